@@ -4,13 +4,56 @@ import os
 import json
 import shutil
 import argparse
-
-def run_script(script_name, json_file):
+from datetime import datetime
+from utilities.pipeline_utils import (
+    PIPELINE_STAGES, create_run_context, create_context_from_submission, run_pipeline_graph,
+    run_batch_pipeline, load_batch_submissions
+)
+from utilities.checkpoint_utils import find_latest_resumable_record
+from utilities.ollama_utils import install_and_setup_ollama, stop_ollama_service
+from utilities.progress_utils import emit_progress_event, inherit_event_channel_kwargs, STAGE_START, STAGE_END, ERROR
+from utilities.trace_utils import span, subprocess_env, export_chrome_trace
+from utilities.pet_catalog_utils import RUN_ID_ENV, get_pet
+from GLOBAL_VARIABLES import (
+    MODEL_ROUTES, BATCH_LLM_CONCURRENCY, BATCH_TRAINING_CONCURRENCY, BATCH_PREDICTION_CONCURRENCY
+)
+
+def run_script(script_name, json_file, run_id=None):
+    emit_progress_event(STAGE_START, stage=script_name)
     try:
-        result = subprocess.run([sys.executable, script_name, json_file], check=True)
+        with span(script_name, category="stage"):
+            # The child's spans join this run's trace under the stage span, and it finds the pet by run ID
+            env = subprocess_env()
+            if run_id:
+                env[RUN_ID_ENV] = run_id
+            result = subprocess.run([sys.executable, script_name, json_file], check=True,
+                                    env=env, **inherit_event_channel_kwargs())
         print(f"[INFO] Successfully ran {script_name} with {json_file}")
+        emit_progress_event(STAGE_END, stage=script_name, status="succeeded")
     except subprocess.CalledProcessError as e:
         print(f"[ERROR] An error occurred while running {script_name}: {e}")
+        emit_progress_event(ERROR, stage=script_name, message=str(e))
+        emit_progress_event(STAGE_END, stage=script_name, status="failed")
+        sys.exit(1)
+
+def run_pipeline(json_file, context, use_subprocess=False):
+    """Run every stage, either in this interpreter following the task graph or one interpreter per stage."""
+    if use_subprocess:
+        try:
+            with span("pipeline", category="pipeline"):
+                for script_name in PIPELINE_STAGES:
+                    print(f"[INFO] Running {script_name}...\n")
+                    run_script(script_name, json_file or "", context["run_id"])
+        finally:
+            print(f"[INFO] Trace written to {export_chrome_trace()}")
+        return
+
+    print("[INFO] Running the pipeline in-process. LoRA training starts as soon as the pet identity is known.\n")
+    try:
+        run_pipeline_graph(context)
+        print("[INFO] Successfully ran all pipeline tasks in-process")
+    except Exception as e:
+        print(f"[ERROR] An error occurred while running the pipeline: {e}")
         sys.exit(1)
 
 def update_global_variables(pet_description, google_drive_link):
@@ -35,7 +78,16 @@ def update_global_variables(pet_description, google_drive_link):
 
     print("[INFO] Updated GLOBAL_VARIABLES.py with the new pet description and Google Drive link.")
 
-def main(json_file=None):
+def resume_from_record(context, json_filepath):
+    """Point the run context at the pet record of a previous, unfinished attempt."""
+    if json_filepath and os.path.exists(json_filepath):
+        print(f"[INFO] Resuming from pet record: {json_filepath}")
+        context["json_filepath"] = json_filepath
+        context["pet_dir_path"] = os.path.dirname(json_filepath)
+    else:
+        print("[INFO] No previous pet record found to resume. Starting from the beginning.")
+
+def main(json_file=None, use_subprocess=False, resume=False):
     if json_file:
         # Check if running within app.py context
         is_app_context = os.getenv('APP_CONTEXT', 'false').lower() == 'true'
@@ -51,29 +103,26 @@ def main(json_file=None):
 
         pet_description = data.get('PET_DESCRIPTION', "")
         gdrive_link = data.get('zip_of_images_via_gdrive', "")
-        update_global_variables(pet_description, gdrive_link)
+
+        # Subprocess stages only see the submission through GLOBAL_VARIABLES.py
+        if use_subprocess:
+            update_global_variables(pet_description, gdrive_link)
 
         # Log the Google Drive link if present
         if 'zip_of_images_via_gdrive' in data:
             print(f"[INFO] Google Drive link for zip file: {data['zip_of_images_via_gdrive']}")
 
-        # Run the first script
-        print("[INFO] Running 1_gather_pet_data.py...\n")
-        run_script("1_gather_pet_data.py", json_file)
+        # Jobs queued by app.py carry their own staging directories
+        context = create_context_from_submission(data, submission_file=json_file_path, resume=resume)
+        if resume:
+            resume_from_record(context, context["json_filepath"])
+        run_pipeline(json_file, context, use_subprocess)
 
-        # Run the second script
-        print("[INFO] Running 2_train_a_lora.py...\n")
-        run_script("2_train_a_lora.py", json_file)
-
-        # Run the third script
-        print("[INFO] Running 3_create_images_of_pet.py...\n")
-        run_script("3_create_images_of_pet.py", json_file)
-
-        # Move the JSON file to the pet directory folder and rename it to config.json
+        # Move the JSON file into this run's own pet directory and rename it to config.json.
+        # Subprocess stages do not fill in the context, so the catalog knows where the pet went.
         try:
-            pet_directory = data['PET_DESCRIPTION'].split()[0].lower()  # Use the first word of the pet description as the directory name
-            safe_pet_directory = ''.join(e for e in pet_directory if e.isalnum() or e == "_")
-            target_directory = os.path.join("pet_directory", safe_pet_directory)
+            pet = get_pet(context["run_id"])
+            target_directory = context["pet_dir_path"] or (pet["pet_dir"] if pet else os.path.join("pet_directory", context["run_id"]))
             os.makedirs(target_directory, exist_ok=True)
             shutil.move(json_file_path, os.path.join(target_directory, "config.json"))
             print(f"[INFO] Moved {json_file_path} to {target_directory}/config.json")
@@ -85,20 +134,69 @@ def main(json_file=None):
         
     else:
         # Default operation if no JSON file is provided
-        print("[INFO] Running 1_gather_pet_data.py without JSON file...\n")
-        run_script("1_gather_pet_data.py", "")
+        print("[INFO] Running the pipeline without JSON file...\n")
+        context = create_run_context(resume=resume)
+        if resume:
+            resume_from_record(context, find_latest_resumable_record([os.path.splitext(s)[0] for s in PIPELINE_STAGES]))
+        run_pipeline(None, context, use_subprocess)
 
-        print("[INFO] Running 2_train_a_lora.py without JSON file...\n")
-        run_script("2_train_a_lora.py", "")
+        print("#### GENERATION COMPLETED! ####")
 
-        print("[INFO] Running 3_create_images_of_pet.py without JSON file...\n")
-        run_script("3_create_images_of_pet.py", "")
+def run_batch(batch_path, resume=False):
+    """Run many pets through one task graph and write a throughput report to batch_reports/."""
+    submissions = load_batch_submissions(batch_path)
+    if not submissions:
+        print(f"[ERROR] No submissions found in {batch_path}")
+        sys.exit(1)
 
-        print("#### GENERATION COMPLETED! ####")
+    contexts = []
+    for data, submission_file in submissions:
+        if not data.get('zip_uploads_dir') and not data.get('zip_of_images_via_gdrive'):
+            # Without their own staging directory, pets would share zip_uploads/ and pick up each other's images
+            print(f"[WARNING] {submission_file or data.get('PET_DESCRIPTION', '')[:40]} has no zip_uploads_dir or Google Drive link.")
+        # Every pet in the batch uses the one Ollama server started below
+        contexts.append(create_context_from_submission(data, submission_file=submission_file, resume=resume, shared_ollama=True))
+
+    resource_limits = {
+        "llm": BATCH_LLM_CONCURRENCY,
+        "training": BATCH_TRAINING_CONCURRENCY,
+        "prediction": BATCH_PREDICTION_CONCURRENCY,
+    }
+    print(f"[INFO] Running a batch of {len(contexts)} pets with resource limits {resource_limits}\n")
+    install_and_setup_ollama(list(MODEL_ROUTES.values()))
+    try:
+        report = run_batch_pipeline(contexts, resource_limits)
+    finally:
+        stop_ollama_service()
+
+    os.makedirs("batch_reports", exist_ok=True)
+    report_file = os.path.join("batch_reports", f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for pet in report["pets"]:
+        status = "OK" if pet["succeeded"] else f"FAILED ({', '.join(pet['failed_tasks'] + pet['skipped_tasks'])})"
+        print(f"[INFO] {pet['submission']}: {status} in {pet['duration_seconds']} seconds")
+    print(f"[INFO] {report['pets_succeeded']}/{report['pets_total']} pets in {report['total_seconds']} seconds "
+          f"({report['pets_per_hour']} pets/hour)")
+    print(f"[INFO] Batch report saved to {report_file}")
+    print("#### BATCH COMPLETED! ####")
+    if report["pets_succeeded"] < report["pets_total"]:
+        sys.exit(1)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run all scripts to generate pet images.")
     parser.add_argument("json_file", nargs='?', default=None, help="Path to the JSON file with pet description.")
+    parser.add_argument("--subprocess", action="store_true", help="Run each stage in its own Python interpreter instead of in-process.")
+    parser.add_argument("--resume", action="store_true", help="Skip stages and steps that already completed with the same inputs.")
+    parser.add_argument("--batch", metavar="PATH", help="Run many pets from a directory of submission JSON files or a JSONL file.")
 
     args = parser.parse_args()
-    main(args.json_file)
\ No newline at end of file
+    if args.resume and args.subprocess:
+        parser.error("--resume needs the in-process runner and cannot be combined with --subprocess.")
+    if args.batch and (args.subprocess or args.json_file):
+        parser.error("--batch cannot be combined with --subprocess or a single JSON file.")
+    if args.batch:
+        run_batch(args.batch, resume=args.resume)
+    else:
+        main(args.json_file, use_subprocess=args.subprocess, resume=args.resume)
\ No newline at end of file
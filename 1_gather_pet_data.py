@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 import re
 import time
 import shutil
@@ -7,15 +8,37 @@ from datetime import datetime
 from GLOBAL_VARIABLES import *
 from utilities.ollama_utils import (
     install_and_setup_ollama,
-    kill_existing_ollama_service,
     clear_gpu_memory,
     stop_ollama_service,
-    get_story_response_from_model
+    get_structured_response_from_model,
+    run_concurrent_chats,
+    track_llm_usage,
+    get_endpoint_pool
 )
 from utilities.replicate_utils import get_replicate_default_values
 from utilities.file_zip_utils import zip_files, move_zip_file_to_pet_directory
+from utilities.image_preprocess_utils import preprocess_images
+from utilities.image_curation_utils import curate_images
+from utilities.listing_utils import parse_shelter_listing
+from utilities.llm_cache_utils import track_cache_stats, get_cache_stats
+from utilities.pet_record_utils import read_pet_record, PetRecord
+from utilities.pet_catalog_utils import get_run_id, register_pet, register_artifact
+from utilities.pipeline_utils import create_run_context
+from utilities.progress_utils import emit_progress_event, ARTIFACT
+from utilities.checkpoint_utils import (
+    hash_inputs,
+    get_checkpoint,
+    is_stage_complete,
+    mark_stage_started,
+    mark_stage_complete,
+    is_step_complete,
+    mark_step_complete
+)
 
+STAGE_NAME = "1_gather_pet_data"
 MODEL_NAME = GLOBAL_MODEL_NAME
+# Every model the routes use, pulled and kept loaded together
+ROUTED_MODELS = list(dict.fromkeys(MODEL_ROUTES.values()))
 NUMBER_OF_FACTS = NUMBER_OF_FACTS
 PET_DESCRIPTION = PET_DESCRIPTION.strip()
 
@@ -25,6 +48,49 @@ STORYLINE_TEMPLATE = (
     "The story should make the pet appealing to potential adopters."
 )
 
+# GATHER_SESSION_MODE: the description travels as this system message and the questions refer to it
+PET_SESSION_TEMPLATE = (
+    "You answer questions about a pet that needs adopting. This is the pet's adoption listing:\n\n{pet_description}"
+)
+PET_SESSION_REFERENCE = "the adoption listing in the system message"
+
+# Generation limits per question: an output budget (num_predict), where the answer ends (stop) and how
+# creative it may be. Short answers stop long before a rambling model would.
+GENERATION_OPTIONS = {
+    "species": {"num_predict": 8, "stop": ["\n", ".", ","], "temperature": 0},
+    "detail": {"num_predict": 64, "stop": ["\n\n"], "temperature": 0},
+    "structured_details": {"num_predict": 512, "temperature": 0},
+    "prompt_base": {"num_predict": 128, "stop": ["\n\n"], "temperature": 0.7},
+    "image_prompt": {"num_predict": 80, "stop": ["\n\n"], "temperature": 0.7},
+    "signage": {"num_predict": 16, "stop": ["\n"], "temperature": 0.7},
+    "fact": {"num_predict": 96, "stop": ["\n\n"], "temperature": 0.8},
+    "facts": {"num_predict": 640, "temperature": 0.8},
+    "storyline": {"num_predict": 768, "temperature": 0.8},
+}
+# Context sizes num_ctx is rounded up to; changing a model's num_ctx reloads it, so only a few sizes are used
+CONTEXT_SIZES = (2048, 4096, 8192, 16384)
+
+# Record key -> the detail asked for; the per-field prompts and the JSON schema are built from it
+PET_DETAIL_FIELDS = {
+    "name": "name of the pet",
+    "type": "species of pet",
+    "pet_ID": "pet ID",
+    "gender": "gender of the pet",
+    "age": "age of the pet",
+    "breed": "breed of the pet",
+    "size": "size of the pet",
+    "location": "location of the pet",
+    "behavioral_characteristics": "behavioral characteristics of the pet",
+    "additional_details_about_the_pet": "additional details about the pet",
+}
+PET_SPECIES = ["dog", "cat", "bird", "reptile", "fish", "rodent"]
+# Structured calls per extraction; fields still missing afterwards are asked for one by one
+STRUCTURED_EXTRACTION_ATTEMPTS = 2
+# FACTS_MODE "single_call": calls for the facts (and their replacements) before falling back to the chain,
+# and the word-pair overlap (Jaccard) at which two facts count as the same fact
+FACT_GENERATION_ATTEMPTS = 2
+FACT_SIMILARITY_THRESHOLD = 0.5
+
 base_output_dir = "pet_directory"
 temp_uploads_dir = os.path.join("temp", "temp_uploads")
 
@@ -46,12 +112,42 @@ def move_uploaded_files(new_directory_path):
 def sanitize_name(name):
     return re.sub(r'[\W_]+', '_', name).lower()
 
-def get_response_from_model(model_name, prompt):
-    start_time = time.time()
-    response = get_story_response_from_model(model_name, prompt)
-    end_time = time.time()
-    response_time = end_time - start_time
-    return response.strip(), response_time
+def model_for_task(task):
+    """The model MODEL_ROUTES assigns to a kind of question (classification, short_extraction, ...)."""
+    return MODEL_ROUTES.get(task) or MODEL_NAME
+
+def generation_options(question, prompt):
+    """GENERATION_OPTIONS of a question, with num_ctx just large enough for the prompt plus the answer."""
+    options = dict(GENERATION_OPTIONS[question])
+    # About four characters per token in English; a third is a safe margin
+    needed_tokens = len(prompt) // 3 + options.get("num_predict", 512) + 64
+    options["num_ctx"] = next((size for size in CONTEXT_SIZES if size >= needed_tokens), CONTEXT_SIZES[-1])
+    return options
+
+async def get_response_from_model(chat, task, question, prompt, cache=True):
+    options = generation_options(question, prompt)
+    # Sampled answers (prompt base, image prompts, signage) should come out new on every run
+    cache = cache and options.get("temperature") == 0
+    response, response_time = await chat(model_for_task(task), prompt, cache=cache, route=task, options=options)
+    return (response or "").strip(), response_time
+
+def session_question(prompt, pet_description):
+    """Move the description out of a prompt into the shared system prefix when GATHER_SESSION_MODE is on.
+
+    Every question then starts with the same tokens, which the server keeps evaluated between requests.
+    Returns (prompt, system).
+    """
+    if not GATHER_SESSION_MODE or pet_description not in prompt:
+        return prompt, None
+    system = PET_SESSION_TEMPLATE.format(pet_description=pet_description)
+    return prompt.replace(pet_description, PET_SESSION_REFERENCE), system
+
+def with_pet_session(chat, pet_description):
+    """Wrap a run_concurrent_chats chat so every question about this pet goes through session_question."""
+    async def session_chat(model_name, user_message, cache=True, **kwargs):
+        user_message, system = session_question(user_message, pet_description)
+        return await chat(model_name, user_message, cache=cache, system=system, **kwargs)
+    return session_chat
 
 def clean_response(response):
     patterns = [
@@ -66,8 +162,10 @@ def clean_response(response):
         response = re.sub(pattern, "", response)
     return response.strip()
 
-def extract_pet_detail(model_name, pet_description, detail_type):
+async def extract_pet_detail(chat, pet_description, detail_type):
+    task, question = "short_extraction", "detail"
     if detail_type == "species of pet":
+        task, question = "classification", "species"
         detail_type_specific_prompt = (
             "Based on the following pet description, respond with the general species (like dog, cat, bird) "
             "and avoid specific breeds or types. Only respond with one word from this set: dog, cat, bird, reptile, fish, rodent."
@@ -77,7 +175,7 @@ def extract_pet_detail(model_name, pet_description, detail_type):
 
     print(f"[INFO] Extracting {detail_type}...")
     prompt = f"{detail_type_specific_prompt}: {pet_description}"
-    response, response_time = get_response_from_model(model_name, prompt)
+    response, response_time = await get_response_from_model(chat, task, question, prompt)
     if not response:
         response = "unsure"
     print(f"Full JSON response: {response}")
@@ -85,253 +183,590 @@ def extract_pet_detail(model_name, pet_description, detail_type):
     print(f"[INFO] Extracted {detail_type}: {detail}")
     return detail, response_time
 
-def create_storyline(model_name, pet_description):
+def build_pet_details_schema(fields):
+    """JSON schema of an object holding the given detail fields as strings."""
+    properties = {}
+    for key in fields:
+        if key == "type":
+            properties[key] = {"type": "string", "enum": PET_SPECIES, "description": "general species of the pet"}
+        else:
+            properties[key] = {"type": "string", "description": PET_DETAIL_FIELDS[key]}
+    return {"type": "object", "properties": properties, "required": list(fields)}
+
+def validate_pet_details(response, fields):
+    """Return the fields of a structured response that are usable, cleaned like per-field answers."""
+    if not isinstance(response, dict):
+        return {}
+    details = {}
+    for key in fields:
+        value = response.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        elif isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        if not isinstance(value, str):
+            continue
+        value = clean_response(value)
+        if key == "type":
+            value = value.lower()
+            if value not in PET_SPECIES:
+                continue
+        if value:
+            details[key] = value
+    return details
+
+def extract_pet_details_structured(pet_description, fields):
+    """Ask for all fields as one JSON object, re-asking only for the fields that came back missing or invalid."""
+    details = {}
+    response_time = 0
+    missing = list(fields)
+    for attempt in range(STRUCTURED_EXTRACTION_ATTEMPTS):
+        print(f"[INFO] Extracting {', '.join(missing)} in one structured call...")
+        field_list = "; ".join(f'"{key}": the {PET_DETAIL_FIELDS[key]}' for key in missing)
+        prompt = (
+            f"Extract these details from the following pet description and respond with a JSON object "
+            f"with exactly these keys: {field_list}. The species must be one of: {', '.join(PET_SPECIES)}. "
+            f"Use short plain text values and \"unsure\" when the description does not say: {pet_description}"
+        )
+        prompt, system = session_question(prompt, pet_description)
+        start_time = time.time()
+        options = generation_options("structured_details", prompt + (system or ""))
+        response = get_structured_response_from_model(model_for_task("short_extraction"), prompt, build_pet_details_schema(missing),
+                                                      system=system, route="short_extraction", options=options)
+        response_time += time.time() - start_time
+        print(f"Full JSON response: {response}")
+        details.update(validate_pet_details(response, missing))
+        missing = [key for key in fields if key not in details]
+        if not missing:
+            break
+        print(f"[WARNING] Missing or invalid details after attempt {attempt + 1}: {', '.join(missing)}")
+    return details, response_time
+
+def extract_pet_details(pet_description, fields, response_times, on_detail=None):
+    """Extract the given detail fields, in one structured call or one question per field (EXTRACTION_MODE).
+
+    Fields labelled in a shelter-site listing are read directly and never reach the model. Fields the
+    structured call cannot fill fall back to the per-field prompts. on_detail(key, value) is called for
+    every detail as it becomes known.
+    """
+    details = validate_pet_details(parse_shelter_listing(pet_description), fields)
+    for key, value in details.items():
+        print(f"[INFO] Parsed {PET_DETAIL_FIELDS[key]} from the listing: {value}")
+        if on_detail:
+            on_detail(key, value)
+
+    remaining = [key for key in fields if key not in details]
+    if EXTRACTION_MODE == "structured" and remaining:
+        structured_details, response_time = extract_pet_details_structured(pet_description, remaining)
+        response_times["structured_details"] = response_times.get("structured_details", 0) + response_time
+        for key, value in structured_details.items():
+            print(f"[INFO] Extracted {PET_DETAIL_FIELDS[key]}: {value}")
+            details[key] = value
+            if on_detail:
+                on_detail(key, value)
+
+    # The per-field questions are independent, so they are asked concurrently
+    remaining = [key for key in fields if key not in details]
+    answers = run_concurrent_chats(lambda chat: [
+        extract_pet_detail(with_pet_session(chat, pet_description), pet_description, PET_DETAIL_FIELDS[key])
+        for key in remaining
+    ]) if remaining else []
+    for key, (detail_value, response_time) in zip(remaining, answers):
+        if not detail_value:
+            detail_value = "unsure"
+        response_times[key] = response_time
+        details[key] = detail_value
+        if on_detail:
+            on_detail(key, detail_value)
+    return {key: details[key] for key in fields if key in details}
+
+async def create_storyline(chat, pet_description):
     print("[INFO] Creating storyline...")
     storyline_prompt = STORYLINE_TEMPLATE.format(pet_description=pet_description) + " Respond with only the storyline."
-    storyline, response_time = get_response_from_model(model_name, storyline_prompt)
+    # The storyline and the facts should be new each run, so they bypass the response cache
+    storyline, response_time = await get_response_from_model(chat, "long_creative", "storyline", storyline_prompt, cache=False)
     if not storyline:
         storyline = "unsure"
     storyline_cleaned = clean_response(storyline)
     print("[INFO] Storyline created.")
     return storyline_cleaned, response_time
 
-def extract_encouraging_facts(model_name, pet_description, number_of_facts):
-    facts = {}
+async def extract_encouraging_facts(chat, pet_description, number_of_facts, existing_facts=None, on_fact=None):
+    facts = dict(existing_facts or {})
     previous_facts = ""
     for i in range(1, number_of_facts + 1):
+        if f"fact_{i}" in facts:
+            previous_facts += f" Fact {i}: {facts[f'fact_{i}']['fact']}."
+            continue
         print(f"[INFO] Generating encouraging fact {i}...")
         prompt = (
             f"Based on the following pet description and the previous facts {previous_facts}, "
             f"provide a new, unique, and encouraging fact number {i} about the pet to promote adoption. "
             f"Respond with only the fact and no additional words: {pet_description}"
         )
-        fact, response_time = get_response_from_model(model_name, prompt)
+        fact, response_time = await get_response_from_model(chat, "long_creative", "fact", prompt, cache=False)
         if not fact:
             fact = "unsure"
         cleaned_fact = clean_response(fact)
         print(f"Full JSON response: {fact}")
         facts[f"fact_{i}"] = {"fact": cleaned_fact, "response_time": response_time}
+        if on_fact:
+            on_fact(f"fact_{i}", facts[f"fact_{i}"])
         print(f"[INFO] Encouraging fact {i}: {cleaned_fact}")
         if fact == "N/A" or not cleaned_fact:
             break
         previous_facts += f" Fact {i}: {cleaned_fact}."
     return facts
 
-def generate_signage_prompt(model_name, fact):
+def fact_shingles(text):
+    """The word pairs of a fact, the unit fact_similarity compares."""
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    if len(words) < 2:
+        return {tuple(words)}
+    return {tuple(words[i:i + 2]) for i in range(len(words) - 1)}
+
+def fact_similarity(fact_a, fact_b):
+    """Jaccard overlap of the word pairs of two facts: 1.0 for the same wording, near 0 for unrelated facts."""
+    shingles_a, shingles_b = fact_shingles(fact_a), fact_shingles(fact_b)
+    union = shingles_a | shingles_b
+    return len(shingles_a & shingles_b) / len(union) if union else 1.0
+
+async def generate_facts_single_call(chat, pet_description, number_of_facts, existing_facts=None, on_fact=None):
+    """Ask for all missing facts in one structured answer, drop near-duplicates and ask only for replacements.
+
+    Facts still missing after FACT_GENERATION_ATTEMPTS calls are generated one by one by
+    extract_encouraging_facts.
+    """
+    facts = dict(existing_facts or {})
+    for attempt in range(FACT_GENERATION_ATTEMPTS):
+        needed = number_of_facts - len(facts)
+        if needed <= 0:
+            break
+        kept = [facts[f"fact_{i}"]["fact"] for i in range(1, len(facts) + 1)]
+        print(f"[INFO] Generating {needed} encouraging facts in one call...")
+        avoid = f" They must be about different things than these facts: {' '.join(kept)}" if kept else ""
+        prompt = (
+            f"Based on the following pet description, provide {needed} new, unique, and encouraging facts about the pet "
+            f"to promote adoption, each about a different aspect of the pet.{avoid} Respond with a JSON object whose "
+            f"\"facts\" list holds only the facts, one short sentence each: {pet_description}"
+        )
+        schema = {
+            "type": "object",
+            "properties": {"facts": {"type": "array", "items": {"type": "string"}, "minItems": needed, "maxItems": needed}},
+            "required": ["facts"],
+        }
+        # Creative, like the chained facts, so the cache is bypassed
+        response, response_time = await chat(model_for_task("long_creative"), prompt, cache=False, output_format=schema,
+                                             route="long_creative", options=generation_options("facts", prompt))
+        try:
+            candidates = json.loads(response or "")["facts"]
+        except (ValueError, KeyError, TypeError):
+            print(f"[WARNING] The facts answer was not the expected JSON: {response}")
+            continue
+        print(f"Full JSON response: {response}")
+        for candidate in candidates if isinstance(candidates, list) else []:
+            cleaned_fact = clean_response(str(candidate))
+            if not cleaned_fact or cleaned_fact == "N/A":
+                continue
+            duplicate_of = next((fact for fact in kept if fact_similarity(cleaned_fact, fact) >= FACT_SIMILARITY_THRESHOLD), None)
+            if duplicate_of:
+                print(f"[INFO] Dropping a near-duplicate fact: {cleaned_fact}")
+                continue
+            fact_key = f"fact_{len(facts) + 1}"
+            facts[fact_key] = {"fact": cleaned_fact, "response_time": response_time}
+            kept.append(cleaned_fact)
+            if on_fact:
+                on_fact(fact_key, facts[fact_key])
+            print(f"[INFO] Encouraging fact {len(facts)}: {cleaned_fact}")
+            if len(facts) == number_of_facts:
+                break
+
+    if len(facts) < number_of_facts:
+        print(f"[INFO] {number_of_facts - len(facts)} fact(s) still missing. Generating them one by one...")
+        facts = await extract_encouraging_facts(chat, pet_description, number_of_facts, facts, on_fact=on_fact)
+    return facts
+
+async def generate_signage_prompt(chat, fact):
     print(f"[INFO] Generating signage prompt for the fact: {fact}...")
     prompt = f"Give a 3 or 4 word max description of this scene: {fact}. Respond with only the signage text."
-    signage, response_time = get_response_from_model(model_name, prompt)
+    signage, response_time = await get_response_from_model(chat, "short_creative", "signage", prompt)
     if not signage:
         signage = "unsure"
     cleaned_signage = clean_response(signage)
     print(f"[INFO] Signage prompt: {cleaned_signage}")
     return cleaned_signage, response_time
 
-def write_to_json(filepath, data):
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=2)
-    print(f"[INFO] Updated JSON file: {filepath}")
+def summarize_llm_usage(usage):
+    """Token counts and per-route latency of the stage, rounded for the pet record."""
+    summary = {key: round(value, 2) for key, value in usage.items() if key != "routes"}
+    summary["routes"] = {
+        route: dict(route_usage, seconds=round(route_usage["seconds"], 2),
+                    average_seconds=round(route_usage["seconds"] / route_usage["requests"], 2))
+        for route, route_usage in usage.get("routes", {}).items()
+    }
+    return summary
+
+def write_to_json(record, data):
+    # Merge instead of overwrite: 2_train_a_lora.py may be writing the same record concurrently
+    record.update(data)
 
 def generate_unique_trigger_word(pet_name, pet_species):
     trigger_word = f"{pet_species}_{pet_name}".lower().replace('o', '0').replace('e', '3').replace('i', '1')
     print(f"[INFO] Generated unique TRIGGER_WORD: {trigger_word}")
     return trigger_word
 
-def generate_prompt_base(model_name, pet_description, pet_breed, pet_age, pet_size):
+async def generate_prompt_base(chat, pet_description, pet_breed, pet_age, pet_size):
     prompt_request = (
         f"Provide a concise visual description for an image prompt of a pet with these characteristics: "
         f"breed: {pet_breed}, age: {pet_age}, size: {pet_size}, details: {pet_description}. "
         f"Respond only with the description. No introductory text."
     )
-    prompt_response, _ = get_response_from_model(model_name, prompt_request)
+    prompt_response, _ = await get_response_from_model(chat, "short_creative", "prompt_base", prompt_request)
     cleaned_prompt = clean_response(prompt_response)
     return cleaned_prompt
 
-def main():
-    # Kill any existing service before starting
-    kill_existing_ollama_service()
-    clear_gpu_memory()
-    
-    # Install and setup the Ollama model
-    install_and_setup_ollama(MODEL_NAME)
-    print("[INFO] Setting up the Ollama model. Please wait...")
-
-    start_time = time.time()
-    print("[INFO] Starting the pet details extraction process...")
+async def create_image_prompt(chat, fact, trigger_word, pet_type, index):
+    """Turn one fact into its image prompt and signage; returns the record keys of image index."""
+    cleaned_fact = clean_response(fact)
 
-    response_times = {}
-    initial_data = {}
+    prompt_request = f"Create an image prompt in 200 characters or less that accentuates the following activity: '{cleaned_fact}'. Respond with only the prompt and no additional words."
+    prompt_response, prompt_response_time = await get_response_from_model(chat, "short_creative", "image_prompt", prompt_request)
+    if not prompt_response:
+        prompt_response = "unsure"
+    cleaned_prompt = clean_response(prompt_response)
 
-    # Extract pet details
-    pet_name, name_response_time = extract_pet_detail(MODEL_NAME, PET_DESCRIPTION, "name of the pet")
-    pet_type, type_response_time = extract_pet_detail(MODEL_NAME, PET_DESCRIPTION, "species of pet")
-
-    response_times["name"] = name_response_time
-    response_times["type"] = type_response_time
-
-    initial_data["name"] = pet_name
-    initial_data["type"] = pet_type
-
-    sanitized_type = sanitize_name(pet_type)
-    sanitized_name = sanitize_name(pet_name)
-
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    pet_dir_name = f"{timestamp}_{sanitized_type}_{sanitized_name}"
-    pet_dir_path = os.path.join(base_output_dir, pet_dir_name)
-    if not os.path.exists(pet_dir_path):
-        print(f"[INFO] Creating directory: {pet_dir_path}")
-        os.makedirs(pet_dir_path)
-
-    json_filename = f"{pet_dir_name}.json"
-    json_filepath = os.path.join(pet_dir_path, json_filename)
-
-    replicate_values = get_replicate_default_values()
-    initial_data["replicate_configs"] = replicate_values
-
-    # Generate unique TRIGGER_WORD
-    print("[INFO] Generating unique TRIGGER_WORD...")
-    unique_trigger_word = generate_unique_trigger_word(sanitized_name, sanitized_type)
-    initial_data["replicate_configs"]["TRIGGER_WORD"] = unique_trigger_word
-
-    # Generate custom PROMPT_BASE
-    pet_breed = initial_data.get("breed", "unknown breed")
-    pet_age = initial_data.get("age", "unknown age")
-    pet_size = initial_data.get("size", "unknown size")
-
-    print("[INFO] Generating custom PROMPT_BASE...")
-    custom_prompt_base = generate_prompt_base(MODEL_NAME, PET_DESCRIPTION, pet_breed, pet_age, pet_size)
-    initial_data["replicate_configs"]["PROMPT_BASE"] = custom_prompt_base
-
-    # Add TRAINING_CONFIGS to initial data
-    initial_data["TRAINING_CONFIGS"] = {
-        "STEPS": STEPS,
-        "LORA_RANK": LORA_RANK,
-        "OPTIMIZER": OPTIMIZER,
-        "BATCH_SIZE": BATCH_SIZE,
-        "RESOLUTION": RESOLUTION,
-        "AUTOCAPTION": AUTOCAPTION,
-        "LEARNING_RATE": LEARNING_RATE,
-        "DESCRIPTION": DESCRIPTION,
-        "USE_CAPTIONS": USE_CAPTIONS,
-        "HARDWARE": HARDWARE,
-        "MAX_RETRIES": MAX_RETRIES,
-        "RETRY_DELAY": RETRY_DELAY,
-        "MODEL_VERSION": MODEL_VERSION,
-        "MODE": MODE,
-        "VISIBILITY": VISIBILITY,
-    }
+    signage_prompt, signage_response_time = await generate_signage_prompt(chat, cleaned_prompt)
 
-    # Write initial data to JSON
-    write_to_json(json_filepath, initial_data)
-
-    # Additional details
-    details = [
-        "pet ID",
-        "gender of the pet",
-        "age of the pet",
-        "breed of the pet",
-        "size of the pet",
-        "location of the pet",
-        "behavioral characteristics of the pet",
-        "additional details about the pet"
-    ]
+    # Adjusting how full_prompt is constructed
+    full_prompt = f"a signage that says: {signage_prompt} {trigger_word} {pet_type} {cleaned_prompt}"
 
-    # Extract each detail and update JSON
-    for detail in details:
-        detail_key = detail.replace(" of the pet", "").replace(" ", "_")
-        detail_value, response_time = extract_pet_detail(MODEL_NAME, PET_DESCRIPTION, detail)
-        if not detail_value:
-            detail_value = "unsure"
-        response_times[detail_key] = response_time
-        initial_data[detail_key] = detail_value
-        write_to_json(json_filepath, initial_data)
+    # Sanitize full_prompt to remove any forward or backslashes
+    full_prompt = full_prompt.replace("\\", "").replace("/", "")
 
-    print("[INFO] All pet details extracted. Now creating the storyline...")
+    return {
+        f"IMAGE_{index}_PROMPT": cleaned_prompt,
+        f"IMAGE_{index}_PROMPT_response_time": prompt_response_time,
+        f"SIGNAGE_PROMPT_{index}": signage_prompt,
+        f"replicate_full_prompt_image_{index}": full_prompt,
+    }
 
-    storyline, response_time = create_storyline(MODEL_NAME, PET_DESCRIPTION)
-    response_times["storyline"] = response_time
-    initial_data["storyline"] = storyline
-    write_to_json(json_filepath, initial_data)
+def gather_identity(context):
+    """Extract what training needs (name, species, TRIGGER_WORD, image zip) and create the pet record."""
+    pet_description = context.get("pet_description") or PET_DESCRIPTION
+
+    # Queued app jobs and batches share one Ollama server, so only a standalone run may stop it
+    shared_ollama = bool(context.get("shared_ollama"))
+
+    # State handed to gather_details once the identity is known
+    state = context["gather_state"] = {
+        "pet_description": pet_description,
+        "shared_ollama": shared_ollama,
+        "response_times": {},
+        "start_time": time.time(),
+        "stage_hash": hash_inputs(pet_description, MODEL_NAME, NUMBER_OF_FACTS, MODEL_ROUTES),
+        "skip": False,
+        "llm_cache": track_cache_stats(),
+        "llm_usage": track_llm_usage(),
+    }
+    stage_hash = state["stage_hash"]
+    response_times = state["response_times"]
 
-    print("[INFO] Storyline created successfully. Generating encouraging facts...")
+    # With --resume, pick up the pet record of the previous attempt if its inputs are unchanged
+    initial_data = {}
+    json_filepath = context.get("json_filepath") if context.get("resume") else None
+    if json_filepath and os.path.exists(json_filepath):
+        initial_data = read_pet_record(json_filepath)
+        checkpoint = get_checkpoint(initial_data, STAGE_NAME)
+        if is_stage_complete(initial_data, STAGE_NAME, stage_hash):
+            print(f"[INFO] {STAGE_NAME} already completed for {json_filepath}. Skipping.")
+            context["pet_dir_path"] = os.path.dirname(json_filepath)
+            context["pet_data"] = initial_data
+            state["skip"] = True
+            return
+        if not checkpoint or checkpoint.get("input_hash") != stage_hash:
+            print("[INFO] Pet description or settings changed since the last attempt. Starting a new pet record.")
+            initial_data, json_filepath = {}, None
+        else:
+            print(f"[INFO] Resuming {STAGE_NAME} from {json_filepath}")
+    else:
+        json_filepath = None
+    state["initial_data"] = initial_data
 
-    encouraging_facts = extract_encouraging_facts(MODEL_NAME, PET_DESCRIPTION, NUMBER_OF_FACTS)
-    initial_data.update(encouraging_facts)
-    write_to_json(json_filepath, initial_data)
+    clear_gpu_memory()
 
-    # Fetch updated TRIGGER_WORD and PROMPT_BASE from replicate_configs
-    TRIGGER_WORD = initial_data["replicate_configs"]["TRIGGER_WORD"]
-    PROMPT_BASE = initial_data["replicate_configs"]["PROMPT_BASE"]
-    PET_TYPE = initial_data.get("type", "unknown pet").lower()
+    # Install and setup the Ollama model; a warm server from an earlier run is reused
+    install_and_setup_ollama(ROUTED_MODELS)
+    print("[INFO] Setting up the Ollama model. Please wait...")
 
-    # Generate image prompts and update JSON
-    for i in range(1, NUMBER_OF_FACTS + 1):
-        fact_key = f"fact_{i}"
-        if fact_key not in initial_data:
-            break
-        fact = initial_data[fact_key]["fact"]
+    print("[INFO] Starting the pet details extraction process...")
 
-        cleaned_fact = clean_response(fact)
+    if json_filepath is None:
+        # Extract pet details; a structured call gets all of them at the cost of one question
+        identity_fields = list(PET_DETAIL_FIELDS) if EXTRACTION_MODE == "structured" else ["name", "type"]
+        initial_data.update(extract_pet_details(pet_description, identity_fields, response_times))
+        pet_name = initial_data["name"]
+        pet_type = initial_data["type"]
+
+        sanitized_type = sanitize_name(pet_type)
+        sanitized_name = sanitize_name(pet_name)
+
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        pet_dir_name = f"{timestamp}_{sanitized_type}_{sanitized_name}"
+        pet_dir_path = os.path.join(base_output_dir, pet_dir_name)
+        if not os.path.exists(pet_dir_path):
+            print(f"[INFO] Creating directory: {pet_dir_path}")
+            os.makedirs(pet_dir_path)
+
+        json_filename = f"{pet_dir_name}.json"
+        json_filepath = os.path.join(pet_dir_path, json_filename)
+
+        replicate_values = get_replicate_default_values()
+        initial_data["replicate_configs"] = replicate_values
+
+        # Generate unique TRIGGER_WORD
+        print("[INFO] Generating unique TRIGGER_WORD...")
+        unique_trigger_word = generate_unique_trigger_word(sanitized_name, sanitized_type)
+        initial_data["replicate_configs"]["TRIGGER_WORD"] = unique_trigger_word
+
+        # Add TRAINING_CONFIGS to initial data
+        initial_data["TRAINING_CONFIGS"] = {
+            "STEPS": STEPS,
+            "LORA_RANK": LORA_RANK,
+            "OPTIMIZER": OPTIMIZER,
+            "BATCH_SIZE": BATCH_SIZE,
+            "RESOLUTION": RESOLUTION,
+            "AUTOCAPTION": AUTOCAPTION,
+            "LEARNING_RATE": LEARNING_RATE,
+            "DESCRIPTION": DESCRIPTION,
+            "USE_CAPTIONS": USE_CAPTIONS,
+            "HARDWARE": HARDWARE,
+            "MAX_RETRIES": MAX_RETRIES,
+            "RETRY_DELAY": RETRY_DELAY,
+            "MODEL_VERSION": MODEL_VERSION,
+            "MODE": MODE,
+            "VISIBILITY": VISIBILITY,
+        }
+
+        # Write initial data to JSON
+        mark_stage_started(initial_data, STAGE_NAME, stage_hash)
+        record = PetRecord(json_filepath)
+        write_to_json(record, initial_data)
+        print(f"[INFO] Created JSON file: {json_filepath}")
+    else:
+        pet_dir_path = os.path.dirname(json_filepath)
+        record = PetRecord(json_filepath)
+    state["record"] = record
 
-        prompt_request = f"Create an image prompt in 200 characters or less that accentuates the following activity: '{cleaned_fact}'. Respond with only the prompt and no additional words."
-        prompt_response, prompt_response_time = get_response_from_model(MODEL_NAME, prompt_request)
-        if not prompt_response:
-            prompt_response = "unsure"
-        cleaned_prompt = clean_response(prompt_response)
-
-        signage_prompt, signage_response_time = generate_signage_prompt(MODEL_NAME, cleaned_prompt)
-
-        # Adjusting how full_prompt is constructed
-        full_prompt = f"a signage that says: {signage_prompt} {TRIGGER_WORD} {PET_TYPE} {cleaned_prompt}"
-        
-        # Sanitize full_prompt to remove any forward or backslashes
-        full_prompt = full_prompt.replace("\\", "").replace("/", "")
-        
-        initial_data[f"IMAGE_{i}_PROMPT"] = cleaned_prompt
-        initial_data[f"IMAGE_{i}_PROMPT_response_time"] = prompt_response_time
-        initial_data[f"SIGNAGE_PROMPT_{i}"] = signage_prompt
-        initial_data[f"replicate_full_prompt_image_{i}"] = full_prompt
-        
-        # Update JSON with new prompt details
-        write_to_json(json_filepath, initial_data)
+    # Let the runner know where the record lives as soon as it exists, so a failed run can be resumed
+    context["pet_dir_path"] = pet_dir_path
+    context["json_filepath"] = json_filepath
+    register_pet(context.get("run_id"), pet_dir_path, json_filepath, initial_data.get("name"), initial_data.get("type"))
+    emit_progress_event(ARTIFACT, stage=STAGE_NAME, kind="pet_record", path=json_filepath)
 
     # Check and zip files in the zip_uploads directory
-    zip_dir = "zip_uploads"
-    print("[INFO] Checking and zipping files in zip_uploads...")
-    if os.path.exists(zip_dir) and os.listdir(zip_dir):
-        # Zip the files
-        zip_file_path = zip_files(zip_dir, "zip_uploads")
-
-        # Move the zip file to the pet directory
-        new_zip_path = move_zip_file_to_pet_directory(zip_file_path, pet_dir_path)
-        initial_data["user_uploaded_images_zip"] = new_zip_path
-        write_to_json(json_filepath, initial_data)
-    else:
-        initial_data["user_uploaded_images_zip"] = ""  # Set to empty string if no files found
-        print("[INFO] No files found to zip. Setting user_uploaded_images_zip to an empty value.")
+    zip_dir = context.get("zip_uploads_dir") or "zip_uploads"
+    if not is_step_complete(initial_data, STAGE_NAME, "zip_uploads"):
+        print(f"[INFO] Checking and zipping files in {zip_dir}...")
+        if os.path.exists(zip_dir) and os.listdir(zip_dir):
+            images_dir = zip_dir
+            if PREPROCESS_TRAINING_IMAGES:
+                # The trainer never uses more than the largest bucket, so full-size originals only slow the upload
+                images_dir = os.path.join(zip_dir, "preprocessed")
+                largest_bucket = max(int(bucket) for bucket in RESOLUTION.split(","))
+                report = preprocess_images(zip_dir, images_dir, largest_bucket, TRAINING_IMAGE_QUALITY)
+                initial_data["image_preprocessing"] = report
+                print(f"[INFO] Preprocessed {report['images']} images: {report['original_bytes']} -> "
+                      f"{report['output_bytes']} bytes ({report['size_ratio']}x smaller) in {report['seconds']} seconds")
+
+            file_names = None
+            if CURATE_TRAINING_IMAGES:
+                # Rejected photos only stay out of the zip; the uploads themselves are left alone
+                file_names, report = curate_images(images_dir, TRAINING_DUPLICATE_DISTANCE, TRAINING_MIN_SHARPNESS,
+                                                   TRAINING_MAX_IMAGES, TRAINING_MIN_IMAGES)
+                initial_data["image_curation"] = report
+                print(f"[INFO] Curated training images: kept {report['kept']} of {report['images']} "
+                      f"({report['decision_counts']})")
+
+            # Zip the files
+            zip_file_path = zip_files(images_dir, zip_dir, file_names=file_names)
+            if images_dir != zip_dir:
+                shutil.rmtree(images_dir)
+
+            # Move the zip file to the pet directory
+            new_zip_path = move_zip_file_to_pet_directory(zip_file_path, pet_dir_path)
+            initial_data["user_uploaded_images_zip"] = new_zip_path
+            register_artifact(context.get("run_id"), "images_zip", new_zip_path)
+        else:
+            initial_data["user_uploaded_images_zip"] = ""  # Set to empty string if no files found
+            print("[INFO] No files found to zip. Setting user_uploaded_images_zip to an empty value.")
+        mark_step_complete(initial_data, STAGE_NAME, "zip_uploads")
+        write_to_json(record, {
+            "user_uploaded_images_zip": initial_data["user_uploaded_images_zip"],
+            **{key: initial_data[key] for key in ("image_preprocessing", "image_curation") if key in initial_data},
+            "checkpoints": {STAGE_NAME: initial_data["checkpoints"][STAGE_NAME]},
+        })
+
+    print("[INFO] Pet identity ready. Training can start while the remaining details are generated.")
+
+def gather_details(context):
+    """Generate the details, storyline, facts and image prompts of a pet whose record already exists."""
+    state = context["gather_state"]
+    if state["skip"]:
+        return
+
+    pet_description = state["pet_description"]
+    response_times = state["response_times"]
+    stage_hash = state["stage_hash"]
+    initial_data = state["initial_data"]
+    json_filepath = context["json_filepath"]
+    record = state["record"]
+    track_cache_stats(state["llm_cache"])
+    track_llm_usage(state["llm_usage"])
+
+    # Only write the keys this stage changed; the training stage owns the rest of the record
+    def save_keys(*keys):
+        updates = {key: initial_data[key] for key in keys}
+        updates["checkpoints"] = {STAGE_NAME: initial_data["checkpoints"][STAGE_NAME]}
+        write_to_json(record, updates)
+
+    # Details not extracted with the identity (per-field mode, or a resumed record); PROMPT_BASE uses them
+    def save_detail(detail_key, detail_value):
+        initial_data[detail_key] = detail_value
+        save_keys(detail_key)
 
-    end_time = time.time()
-    total_time_taken = end_time - start_time
+    missing_details = [key for key in PET_DETAIL_FIELDS if key not in initial_data]
+    extract_pet_details(pet_description, missing_details, response_times, on_detail=save_detail)
 
-    initial_data["summary"] = {
-        "total_time_taken": round(total_time_taken, 2),
-        "average_response_time_per_question": round(sum(response_times.values()) / len(response_times), 2),
-        "response_times": response_times
-    }
+    TRIGGER_WORD = initial_data["replicate_configs"]["TRIGGER_WORD"]
+    PET_TYPE = initial_data.get("type", "unknown pet").lower()
+    existing_facts = {key: value for key, value in initial_data.items() if re.match(r'^fact_\d+$', key)}
+    need_prompt_base = not is_step_complete(initial_data, STAGE_NAME, "prompt_base")
+    need_storyline = "storyline" not in initial_data
+    need_facts = not is_step_complete(initial_data, STAGE_NAME, "encouraging_facts")
+
+    # PROMPT_BASE, the storyline and the fact chain do not depend on each other, so they are asked for
+    # concurrently; each fact's image prompt chain starts as soon as that fact exists
+    async def prompt_base(chat):
+        if not need_prompt_base:
+            return None
+        print("[INFO] Generating custom PROMPT_BASE...")
+        return await generate_prompt_base(
+            chat, pet_description,
+            initial_data.get("breed", "unknown breed"),
+            initial_data.get("age", "unknown age"),
+            initial_data.get("size", "unknown size"),
+        )
 
-    # Final update to JSON
-    write_to_json(json_filepath, initial_data)
+    async def storyline(chat):
+        return await create_storyline(chat, pet_description) if need_storyline else None
+
+    async def facts_and_image_prompts(chat):
+        image_tasks = {}
+
+        def start_image_prompt(fact_key, fact_entry):
+            i = int(fact_key.split("_")[1])
+            if f"replicate_full_prompt_image_{i}" not in initial_data:
+                image_tasks[i] = asyncio.create_task(
+                    create_image_prompt(chat, fact_entry["fact"], TRIGGER_WORD, PET_TYPE, i))
+
+        for i in range(1, NUMBER_OF_FACTS + 1):
+            if f"fact_{i}" not in existing_facts:
+                break
+            start_image_prompt(f"fact_{i}", existing_facts[f"fact_{i}"])
+        facts = existing_facts
+        if need_facts:
+            generate_facts = generate_facts_single_call if FACTS_MODE == "single_call" else extract_encouraging_facts
+            facts = await generate_facts(chat, pet_description, NUMBER_OF_FACTS, existing_facts,
+                                         on_fact=start_image_prompt)
+        image_prompts = {i: await image_tasks[i] for i in sorted(image_tasks)}
+        return facts, image_prompts
+
+    def build_requests(chat):
+        chat = with_pet_session(chat, pet_description)
+        return [prompt_base(chat), storyline(chat), facts_and_image_prompts(chat)]
+
+    custom_prompt_base, storyline_result, (facts, image_prompts) = run_concurrent_chats(build_requests)
+
+    # Save in a fixed order, whatever order the answers arrived in, and write the record once at the end
+    with record.batch():
+        if need_prompt_base:
+            initial_data["replicate_configs"]["PROMPT_BASE"] = custom_prompt_base
+            mark_step_complete(initial_data, STAGE_NAME, "prompt_base")
+            write_to_json(record, {
+                "replicate_configs": {"PROMPT_BASE": custom_prompt_base},
+                "checkpoints": {STAGE_NAME: initial_data["checkpoints"][STAGE_NAME]},
+            })
+
+        if need_storyline:
+            initial_data["storyline"], response_times["storyline"] = storyline_result
+            save_keys("storyline")
+            print("[INFO] Storyline created successfully.")
+        storyline_text = initial_data["storyline"]
+
+        if need_facts:
+            new_fact_keys = sorted((key for key in facts if key not in existing_facts), key=lambda key: int(key.split("_")[1]))
+            for fact_key in new_fact_keys:
+                initial_data[fact_key] = facts[fact_key]
+            mark_step_complete(initial_data, STAGE_NAME, "encouraging_facts")
+            save_keys(*new_fact_keys)
+
+        # All image prompts in one update instead of one per fact
+        image_prompt_keys = []
+        for i, image_prompt in image_prompts.items():
+            initial_data.update(image_prompt)
+            image_prompt_keys.extend(image_prompt)
+        if image_prompt_keys:
+            save_keys(*image_prompt_keys)
+
+        end_time = time.time()
+        total_time_taken = end_time - state["start_time"]
+        average_response_time = sum(response_times.values()) / len(response_times) if response_times else 0
+
+        initial_data["summary"] = {
+            "total_time_taken": round(total_time_taken, 2),
+            "average_response_time_per_question": round(average_response_time, 2),
+            "response_times": response_times,
+            "llm_cache": get_cache_stats(state["llm_cache"]),
+            "llm_usage": summarize_llm_usage(state["llm_usage"]),
+            "llm_endpoints": get_endpoint_pool().stats(),
+        }
+
+        # Final update to JSON
+        mark_stage_complete(initial_data, STAGE_NAME, stage_hash)
+        save_keys("summary")
 
     print(f"[INFO] Generated initial JSON file: {json_filepath}")
-    print(f"[INFO] Here is your storyline:\n{storyline}")
+    print(f"[INFO] Here is your storyline:\n{storyline_text}")
 
     print("[INFO] === SUMMARY ===")
     print(f"[INFO] Total time taken: {total_time_taken:.2f} seconds")
-    print(f"[INFO] Average response time per question: {sum(response_times.values()) / len(response_times):.2f} seconds")
+    print(f"[INFO] Average response time per question: {average_response_time:.2f} seconds")
+    cache_stats = initial_data["summary"]["llm_cache"]
+    print(f"[INFO] LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    usage = initial_data["summary"]["llm_usage"]
+    print(f"[INFO] LLM tokens: {usage['prompt_eval_tokens']} prompt-eval ({usage['prompt_eval_seconds']} s), "
+          f"{usage['eval_tokens']} generated ({usage['eval_seconds']} s) over {usage['requests']} requests, "
+          f"{usage['truncated']} cut off at their token budget")
+    for route, route_usage in usage["routes"].items():
+        print(f"[INFO] Route {route} ({route_usage['model']}): {route_usage['requests']} requests, "
+              f"{route_usage['average_seconds']} s on average, {route_usage['truncated']} truncated")
+    for url, endpoint_stats in initial_data["summary"]["llm_endpoints"].items():
+        print(f"[INFO] Endpoint {url}: {endpoint_stats['requests']} requests, "
+              f"{endpoint_stats['average_seconds']} s on average, error rate {endpoint_stats['error_rate']}")
     print(f"[INFO] JSON file path: {json_filepath}")
 
-    stop_ollama_service()
+    context["pet_data"] = initial_data
+
+    if not state["shared_ollama"]:
+        stop_ollama_service()
     clear_gpu_memory()
 
+def main(context=None):
+    # Standalone runs use the description in GLOBAL_VARIABLES
+    if context is None:
+        context = create_run_context(PET_DESCRIPTION, run_id=get_run_id())
+    gather_identity(context)
+    gather_details(context)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -20,8 +20,21 @@ from utilities.replicate_utils import (
     get_model_versions
 )
 from utilities.fileio_utils import upload_file_to_fileio
+from utilities.pet_record_utils import update_pet_record, append_journal_event
+from utilities.pet_catalog_utils import get_run_id, find_pet
+from utilities.progress_utils import emit_progress_event, ARTIFACT
+from utilities.checkpoint_utils import (
+    hash_inputs,
+    hash_file,
+    get_checkpoint,
+    is_stage_complete,
+    mark_stage_started,
+    mark_stage_complete
+)
 from GLOBAL_VARIABLES import *
 
+STAGE_NAME = "2_train_a_lora"
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -69,37 +82,44 @@ def create_hf_repo(hf_token, repo_id, json_file):
     else:
         print("Skipping Hugging Face repository creation in DEVELOPMENT mode.")
 
+# Log lines that also set a field of the pet record
+MESSAGE_FIELDS = {
+    "Model created:": "REPLICATE_MODEL_LINK",
+    "Model URL:": "REPLICATE_MODEL_URL",
+    "Direct download link generated:": "TRAINING_IMAGES_ZIP_FILE",
+    "Training completed with status:": "REPLICATE_TRAINING_STATUS",
+    "Training ID:": "REPLICATE_TRAINING_ID",
+}
+
 def print_log_and_save(message, json_file, update_configs=False):
-    """Prints the message, then appends it to the JSON file."""
+    """Prints the message and appends it to the pet record's journal.
+
+    The record itself is only rewritten for messages that carry one of its fields.
+    """
     print(message)
-    
-    # Open the JSON file and load existing data
-    if os.path.exists(json_file):
-        with open(json_file, 'r') as file:
-            json_data = json.load(file)
-    else:
-        json_data = {}
-
-    # Append specific relevant information based on message content
-    if "Model created:" in message:
-        json_data["REPLICATE_MODEL_LINK"] = message.split(": ")[1]
-    elif "Model URL:" in message:
-        json_data["REPLICATE_MODEL_URL"] = message.split(": ")[1]
-    elif "Direct download link generated:" in message:
-        json_data["TRAINING_IMAGES_ZIP_FILE"] = message.split(": ")[1]
-    elif "Training completed with status:" in message:
-        json_data["REPLICATE_TRAINING_STATUS"] = message.split(": ")[1]
-    
-    # Update replicate_configs section if needed
-    if update_configs:
-        if "REPLICATE_MODEL_LINK" in json_data and "REPLICATE_MODEL_VERSION" in json_data:
-            model_version_string = f"{REPLICATE_OWNER}/{json_data['REPLICATE_MODEL_LINK']}:{json_data['REPLICATE_MODEL_VERSION']}"
-            if "replicate_configs" in json_data:
-                json_data["replicate_configs"]["MODEL_VERSION"] = model_version_string
-
-    # Save updated data back to JSON file
-    with open(json_file, 'w') as file:
-        json.dump(json_data, file, indent=2)
+    append_journal_event(json_file, message, stage=STAGE_NAME)
+
+    field = next((key for prefix, key in MESSAGE_FIELDS.items() if prefix in message), None)
+    if field is None and not update_configs:
+        return
+
+    def apply_message(json_data):
+        if field is not None:
+            json_data[field] = message.split(": ")[1]
+
+        # Update replicate_configs section if needed
+        if update_configs:
+            if "REPLICATE_MODEL_LINK" in json_data and "REPLICATE_MODEL_VERSION" in json_data:
+                model_version_string = f"{REPLICATE_OWNER}/{json_data['REPLICATE_MODEL_LINK']}:{json_data['REPLICATE_MODEL_VERSION']}"
+                if "replicate_configs" in json_data:
+                    json_data["replicate_configs"]["MODEL_VERSION"] = model_version_string
+
+    # Locked read-modify-write, since 1_gather_pet_data.py may be updating the same record
+    update_pet_record(json_file, updater=apply_message)
+
+def update_json_file(json_file, updater):
+    """Load the JSON file, let updater(data) modify it and write it back."""
+    return update_pet_record(json_file, updater=updater)
 
 def generate_model_name(trigger_word):
     """Generate a unique model name with a timestamp."""
@@ -111,7 +131,7 @@ def generate_hf_repo_name(trigger_word):
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     return f"{trigger_word}_{timestamp}"
 
-def generate_direct_download_link(source, file_path):
+def generate_direct_download_link(source, file_path, fallback_link=GOOGLE_DRIVE_PATH_TO_IMAGES_ZIP):
     """Generate a direct download link based on the source specified."""
     if source == "file_io":
         print("[INFO] Attempting to upload and generate link using file.io...")
@@ -129,28 +149,13 @@ def generate_direct_download_link(source, file_path):
 
     # Google Drive logic as fallback
     print("[INFO] Using Google Drive link.")
-    return GOOGLE_DRIVE_PATH_TO_IMAGES_ZIP
-
-def main():
-    # Find the most recent JSON file in the pet_directory
-    base_output_dir = "pet_directory"
-    latest_json_file = get_latest_json_file(base_output_dir)
-    if latest_json_file is None:
-        print("Error: No JSON file found in the pet_directory.")
-        exit(1)
+    return fallback_link
 
-    # Load the contents of the JSON file
-    with open(latest_json_file, 'r') as file:
-        json_data = json.load(file)
-
-    trigger_word = extract_trigger_word(latest_json_file)
-    if not trigger_word:
-        print("Error: TRIGGER_WORD not found in the latest JSON file.")
-        exit(1)
-
-    print_log_and_save("Starting main process...", json_file=latest_json_file)
-
-    client = initialize_client()
+def create_model_and_train(context, latest_json_file, trigger_word, image_source, file_io_path, fallback_link, stage_hash):
+    """Create the Replicate model, upload the images and run the training. Returns (model_name, status)."""
+    clients = context["clients"] if context is not None else {}
+    client = clients.get("replicate") or initialize_client()
+    clients["replicate"] = client
     print_log_and_save("Replicate client initialized successfully.", json_file=latest_json_file)
 
     model_name = generate_model_name(trigger_word)
@@ -171,13 +176,8 @@ def main():
 
     print_log_and_save(f"Starting training with model: {model.name} at {datetime.now()}", json_file=latest_json_file)
 
-    # Check if user has uploaded images and use that path if available, else use default path
-    user_uploaded_images_zip = json_data.get("user_uploaded_images_zip", "").strip()
-    IMAGE_SOURCE = "file_io"
-    FILE_IO_PATH = user_uploaded_images_zip if user_uploaded_images_zip else FILE_IO_PATH_TO_IMAGES_ZIP
-
     # Generate the direct download link for the image zip file
-    direct_download_link = generate_direct_download_link(IMAGE_SOURCE, FILE_IO_PATH)
+    direct_download_link = generate_direct_download_link(image_source, file_io_path, fallback_link)
     if not direct_download_link:
         print_log_and_save("Error generating direct download link for the image file.", json_file=latest_json_file)
         exit(1)
@@ -190,10 +190,75 @@ def main():
         HUGGING_FACE_TOKEN if MODE == "PRODUCTION" else None, hf_repo_name, MODEL_VERSION, RETRY_DELAY, MAX_RETRIES
     )
 
+    print_log_and_save(f"Training ID: {training.id}", json_file=latest_json_file)
+    update_json_file(latest_json_file, lambda data: mark_stage_started(data, STAGE_NAME, stage_hash))
     print_log_and_save(f"Training process started at {datetime.now()}. Monitoring progress...", json_file=latest_json_file)
 
     # Monitor the training status
-    monitor_training(training.id)
+    training_status = monitor_training(training.id)
+    return model_name, training_status
+
+def main(context=None):
+    # Use the pet record handed over by the runner, else look the run's pet up in the catalog,
+    # else find the most recent JSON file in the pet_directory
+    base_output_dir = "pet_directory"
+    catalog_entry = None if context and context.get("json_filepath") else find_pet(get_run_id())
+    if context and context.get("json_filepath"):
+        latest_json_file = context["json_filepath"]
+        print(f"Using JSON file from run context: {latest_json_file}")
+    elif catalog_entry:
+        latest_json_file = catalog_entry["json_file"]
+        print(f"Using JSON file from the pet catalog: {latest_json_file}")
+    else:
+        latest_json_file = get_latest_json_file(base_output_dir)
+    if latest_json_file is None:
+        print("Error: No JSON file found in the pet_directory.")
+        exit(1)
+
+    # Load the contents of the JSON file
+    with open(latest_json_file, 'r') as file:
+        json_data = json.load(file)
+
+    trigger_word = extract_trigger_word(latest_json_file)
+    if not trigger_word:
+        print("Error: TRIGGER_WORD not found in the latest JSON file.")
+        exit(1)
+
+    # Check if user has uploaded images and use that path if available, else use default path
+    user_uploaded_images_zip = json_data.get("user_uploaded_images_zip", "").strip()
+    IMAGE_SOURCE = "file_io"
+    FILE_IO_PATH = user_uploaded_images_zip if user_uploaded_images_zip else FILE_IO_PATH_TO_IMAGES_ZIP
+    fallback_link = context.get("gdrive_link") if context and context.get("gdrive_link") else GOOGLE_DRIVE_PATH_TO_IMAGES_ZIP
+
+    # The training only depends on the trigger word, the images and the training settings
+    stage_hash = hash_inputs(
+        trigger_word, hash_file(FILE_IO_PATH), fallback_link,
+        [STEPS, LORA_RANK, OPTIMIZER, BATCH_SIZE, RESOLUTION, AUTOCAPTION, LEARNING_RATE, MODEL_VERSION, MODE]
+    )
+
+    resume_training_id = None
+    if context and context.get("resume"):
+        if is_stage_complete(json_data, STAGE_NAME, stage_hash):
+            print(f"[INFO] {STAGE_NAME} already completed for {latest_json_file}. Skipping.")
+            return
+        checkpoint = get_checkpoint(json_data, STAGE_NAME)
+        previous_training_id = json_data.get("REPLICATE_TRAINING_ID")
+        if checkpoint and checkpoint.get("input_hash") == stage_hash and previous_training_id:
+            previous_status = (get_training_status(previous_training_id) or {}).get("status")
+            # Re-attach to a training that is still running or already done instead of paying for a new one
+            if previous_status in ["starting", "processing", "succeeded"]:
+                resume_training_id = previous_training_id
+                print(f"[INFO] Resuming training {resume_training_id} (status: {previous_status})")
+
+    print_log_and_save("Starting main process...", json_file=latest_json_file)
+
+    if resume_training_id:
+        model_name = json_data["REPLICATE_MODEL_LINK"]
+        training_status = monitor_training(resume_training_id)
+    else:
+        model_name, training_status = create_model_and_train(
+            context, latest_json_file, trigger_word, IMAGE_SOURCE, FILE_IO_PATH, fallback_link, stage_hash
+        )
 
     # Fetch and save the model versions after training is complete
     versions = get_model_versions(REPLICATE_OWNER, model_name)
@@ -203,14 +268,14 @@ def main():
 
         # Save the REPLICATE_MODEL_VERSION to JSON
         if os.path.exists(latest_json_file):
-            with open(latest_json_file, 'r') as file:
-                json_data = json.load(file)
-            json_data["REPLICATE_MODEL_VERSION"] = latest_version_id
-            with open(latest_json_file, 'w') as file:
-                json.dump(json_data, file, indent=2)
+            update_pet_record(latest_json_file, {"REPLICATE_MODEL_VERSION": latest_version_id})
+            emit_progress_event(ARTIFACT, stage=STAGE_NAME, kind="model_version", version=latest_version_id, model=model_name)
 
         # Update replicate_configs section with the new MODEL_VERSION
         print_log_and_save("Updating replicate_configs with new MODEL_VERSION", json_file=latest_json_file, update_configs=True)
+
+        if training_status == "succeeded":
+            update_json_file(latest_json_file, lambda data: mark_stage_complete(data, STAGE_NAME, stage_hash))
     else:
         print_log_and_save("Failed to fetch model versions or no versions available.", json_file=latest_json_file)
 
@@ -5,6 +5,17 @@ from datetime import datetime
 from dotenv import load_dotenv
 from utilities.replicate_utils import create_image, get_replicate_default_values
 from utilities.gmail_utils import send_email
+from utilities.progress_utils import emit_progress_event, PROGRESS, ARTIFACT
+from utilities.trace_utils import span
+from utilities.pet_record_utils import PetRecord
+from utilities.pet_catalog_utils import get_run_id, find_pet, register_artifact
+from utilities.checkpoint_utils import (
+    hash_inputs,
+    get_checkpoint,
+    is_stage_complete,
+    mark_stage_started,
+    mark_stage_complete
+)
 import time
 from GLOBAL_VARIABLES import NUMBER_OF_FACTS, EMAIL_ON_COMPLETION, EMAIL_RECIPIENTS, PET_DESCRIPTION
 
@@ -15,6 +26,8 @@ REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
 if not REPLICATE_API_TOKEN:
     raise Exception("Replicate API token not found. Please ensure it is set in the .env file.")
 
+STAGE_NAME = "3_create_images_of_pet"
+
 def log(message):
     """Helper function to print log messages with a timestamp."""
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
@@ -31,10 +44,8 @@ def notify_completion(pet_dir_name, pet_data, image_paths):
     send_email(subject, body, EMAIL_RECIPIENTS, attachment_paths=image_paths, is_html=True)
     log(f"Email notification sent to: {', '.join(EMAIL_RECIPIENTS)}")
 
-def main():
-    log("create_images_of_pet.py script started.")
-    
-    pet_dir_base = "pet_directory"
+def find_latest_pet_json(pet_dir_base="pet_directory"):
+    """Find the most recently modified pet directory and its JSON file."""
     pet_subdirs = [f.path for f in os.scandir(pet_dir_base) if f.is_dir()]
     if not pet_subdirs:
         raise Exception("No pet directories found in pet_directory")
@@ -44,11 +55,27 @@ def main():
     if not json_files:
         raise Exception(f"No JSON files found in the latest pet directory {latest_pet_dir}")
 
-    latest_json_file = os.path.join(latest_pet_dir, json_files[0])
+    return latest_pet_dir, os.path.join(latest_pet_dir, json_files[0])
+
+def main(context=None):
+    log("create_images_of_pet.py script started.")
+
+    # Use the pet handed over by the runner, else the run's pet in the catalog, else the most recent pet directory
+    run_id = context.get("run_id") if context else get_run_id()
+    catalog_entry = None if context and context.get("json_filepath") else find_pet(run_id)
+    if context and context.get("json_filepath"):
+        latest_pet_dir = context["pet_dir_path"]
+        latest_json_file = context["json_filepath"]
+    elif catalog_entry:
+        latest_pet_dir = catalog_entry["pet_dir"]
+        latest_json_file = catalog_entry["json_file"]
+    else:
+        latest_pet_dir, latest_json_file = find_latest_pet_json()
     log(f"Using JSON file: {latest_json_file}")
 
-    with open(latest_json_file, 'r') as file:
-        pet_data = json.load(file)
+    # Merged into the record on every save, so fields other stages write in the meantime are kept
+    record = PetRecord(latest_json_file)
+    pet_data = record.data
 
     replicate_defaults = get_replicate_default_values()
     log("Replicate default values loaded successfully.")
@@ -62,8 +89,31 @@ def main():
     image_details = {}
     image_paths = []
 
+    # The images depend on the trained model, the generation settings and the prompts
+    full_prompts = [pet_data.get(f"replicate_full_prompt_image_{i}") for i in range(1, NUMBER_OF_FACTS + 1)]
+    stage_hash = hash_inputs(pet_data.get("replicate_configs"), full_prompts)
+
+    if context and context.get("resume"):
+        if is_stage_complete(pet_data, STAGE_NAME, stage_hash):
+            log(f"{STAGE_NAME} already completed for {latest_json_file}. Skipping.")
+            context["pet_data"] = pet_data
+            return
+        checkpoint = get_checkpoint(pet_data, STAGE_NAME)
+        if checkpoint and checkpoint.get("input_hash") == stage_hash:
+            # Keep the prompts whose images were already downloaded
+            for prompt_key, details in pet_data.get("image_generation", {}).items():
+                saved_images = [path for path in details.get("images", []) if os.path.exists(path)]
+                if saved_images:
+                    image_details[prompt_key] = dict(details, images=saved_images)
+                    image_paths.extend(saved_images)
+            log(f"Resuming image generation, {len(image_details)} prompt(s) already done.")
+
+    record.update(updater=lambda data: mark_stage_started(data, STAGE_NAME, stage_hash))
+
     for i in range(1, NUMBER_OF_FACTS + 1):
         replicate_full_prompt_key = f"replicate_full_prompt_image_{i}"
+        if replicate_full_prompt_key in image_details:
+            continue
         if replicate_full_prompt_key in pet_data:
             full_prompt = pet_data[replicate_full_prompt_key]
             log(f"Generating image for: {full_prompt}")
@@ -83,7 +133,8 @@ def main():
             for index, url in enumerate(image_urls):
                 try:
                     log(f"Downloading image from URL: {url}")
-                    response = requests.get(url)
+                    with span("image.download", category="download"):
+                        response = requests.get(url)
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                     image_name = f"{timestamp}_{index}.{replicate_defaults['OUTPUT_FORMAT']}"
                     image_path = os.path.join(image_dir_path, image_name)
@@ -92,6 +143,8 @@ def main():
                         with open(image_path, 'wb') as f:
                             f.write(response.content)
                         log(f"Image saved: {image_path}")
+                        emit_progress_event(ARTIFACT, stage=STAGE_NAME, kind="image", path=image_path, url=url)
+                        register_artifact(run_id, "image", image_path)
 
                         image_paths.append(image_path)
                         
@@ -103,19 +156,27 @@ def main():
                 except Exception as e:
                     log(f"Error downloading or saving image {url}: {e}")
 
-    pet_data.update({"image_generation": image_details})
-    pet_data.update({
-        "EXTRA_LORA_MAIN_URL": replicate_defaults["EXTRA_LORA_MAIN_URL"],
-        "EXTRA_LORA_NAME": replicate_defaults["EXTRA_LORA_NAME"]
-    })
-    
+            # Checkpoint after every prompt so a resumed run skips the finished ones
+            record.update({"image_generation": image_details})
+        emit_progress_event(PROGRESS, stage=STAGE_NAME, percent=round(100 * i / NUMBER_OF_FACTS))
+
+    # Prompts that failed are retried by the next --resume
+    all_prompts_done = all(f"replicate_full_prompt_image_{i}" in image_details
+                           for i in range(1, NUMBER_OF_FACTS + 1) if full_prompts[i - 1])
+
     try:
-        with open(latest_json_file, 'w') as file:
-            json.dump(pet_data, file, indent=2)
+        record.update({
+            "image_generation": image_details,
+            "EXTRA_LORA_MAIN_URL": replicate_defaults["EXTRA_LORA_MAIN_URL"],
+            "EXTRA_LORA_NAME": replicate_defaults["EXTRA_LORA_NAME"]
+        }, updater=(lambda data: mark_stage_complete(data, STAGE_NAME, stage_hash)) if all_prompts_done else None)
         log(f"Updated JSON file with image details and LORA info: {latest_json_file}")
     except Exception as e:
         log(f"Error updating JSON file {latest_json_file}: {e}")
     
+    if context is not None:
+        context["pet_data"] = pet_data
+
     if EMAIL_ON_COMPLETION:
         notify_completion(latest_pet_dir, pet_data, image_paths)
 
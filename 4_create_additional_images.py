@@ -6,6 +6,9 @@ import requests
 import argparse
 from datetime import datetime
 from dotenv import load_dotenv
+from utilities.progress_utils import emit_progress_event, ARTIFACT, ERROR
+from utilities.trace_utils import span, export_chrome_trace
+from utilities.pet_record_utils import update_pet_record
 
 # Load environment variables from .env file
 load_dotenv()
@@ -44,33 +47,30 @@ def read_json(file_path):
         data = json.load(file)
     return data
 
-def write_json(file_path, data):
-    """Write JSON data to a file."""
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=2)
-
 def generate_image(prompt, model_version, trigger_word, num_outputs, aspect_ratio, output_format, guidance_scale, output_quality, prompt_strength, extra_lora, extra_lora_scale):
     """Generate an image using Replicate's API."""
     combined_prompt = f"{trigger_word} {prompt}"
 
     try:
-        output = replicate.run(
-            model_version,
-            input={
-                "prompt": combined_prompt,
-                "num_outputs": num_outputs,
-                "aspect_ratio": aspect_ratio,
-                "output_format": output_format,
-                "guidance_scale": guidance_scale,
-                "output_quality": output_quality,
-                "prompt_strength": prompt_strength,
-                "extra_lora": extra_lora,
-                "extra_lora_scale": extra_lora_scale
-            }
-        )
+        with span("replicate.predict", category="replicate"):
+            output = replicate.run(
+                model_version,
+                input={
+                    "prompt": combined_prompt,
+                    "num_outputs": num_outputs,
+                    "aspect_ratio": aspect_ratio,
+                    "output_format": output_format,
+                    "guidance_scale": guidance_scale,
+                    "output_quality": output_quality,
+                    "prompt_strength": prompt_strength,
+                    "extra_lora": extra_lora,
+                    "extra_lora_scale": extra_lora_scale
+                }
+            )
         return output
     except Exception as e:
         log(f"Error generating images: {e}")
+        emit_progress_event(ERROR, message=f"Error generating images: {e}")
         return []
 
 def save_images(image_urls, image_dir, output_format):
@@ -79,7 +79,8 @@ def save_images(image_urls, image_dir, output_format):
     for index, url in enumerate(image_urls):
         try:
             log(f"Downloading image from URL: {url}")
-            response = requests.get(url)
+            with span("image.download", category="download"):
+                response = requests.get(url)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             image_name = f"{timestamp}_{index}.{output_format}"
             image_path = os.path.join(image_dir, image_name)
@@ -88,6 +89,7 @@ def save_images(image_urls, image_dir, output_format):
                 with open(image_path, 'wb') as f:
                     f.write(response.content)
                 log(f"Image saved: {image_path}")
+                emit_progress_event(ARTIFACT, kind="image", path=image_path, url=url)
                 image_paths.append(image_path)
             else:
                 log(f"Failed to download image from {url}, status code: {response.status_code}")
@@ -138,13 +140,14 @@ def main(pet_directory, prompt, num_outputs, aspect_ratio, output_format, guidan
     
     # Update JSON with the new image details
     generation_time = time.time()
-    pet_data["new_image_generation"] = {
+    new_image_generation = {
         "prompt": combined_prompt,
         "images": image_paths,
         "generation_time": generation_time
     }
-    
-    write_json(latest_json_file, pet_data)
+
+    # Merge under the record lock rather than writing back the copy read at the start
+    update_pet_record(latest_json_file, updater=lambda data: data.update(new_image_generation=new_image_generation))
     log(f"Updated JSON file with new image details: {latest_json_file}")
 
     log("4_create_new_images_via_existing_lora.py script finished.")
@@ -164,4 +167,8 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
-    main(args.pet_directory, args.prompt, args.num_outputs, args.aspect_ratio, args.output_format, args.guidance_scale, args.output_quality, args.prompt_strength, args.extra_lora, args.extra_lora_scale)
\ No newline at end of file
+    try:
+        with span("create_additional_images", category="stage", pet_directory=args.pet_directory):
+            main(args.pet_directory, args.prompt, args.num_outputs, args.aspect_ratio, args.output_format, args.guidance_scale, args.output_quality, args.prompt_strength, args.extra_lora, args.extra_lora_scale)
+    finally:
+        log(f"Trace written to {export_chrome_trace()}")
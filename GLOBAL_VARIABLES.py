@@ -74,6 +74,34 @@ VISIBILITY = "private" if MODE == "DEVELOPMENT" else "public"
 
 REPLICATE_API_URL = "https://api.replicate.com/v1/predictions"
 GLOBAL_MODEL_NAME = 'llama3'
+# Ollama model per kind of question: small models answer the one-word and few-word questions several times faster,
+# the large model writes the storyline and facts. Point a route at GLOBAL_MODEL_NAME to use one model for it.
+MODEL_ROUTES = {
+    "classification": "llama3.2:1b",  # species of pet
+    "short_extraction": "llama3.2:3b",  # pet details
+    "short_creative": "llama3.2:3b",  # PROMPT_BASE, image prompts, signage text
+    "long_creative": GLOBAL_MODEL_NAME,  # storyline, encouraging facts
+}
 NUMBER_OF_FACTS = 5
+# "structured" extracts all pet details in one JSON call; "per_field" asks one question per detail
+EXTRACTION_MODE = "structured"  # or "per_field"
+# Send the pet description once per question as the same system message, so Ollama reuses its evaluated prefix
+GATHER_SESSION_MODE = True
+# "single_call" asks for all facts in one structured answer and drops near-duplicates; "chain" asks for them one by one
+FACTS_MODE = "single_call"  # or "chain"
+# Rotate, downscale to the largest RESOLUTION bucket, re-encode and strip metadata from uploads before zipping them
+PREPROCESS_TRAINING_IMAGES = True
+TRAINING_IMAGE_QUALITY = 90  # JPEG quality of the preprocessed images
+# Leave near-duplicate bursts, blurry shots and surplus photos out of the training zip
+CURATE_TRAINING_IMAGES = True
+TRAINING_DUPLICATE_DISTANCE = 6  # Perceptual hashes differing in at most this many of 64 bits are near-duplicates
+TRAINING_MIN_SHARPNESS = 50.0  # Variance of the Laplacian below which a photo counts as blurry
+TRAINING_MIN_IMAGES = 5  # Keep the least blurry photos rather than fewer than this many
+TRAINING_MAX_IMAGES = 30
+
+# Batch mode (0_run_all.py --batch): how many pets may use each resource at the same time
+BATCH_LLM_CONCURRENCY = 1  # one local Ollama server
+BATCH_TRAINING_CONCURRENCY = 3  # concurrent Replicate trainings
+BATCH_PREDICTION_CONCURRENCY = 2  # pets generating images on Replicate
 EMAIL_ON_COMPLETION = True  # Set to True to enable email notifications
 EMAIL_RECIPIENTS = ["your-email@example.com"]  # Update with the actual recipient emails
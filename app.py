@@ -7,10 +7,34 @@ from flask_socketio import SocketIO
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import uuid
+import shutil
 from utilities.fileio_utils import upload_file_to_fileio
 from utilities.file_zip_utils import zip_files
-
-FLASK_PORT = 5001
+from utilities.job_queue_utils import (
+    init_job_queue,
+    new_job_id,
+    create_job_staging_dir,
+    enqueue_job,
+    get_job,
+    get_queue_position,
+    run_worker
+)
+from utilities.progress_utils import run_with_progress_events, ProgressCoalescer, ARTIFACT
+from utilities.trace_utils import TRACE_ID_ENV, get_trace_dir
+
+FLASK_PORT = int(os.getenv("FLASK_PORT", 5001))
+
+# Job queue settings for /create_lora
+LORA_JOB_WORKERS = 2      # Pipelines allowed to run at the same time
+MAX_QUEUED_LORA_JOBS = 10 # Submissions waiting beyond this are rejected with 429
+RETRY_AFTER_SECONDS = 300
+
+# Job queue settings for /create_images; these jobs mostly wait on Replicate, so more can run at once
+IMAGE_JOB_WORKERS = 4
+MAX_QUEUED_IMAGE_JOBS = 20
+
+# Output lines and progress events are pushed to clients at most this often (seconds)
+PROGRESS_EMIT_INTERVAL = 0.5
 
 def kill_process_using_port(port):
     try:
@@ -51,38 +75,114 @@ uploads_dir = 'uploads'
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def run_scripts(json_file):
+def run_with_progress(cmd, job_id=None, env=None):
+    """Run a pipeline script and push its output and typed progress events to clients in coalesced batches.
+
+    Returns (exit code, events).
+    """
+    events = []
+
+    def send(message, batch):
+        socketio.emit('progress_update', {'message': message, 'events': batch, 'job_id': job_id})
+
+    def on_output(line, stream_name):
+        print(line)
+        coalescer.add_line(line)
+
+    def on_event(event):
+        events.append(event)
+        coalescer.add_event(event)
+
+    coalescer = ProgressCoalescer(send, interval=PROGRESS_EMIT_INTERVAL).start()
+    try:
+        returncode = run_with_progress_events(cmd, on_event, on_output, env=env)
+    finally:
+        coalescer.close()
+    return returncode, events
+
+def run_scripts(json_file, job_id=None):
     try:
         env = os.environ.copy()
         env['APP_CONTEXT'] = 'true'
+        if job_id:
+            # All processes of a job share one trace, so a resumed job adds to the same trace file
+            env[TRACE_ID_ENV] = job_id
         
         cmd = ["python3", "0_run_all.py", json_file]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=env)
-
-        socketio.emit('progress_update', {'message': 'Script execution started...'})
-
-        for line in iter(process.stdout.readline, ''):
-            if line:
-                cleaned_line = line.strip()
-                socketio.emit('progress_update', {'message': cleaned_line})
-                print(cleaned_line)
+        socketio.emit('progress_update', {'message': 'Script execution started...', 'job_id': job_id})
 
-        process.stdout.close()
-        process.wait()
+        returncode, events = run_with_progress(cmd, job_id=job_id, env=env)
+        if returncode != 0:
+            raise Exception(f"0_run_all.py exited with code {returncode}")
 
-        for line in iter(process.stderr.readline, ''):
-            if line:
-                cleaned_line = line.strip()
-                socketio.emit('progress_update', {'message': cleaned_line})
-                print(cleaned_line)
-
-        process.stderr.close()
-
-        socketio.emit('progress_update', {'message': '#### GENERATION COMPLETED! ####'})
+        socketio.emit('progress_update', {'message': '#### GENERATION COMPLETED! ####', 'job_id': job_id})
         print("#### GENERATION COMPLETED! ####")
+        artifacts = [event for event in events if event.get('type') == ARTIFACT]
+        return {'returncode': returncode, 'artifacts': artifacts, 'trace_file': os.path.join(get_trace_dir(), f"{job_id}.json") if job_id else None}
     except Exception as e:
-        socketio.emit('progress_update', {'message': f"An error occurred: {str(e)}"})
+        socketio.emit('progress_update', {'message': f"An error occurred: {str(e)}", 'job_id': job_id})
         print(f"An error occurred: {str(e)}")
+        raise
+
+def run_lora_job(job):
+    """Worker handler for a queued /create_lora submission."""
+    payload = job['payload']
+    result = run_scripts(payload['json_filename'], job_id=job['id'])
+    # The uploads have been zipped into the pet directory by now. A failed job keeps its
+    # staging directory, so 0_run_all.py --resume can pick up where it stopped.
+    shutil.rmtree(payload['job_dir'], ignore_errors=True)
+    return result
+
+def run_image_job(job):
+    """Worker handler for a queued /create_images request."""
+    payload = job['payload']
+    cmd = [
+        "python3", "4_create_additional_images.py",
+        "--pet_directory", payload['pet_directory'],
+        "--prompt", payload['prompt'],
+        "--num_outputs", str(payload['num_outputs']),
+        "--aspect_ratio", payload['aspect_ratio'],
+        "--output_format", payload['output_format'],
+        "--guidance_scale", str(payload['guidance_scale']),
+        "--output_quality", str(payload['output_quality']),
+        "--prompt_strength", str(payload['prompt_strength']),
+        "--extra_lora", payload['extra_lora'],
+        "--extra_lora_scale", str(payload['extra_lora_scale'])
+    ]
+    env = os.environ.copy()
+    env[TRACE_ID_ENV] = job['id']
+    try:
+        returncode, events = run_with_progress(cmd, job_id=job['id'], env=env)
+
+        # The script reports every downloaded image as an artifact event
+        images = [event for event in events if event.get('type') == ARTIFACT and event.get('kind') == 'image']
+        if returncode != 0:
+            raise Exception(f"4_create_additional_images.py exited with code {returncode}")
+        if not images:
+            raise Exception("No images were generated.")
+
+        result = {
+            'image_urls': [event['url'] for event in images],
+            # Replicate URLs expire, so also point at the copies saved in the pet directory
+            'local_image_urls': [f"/pet_images/{payload['pet_directory']}/{os.path.basename(event['path'])}" for event in images],
+            'trace_file': os.path.join(get_trace_dir(), f"{job['id']}.json")
+        }
+    except Exception as e:
+        socketio.emit('job_finished', {'job_id': job['id'], 'status': 'failed', 'error': str(e)})
+        print(f"An error occurred: {str(e)}")
+        raise
+
+    socketio.emit('progress_update', {'message': '#### IMAGE CREATION COMPLETED! ####', 'job_id': job['id']})
+    socketio.emit('job_finished', dict(result, job_id=job['id'], status='succeeded'))
+    print("#### IMAGE CREATION COMPLETED! ####")
+    return result
+
+def start_job_workers():
+    init_job_queue()
+    for _ in range(LORA_JOB_WORKERS):
+        socketio.start_background_task(run_worker, 'create_lora', run_lora_job, 1.0, socketio.sleep)
+    for _ in range(IMAGE_JOB_WORKERS):
+        socketio.start_background_task(run_worker, 'create_images', run_image_job, 1.0, socketio.sleep)
 
 @app.route('/')
 def index():
@@ -99,10 +199,6 @@ def create_lora():
                 logging.error('Pet description is missing.')
                 return jsonify({'message': 'Pet description is required!'}), 400
 
-            zip_uploads_dir = 'zip_uploads'
-            os.makedirs(zip_uploads_dir, exist_ok=True)
-            logging.debug('Ensured zip_uploads directory exists: %s', zip_uploads_dir)
-
             uploaded_files = request.files.getlist('file_input')
             logging.debug('Uploaded files: %s', uploaded_files)
 
@@ -110,6 +206,12 @@ def create_lora():
                 logging.error('No files uploaded.')
                 return jsonify({'message': 'No files uploaded!'}), 400
 
+            # Each job gets its own upload directories so concurrent runs never share files
+            job_id = new_job_id()
+            staging = create_job_staging_dir(job_id)
+            zip_uploads_dir = staging['zip_uploads_dir']
+            logging.debug('Created staging directories for job %s: %s', job_id, staging['job_dir'])
+
             for file in uploaded_files:
                 if file.filename == '':
                     logging.warning('Empty filename detected, skipping file.')
@@ -122,24 +224,35 @@ def create_lora():
             # Prepare data for further processing, such as running scripts
             json_data = {
                 "PET_DESCRIPTION": pet_description,
-                "submit_time": int(datetime.now().timestamp())
+                "submit_time": int(datetime.now().timestamp()),
+                "job_id": job_id,
+                "zip_uploads_dir": staging['zip_uploads_dir']
             }
 
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            json_filename = f"create_lora_data_{timestamp}.json"
+            json_filename = f"create_lora_data_{timestamp}_{job_id[:8]}.json"
             log_dir = os.path.join('app_submit_log')
             os.makedirs(log_dir, exist_ok=True)
             log_filepath = os.path.join(log_dir, json_filename)
             with open(log_filepath, 'w') as log_file:
                 json.dump(json_data, log_file, indent=2)
 
-            # Start the background task to run the scripts
-            socketio.start_background_task(run_scripts, json_filename)
+            # Queue the run; a worker picks it up when a slot is free
+            payload = {'json_filename': json_filename, 'job_dir': staging['job_dir']}
+            if enqueue_job('create_lora', payload, job_id=job_id, max_queued=MAX_QUEUED_LORA_JOBS) is None:
+                logging.warning('Job queue is full, rejecting submission %s', job_id)
+                shutil.rmtree(staging['job_dir'], ignore_errors=True)
+                os.remove(log_filepath)
+                response = jsonify({'message': 'Too many pets are waiting to be processed. Please try again later.'})
+                response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+                return response, 429
 
             date_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            message = f"Pet info and images accepted! Generation process started as of {date_time_str}!"
+            position = get_queue_position(job_id)
+            message = f"Pet info and images accepted as of {date_time_str}! Job {job_id} is queued"
+            message += f" behind {position} other job(s)." if position else " and will start shortly."
 
-            return jsonify({'message': message}), 200
+            return jsonify({'message': message, 'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
 
         except Exception as e:
             logging.error("Error in create_lora", exc_info=True)
@@ -147,6 +260,14 @@ def create_lora():
 
     return render_template('create_lora.html')
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'message': 'Job not found.'}), 404
+    job['queue_position'] = get_queue_position(job_id)
+    return jsonify(job), 200
+
 @app.route('/view_pets', methods=['GET'])
 def view_pets():
     directories = [d for d in os.listdir(base_output_dir) if os.path.isdir(os.path.join(base_output_dir, d))]
@@ -210,57 +331,34 @@ def create_images():
         if not pet_directory or not prompt:
             return jsonify({'message': 'Pet directory and prompt are required!'}), 400
 
-        try:
-            cmd = [
-                "python3", "4_create_additional_images.py",
-                "--pet_directory", pet_directory,
-                "--prompt", prompt,
-                "--num_outputs", str(num_outputs),
-                "--aspect_ratio", aspect_ratio,
-                "--output_format", output_format,
-                "--guidance_scale", str(guidance_scale),
-                "--output_quality", str(output_quality),
-                "--prompt_strength", str(prompt_strength),
-                "--extra_lora", extra_lora_url,
-                "--extra_lora_scale", str(extra_lora_scale)
-            ]
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-
-            image_urls = []
-
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    cleaned_line = line.strip()
-                    socketio.emit('progress_update', {'message': cleaned_line})
-                    print(cleaned_line)
-                    
-                    # Extract image URLs from the script output.
-                    if "Downloading image from URL" in cleaned_line:
-                        url_start = cleaned_line.find("http")
-                        url = cleaned_line[url_start:]
-                        image_urls.append(url)
-
-            process.stdout.close()
-            process.wait()
-
-            for line in iter(process.stderr.readline, ''):
-                if line:
-                    cleaned_line = line.strip()
-                    socketio.emit('progress_update', {'message': cleaned_line})
-                    print(cleaned_line)
-
-            process.stderr.close()
-
-            socketio.emit('progress_update', {'message': '#### IMAGE CREATION COMPLETED! ####'})
-            print("#### IMAGE CREATION COMPLETED! ####")
+        if pet_directory not in os.listdir(base_output_dir):
+            return jsonify({'message': 'Unknown pet directory.'}), 400
+
+        # Queue the generation; a worker runs it and pushes the image URLs over the socket when done
+        payload = {
+            'pet_directory': pet_directory,
+            'prompt': prompt,
+            'num_outputs': num_outputs,
+            'aspect_ratio': aspect_ratio,
+            'output_format': output_format,
+            'guidance_scale': guidance_scale,
+            'output_quality': output_quality,
+            'prompt_strength': prompt_strength,
+            'extra_lora': extra_lora_url,
+            'extra_lora_scale': extra_lora_scale
+        }
+        job_id = enqueue_job('create_images', payload, max_queued=MAX_QUEUED_IMAGE_JOBS)
+        if job_id is None:
+            logging.warning('Image job queue is full, rejecting request for %s', pet_directory)
+            response = jsonify({'message': 'Too many image requests are waiting. Please try again later.'})
+            response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            return response, 429
 
-        except Exception as e:
-            socketio.emit('progress_update', {'message': f"An error occurred: {str(e)}"})
-            print(f"An error occurred: {str(e)}")
+        position = get_queue_position(job_id)
+        message = f"Image creation job {job_id} is queued"
+        message += f" behind {position} other job(s)." if position else " and will start shortly."
 
-        message = "Image creation process started! Check the console for updates."
-        
-        return jsonify({'message': message, 'image_urls': image_urls}), 200
+        return jsonify({'message': message, 'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
 
     directories = [d for d in os.listdir(base_output_dir) if os.path.isdir(os.path.join(base_output_dir, d))]
     return render_template('create_images.html', directories=directories)
@@ -282,4 +380,5 @@ def handle_disconnect():
     print('Client disconnected')
 
 if __name__ == '__main__':
+    start_job_workers()
     socketio.run(app, host='0.0.0.0', port=FLASK_PORT)
\ No newline at end of file
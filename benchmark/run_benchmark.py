@@ -0,0 +1,370 @@
+"""Offline end-to-end benchmark: run synthetic pets through 0_run_all.py or app.py against local stand-ins.
+
+    python benchmark/run_benchmark.py --pets 6 --mode batch
+    python benchmark/run_benchmark.py --pets 4 --mode cli --concurrency 2 --fail ollama=0.05
+    python benchmark/run_benchmark.py --pets 4 --mode app
+
+The code is copied into a scratch directory first, so pet_directory/, traces and the job queue of
+the real tree are not touched. Per-stage latency percentiles come from the run traces
+(utilities/trace_utils.py); the report is saved to benchmark_reports/ unless --output says otherwise.
+A pet only counts as succeeded if its record shows generated images and a completed image stage.
+"""
+import os
+import sys
+import json
+import glob
+import math
+import time
+import shutil
+import socket
+import random
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_servers import DEFAULT_STUB_CONFIG, start_stub_server, stub_environment, PNG_BYTES
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from utilities.pet_catalog_utils import get_pet
+from utilities.checkpoint_utils import get_checkpoint
+
+REPORT_DIR = os.path.join(REPO_ROOT, "benchmark_reports")
+
+# Left out of the scratch copy: run outputs and anything the benchmark does not execute
+COPY_IGNORE = shutil.ignore_patterns(
+    ".git", "__pycache__", "pet_directory", "traces", "app_submit_log", "job_staging", "batch_reports",
+    "benchmark_reports", "zip_uploads", "temp", "uploads", "usage_data", "video_maker", "sample_outputs",
+    "*.sqlite3*", ".env"
+)
+
+# Appended to the scratch GLOBAL_VARIABLES.py; later assignments win
+GLOBAL_OVERRIDES = """
+# Benchmark overrides
+EMAIL_ON_COMPLETION = False
+"""
+
+# Written in place of the real .env, which is not copied. Without it utilities/gmail_utils.py
+# would ask Google Cloud Secret Manager for credentials when it is imported.
+STUB_DOTENV = """GMAIL_USER=benchmark@example.com
+GMAIL_APP_PASSWORD=benchmark
+REPLICATE_API_TOKEN=benchmark-token
+"""
+
+# The stage whose images decide whether a pet succeeded
+IMAGE_STAGE = "3_create_images_of_pet"
+
+PET_NAMES = ["Biscuit", "Maple", "Juniper", "Pepper", "Clover", "Waffles", "Ziggy", "Olive", "Mochi", "Rocco",
+             "Hazel", "Tater", "Luna", "Bruno", "Pickles", "Nova"]
+BREEDS = ["Labrador mix", "Tabby", "Beagle", "Siamese", "Pit Bull Terrier mix", "Cockatiel", "Guinea pig"]
+
+# Span categories the report breaks down
+REPORTED_CATEGORIES = {"stage", "llm", "replicate", "upload", "download", "io", "pipeline"}
+
+def prepare_workdir(workdir):
+    """Copy the code into workdir and disable side effects such as completion emails."""
+    shutil.copytree(REPO_ROOT, workdir, ignore=COPY_IGNORE, dirs_exist_ok=True)
+    with open(os.path.join(workdir, "GLOBAL_VARIABLES.py"), "a") as f:
+        f.write(GLOBAL_OVERRIDES)
+    with open(os.path.join(workdir, ".env"), "w") as f:
+        f.write(STUB_DOTENV)
+
+def make_synthetic_pets(count, workdir, seed=None):
+    """Create pet submissions, each with its own upload directory holding a few images."""
+    rng = random.Random(seed)
+    pets = []
+    for index in range(count):
+        name = f"{PET_NAMES[index % len(PET_NAMES)]}{index // len(PET_NAMES) or ''}"
+        description = (
+            f"{name} is a {rng.randint(1, 9)}-year-old {rng.choice(BREEDS)} who loves toys, naps and people. "
+            f"{name} gets along with other pets and would do best in a quiet home.\n\n"
+            f"Additional details\nPet ID\n{rng.randint(10000000, 99999999)}\nSize\nMedium"
+        )
+        pet_dir = os.path.join(workdir, "bench_inputs", f"pet_{index + 1}")
+        zip_uploads_dir = os.path.join(pet_dir, "zip_uploads")
+        os.makedirs(zip_uploads_dir, exist_ok=True)
+        for image_index in range(3):
+            with open(os.path.join(zip_uploads_dir, f"photo_{image_index}.png"), "wb") as f:
+                f.write(PNG_BYTES)
+        pets.append({
+            "index": index + 1,
+            "name": name,
+            "submission": {
+                "PET_DESCRIPTION": description,
+                "submit_time": int(time.time()),
+                "zip_uploads_dir": zip_uploads_dir,
+                # Key of the pet's record in the catalog, checked once the run is over
+                "run_id": f"bench-{os.getpid()}-pet-{index + 1:03d}",
+            },
+        })
+    return pets
+
+def write_submission(pet, directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"pet_{pet['index']:03d}.json")
+    with open(path, "w") as f:
+        json.dump(pet["submission"], f, indent=2)
+    return path
+
+def run_cli(pets, workdir, env, concurrency, timeout):
+    """One 0_run_all.py process per pet, up to `concurrency` at a time."""
+    log_dir = os.path.join(workdir, "bench_logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    def run_one(pet):
+        submission_file = write_submission(pet, os.path.join(workdir, "bench_submissions"))
+        pet_env = dict(env, PIPELINE_TRACE_ID=f"bench-pet-{pet['index']:03d}")
+        started = time.time()
+        with open(os.path.join(log_dir, f"pet_{pet['index']:03d}.log"), "w") as log:
+            try:
+                returncode = subprocess.run([sys.executable, "0_run_all.py", submission_file], cwd=workdir, env=pet_env,
+                                            stdout=log, stderr=subprocess.STDOUT, timeout=timeout).returncode
+            except subprocess.TimeoutExpired:
+                returncode = "timeout"
+        return {"pet": pet["name"], "run_id": pet["submission"]["run_id"], "succeeded": returncode == 0,
+                "returncode": returncode, "duration_seconds": round(time.time() - started, 2)}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(run_one, pets))
+
+def run_batch(pets, workdir, env, timeout):
+    """All pets in one 0_run_all.py --batch run."""
+    batch_dir = os.path.join(workdir, "bench_batch")
+    for pet in pets:
+        write_submission(pet, batch_dir)
+    with open(os.path.join(workdir, "bench_batch.log"), "w") as log:
+        try:
+            subprocess.run([sys.executable, "0_run_all.py", "--batch", batch_dir], cwd=workdir,
+                           env=dict(env, PIPELINE_TRACE_ID="bench-batch"), stdout=log, stderr=subprocess.STDOUT,
+                           timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return [{"pet": pet["name"], "succeeded": False, "returncode": "timeout"} for pet in pets]
+
+    reports = sorted(glob.glob(os.path.join(workdir, "batch_reports", "*.json")))
+    if not reports:
+        return [{"pet": pet["name"], "succeeded": False, "returncode": "no batch report"} for pet in pets]
+    with open(reports[-1]) as f:
+        batch_report = json.load(f)
+    return [
+        {"pet": pet["name"], "run_id": pet["submission"]["run_id"], "succeeded": entry["succeeded"],
+         "duration_seconds": entry["duration_seconds"],
+         "failed_tasks": entry["failed_tasks"], "skipped_tasks": entry["skipped_tasks"]}
+        for pet, entry in zip(pets, batch_report["pets"])
+    ]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return True
+        time.sleep(0.2)
+    return False
+
+def run_app(pets, workdir, env, port, timeout):
+    """Submit every pet to /create_lora of a local app.py and wait for the queued jobs."""
+    import requests
+
+    app_log = open(os.path.join(workdir, "bench_app.log"), "w")
+    app = subprocess.Popen([sys.executable, "app.py"], cwd=workdir, env=dict(env, FLASK_PORT=str(port)),
+                           stdout=app_log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_for_port(port):
+            raise Exception(f"app.py did not start listening on port {port}; see {app_log.name}")
+        base_url = f"http://127.0.0.1:{port}"
+
+        jobs = []
+        for pet in pets:
+            zip_uploads_dir = pet["submission"]["zip_uploads_dir"]
+            files = [("file_input", (name, open(os.path.join(zip_uploads_dir, name), "rb"), "image/png"))
+                     for name in sorted(os.listdir(zip_uploads_dir))]
+            response = requests.post(f"{base_url}/create_lora", data={"pet_description": pet["submission"]["PET_DESCRIPTION"]},
+                                     files=files)
+            for _, (_, handle, _) in files:
+                handle.close()
+            jobs.append((pet, response.json().get("job_id") if response.status_code == 202 else None, response.status_code))
+
+        results = {}
+        deadline = time.time() + timeout
+        while time.time() < deadline and len(results) < len(jobs):
+            for pet, job_id, status_code in jobs:
+                if pet["name"] in results:
+                    continue
+                if job_id is None:
+                    results[pet["name"]] = {"pet": pet["name"], "succeeded": False, "returncode": f"HTTP {status_code}"}
+                    continue
+                job = requests.get(f"{base_url}/jobs/{job_id}").json()
+                if job["status"] in ("succeeded", "failed"):
+                    results[pet["name"]] = {
+                        # Queued jobs use their job ID as run ID
+                        "pet": pet["name"], "job_id": job_id, "run_id": job_id, "succeeded": job["status"] == "succeeded",
+                        "queued_seconds": round(job["started_at"] - job["created_at"], 2),
+                        "duration_seconds": round(job["finished_at"] - job["created_at"], 2),
+                        "error": job.get("error"),
+                    }
+            time.sleep(0.5)
+        return [results.get(pet["name"], {"pet": pet["name"], "succeeded": False, "returncode": "timeout"}) for pet, _, _ in jobs]
+    finally:
+        app.terminate()
+        app.wait(timeout=10)
+        app_log.close()
+
+def check_pet_record(result, catalog_db):
+    """Mark a pet failed unless its record holds generated images and a completed image stage.
+
+    Stage 3 skips prompts whose generation fails, so a clean exit alone does not mean the pet got its images.
+    """
+    if not result["succeeded"]:
+        return result
+    pet = get_pet(result.get("run_id"), db_path=catalog_db)
+    if pet is None:
+        return dict(result, succeeded=False, images=0, record_error="pet record not found")
+    with open(pet["json_file"]) as f:
+        record = json.load(f)
+    images = sum(len(details.get("images", [])) for details in record.get("image_generation", {}).values())
+    image_stage = (get_checkpoint(record, IMAGE_STAGE) or {}).get("status")
+    result = dict(result, images=images, image_stage=image_stage)
+    if not images or image_stage != "completed":
+        result.update(succeeded=False, record_error=f"{images} images, {IMAGE_STAGE} {image_stage or 'not started'}")
+    return result
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def span_percentiles(trace_dir):
+    """Latency percentiles per span name over every trace the run wrote."""
+    durations = {}
+    for spans_file in glob.glob(os.path.join(trace_dir, "*.spans.jsonl")):
+        with open(spans_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("cat") not in REPORTED_CATEGORIES:
+                    continue
+                # Batch tasks are prefixed with the pet ("pet_3:train_lora")
+                name = record["name"].split(":", 1)[-1] if record["name"].startswith("pet_") else record["name"]
+                durations.setdefault(name, []).append(record["end"] - record["start"])
+
+    summary = {}
+    for name, values in sorted(durations.items()):
+        values.sort()
+        summary[name] = {
+            "count": len(values),
+            "p50": round(percentile(values, 0.50), 3),
+            "p90": round(percentile(values, 0.90), 3),
+            "p99": round(percentile(values, 0.99), 3),
+            "max": round(values[-1], 3),
+        }
+    return summary
+
+def parse_failure_rates(values):
+    rates = {}
+    for value in values or []:
+        service, _, rate = value.partition("=")
+        if service not in DEFAULT_STUB_CONFIG["failure_rates"]:
+            raise argparse.ArgumentTypeError(f"Unknown service '{service}' in --fail")
+        rates[service] = float(rate)
+    return rates
+
+def print_report(report):
+    print(f"\n[INFO] Mode: {report['mode']}, pets: {report['pets_succeeded']}/{report['pets_total']} succeeded "
+          f"in {report['wall_seconds']} seconds ({report['pets_per_hour']} pets/hour)")
+    print(f"{'span':<32}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, stats in report["span_percentiles"].items():
+        print(f"{name:<32}{stats['count']:>7}{stats['p50']:>10}{stats['p90']:>10}{stats['p99']:>10}{stats['max']:>10}")
+    print(f"[INFO] Stand-in requests: {report['stub_stats']['requests']}, injected failures: {report['stub_stats']['failures_injected']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline against local stand-ins.")
+    parser.add_argument("--mode", choices=["cli", "batch", "app"], default="cli",
+                        help="cli: one 0_run_all.py per pet, batch: 0_run_all.py --batch, app: queued /create_lora jobs")
+    parser.add_argument("--pets", type=int, default=4, help="Number of synthetic pets.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Parallel 0_run_all.py processes in cli mode.")
+    parser.add_argument("--training-seconds", type=float, default=DEFAULT_STUB_CONFIG["training_seconds"])
+    parser.add_argument("--prediction-seconds", type=float, default=DEFAULT_STUB_CONFIG["prediction_seconds"])
+    parser.add_argument("--webhooks", action="store_true",
+                        help="Learn about finished trainings from webhooks instead of polling alone.")
+    parser.add_argument("--ollama-latency", type=float, default=DEFAULT_STUB_CONFIG["ollama_latency"])
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_STUB_CONFIG["ollama_tokens_per_second"])
+    parser.add_argument("--fail", action="append", metavar="SERVICE=RATE",
+                        help="Inject failures, e.g. --fail ollama=0.05 --fail replicate=0.01 (services: ollama, replicate, fileio).")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for synthetic pets, answers and failure injection.")
+    parser.add_argument("--app-port", type=int, default=5055, help="Port for app.py in app mode.")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds before a run is abandoned.")
+    parser.add_argument("--workdir", help="Scratch directory (default: a new temporary directory).")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory for inspection.")
+    parser.add_argument("--output", default=REPORT_DIR, help="Directory for the report (default: benchmark_reports/).")
+    parser.add_argument("--min-pets-per-hour", type=float, help="Exit with an error below this throughput (for CI).")
+    args = parser.parse_args()
+
+    stub_config = {
+        "training_seconds": args.training_seconds,
+        "prediction_seconds": args.prediction_seconds,
+        "ollama_latency": args.ollama_latency,
+        "ollama_tokens_per_second": args.tokens_per_second,
+        "failure_rates": parse_failure_rates(args.fail),
+        "seed": args.seed,
+    }
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pet_benchmark_")
+    prepare_workdir(workdir)
+    pets = make_synthetic_pets(args.pets, workdir, args.seed)
+
+    server = start_stub_server(stub_config)
+    env = dict(os.environ, **stub_environment(server.url, training_poll_interval=max(0.2, args.training_seconds / 10),
+                                              training_seconds=args.training_seconds, webhooks=args.webhooks))
+    env["PIPELINE_TRACE_DIR"] = os.path.join(workdir, "traces")
+    env["PET_CATALOG_DB"] = os.path.join(workdir, "pet_catalog.sqlite3")
+    env.pop("PROGRESS_EVENT_FD", None)
+    print(f"[INFO] Stand-ins at {server.url}, scratch directory {workdir}")
+
+    started = time.time()
+    try:
+        if args.mode == "cli":
+            results = run_cli(pets, workdir, env, args.concurrency, args.timeout)
+        elif args.mode == "batch":
+            results = run_batch(pets, workdir, env, args.timeout)
+        else:
+            results = run_app(pets, workdir, env, args.app_port, args.timeout)
+    finally:
+        server.shutdown()
+    wall_seconds = time.time() - started
+    results = [check_pet_record(result, env["PET_CATALOG_DB"]) for result in results]
+
+    succeeded = sum(1 for result in results if result["succeeded"])
+    report = {
+        "mode": args.mode,
+        "started_at": datetime.fromtimestamp(started).isoformat(),
+        "pets_total": len(results),
+        "pets_succeeded": succeeded,
+        "wall_seconds": round(wall_seconds, 2),
+        "pets_per_hour": round(succeeded * 3600 / wall_seconds, 2) if wall_seconds > 0 else 0,
+        "concurrency": args.concurrency if args.mode == "cli" else None,
+        "stub_config": server.state.config,
+        "stub_stats": server.state.stats(),
+        "span_percentiles": span_percentiles(os.path.join(workdir, "traces")),
+        "pets": results,
+        "workdir": workdir if args.keep else None,
+    }
+
+    os.makedirs(args.output, exist_ok=True)
+    report_file = os.path.join(args.output, f"benchmark_{args.mode}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"[INFO] Benchmark report saved to {report_file}")
+
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.min_pets_per_hour is not None and report["pets_per_hour"] < args.min_pets_per_hour:
+        print(f"[ERROR] Throughput {report['pets_per_hour']} pets/hour is below {args.min_pets_per_hour}.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
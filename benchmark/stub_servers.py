@@ -0,0 +1,403 @@
+"""Local HTTP stand-ins for Ollama, Replicate and file.io, so the pipeline can be benchmarked offline.
+
+One server answers all three APIs:
+    /api/chat, /api/tags, /api/pull    Ollama
+    /v1/...                            Replicate (models, trainings, predictions, versions)
+    /fileio/                           file.io upload
+    /files/<name>                      generated images and uploaded zips
+
+Point the pipeline at it with OLLAMA_HOST, REPLICATE_BASE_URL and FILEIO_URL (see stub_environment()).
+"""
+import re
+import json
+import time
+import uuid
+import random
+import struct
+import zlib
+import threading
+import argparse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_STUB_CONFIG = {
+    # Seconds before an Ollama answer starts, and how fast it streams
+    "ollama_latency": 0.2,
+    "ollama_tokens_per_second": 200,
+    # Seconds a training or an image prediction takes from creation to "succeeded"
+    "training_seconds": 5.0,
+    "prediction_seconds": 2.0,
+    # Seconds added to every Replicate and file.io request
+    "api_latency": 0.05,
+    "upload_latency": 0.5,
+    # Probability (0-1) that a request to a service fails with a 500
+    "failure_rates": {"ollama": 0.0, "replicate": 0.0, "fileio": 0.0},
+    "seed": None,
+}
+
+SPECIES = ["dog", "cat", "bird", "rodent"]
+FILLER_WORDS = (
+    "loves long walks gentle belly rubs sunny windows squeaky toys quiet evenings "
+    "new friends soft blankets treats and a patient family ready to share the couch"
+).split()
+
+def _tiny_png():
+    """A valid 1x1 PNG, enough for the download and save steps."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\xff\xaa\x66")) + chunk(b"IEND", b"")
+
+PNG_BYTES = _tiny_png()
+
+class StubState:
+    """What the stand-ins remember between requests, plus request counters for the report."""
+
+    def __init__(self, config):
+        self.config = config
+        self.random = random.Random(config.get("seed"))
+        self.lock = threading.Lock()
+        self.trainings = {}
+        self.predictions = {}
+        self.models = {}
+        self.request_counts = {}
+        self.failures_injected = {}
+
+    def count(self, service):
+        with self.lock:
+            self.request_counts[service] = self.request_counts.get(service, 0) + 1
+
+    def should_fail(self, service):
+        rate = self.config["failure_rates"].get(service, 0.0)
+        with self.lock:
+            failed = rate > 0 and self.random.random() < rate
+            if failed:
+                self.failures_injected[service] = self.failures_injected.get(service, 0) + 1
+        return failed
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.request_counts), "failures_injected": dict(self.failures_injected)}
+
+def synthetic_answer(prompt, rng):
+    """Answer an extraction prompt of 1_gather_pet_data.py with plausible, short text."""
+    name_match = re.search(r"Respond with only the name of the pet without any preamble or filler text\.: (\w+)", prompt)
+    if name_match:
+        return name_match.group(1)
+    if "general species" in prompt:
+        return rng.choice(SPECIES)
+    if "Respond with only the storyline" in prompt:
+        return " ".join(rng.choice(FILLER_WORDS) for _ in range(150)).capitalize() + "."
+    if "3 or 4 word" in prompt:
+        return " ".join(rng.choice(FILLER_WORDS) for _ in range(3)).capitalize()
+    return " ".join(rng.choice(FILLER_WORDS) for _ in range(20)).capitalize() + "."
+
+def synthetic_json_answer(schema, rng):
+    """Answer a structured-output request with an object that follows the schema's string and list properties."""
+    properties = schema.get("properties", {}) if isinstance(schema, dict) else {}
+    answer = {}
+    for key, prop in properties.items():
+        if prop.get("enum"):
+            answer[key] = rng.choice(prop["enum"])
+        elif prop.get("type") == "array":
+            answer[key] = [" ".join(rng.choice(FILLER_WORDS) for _ in range(8)).capitalize() + "."
+                           for _ in range(prop.get("minItems", 3))]
+        else:
+            answer[key] = " ".join(rng.choice(FILLER_WORDS) for _ in range(3))
+    return json.dumps(answer)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def config(self):
+        return self.server.state.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def base_url(self):
+        return f"http://{self.headers.get('Host', '%s:%d' % self.server.server_address[:2])}"
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_failure(self, service):
+        self.send_json({"detail": f"Injected {service} failure", "status": 500}, status=500)
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def route(self, method):
+        path = self.path.split("?")[0]
+        body = self.read_body() if method == "POST" else b""
+        if path.startswith("/api/"):
+            return self.handle_ollama(method, path, body)
+        if path.startswith("/v1/"):
+            return self.handle_replicate(method, path, body)
+        if path.startswith("/fileio"):
+            return self.handle_fileio(method)
+        if path.startswith("/files/") and method == "GET":
+            return self.handle_file(path)
+        self.send_json({"detail": "Not found"}, status=404)
+
+    # --- Ollama ---
+
+    def handle_ollama(self, method, path, body):
+        self.state.count("ollama")
+        if path in ("/api/tags", "/api/version", "/api/pull", "/api/show"):
+            return self.send_json({"models": [], "version": "stub", "status": "success"})
+        if path not in ("/api/chat", "/api/generate"):
+            return self.send_json({"error": "not found"}, status=404)
+
+        request = json.loads(body or b"{}")
+        time.sleep(self.config["ollama_latency"])
+        if self.state.should_fail("ollama"):
+            return self.send_json({"error": "Injected ollama failure"}, status=500)
+
+        messages = request.get("messages") or [{"content": request.get("prompt", "")}]
+        with self.state.lock:
+            if request.get("format"):
+                answer = synthetic_json_answer(request["format"], self.state.random)
+            else:
+                answer = synthetic_answer(messages[-1].get("content", ""), self.state.random)
+        words = answer.split(" ")
+        model = request.get("model", "stub")
+
+        if not request.get("stream", True):
+            time.sleep(len(words) / self.config["ollama_tokens_per_second"])
+            return self.send_json({
+                "model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "message": {"role": "assistant", "content": answer}, "response": answer,
+                "done": True, "done_reason": "stop", "prompt_eval_count": len(messages[-1].get("content", "").split()),
+                "eval_count": len(words),
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, word in enumerate(words):
+            time.sleep(1 / self.config["ollama_tokens_per_second"])
+            token = word if index == 0 else " " + word
+            self.write_chunk({"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                              "message": {"role": "assistant", "content": token}, "done": False})
+        self.write_chunk({"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                          "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop",
+                          "prompt_eval_count": len(messages[-1].get("content", "").split()), "eval_count": len(words)})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    # --- Replicate ---
+
+    def handle_replicate(self, method, path, body):
+        self.state.count("replicate")
+        time.sleep(self.config["api_latency"])
+        if self.state.should_fail("replicate"):
+            return self.send_failure("replicate")
+        request = json.loads(body or b"{}") if body else {}
+        now = time.time()
+
+        if method == "POST" and path == "/v1/models":
+            model = {
+                "owner": request.get("owner"), "name": request.get("name"),
+                "description": request.get("description"), "visibility": request.get("visibility", "private"),
+                "url": f"{self.base_url()}/{request.get('owner')}/{request.get('name')}",
+                "github_url": None, "paper_url": None, "license_url": None, "run_count": 0,
+                "cover_image_url": None, "default_example": None, "latest_version": None,
+            }
+            with self.state.lock:
+                self.state.models[(model["owner"], model["name"])] = model
+            return self.send_json(model, status=201)
+
+        match = re.fullmatch(r"/v1/models/([^/]+)/([^/]+)/versions/([^/]+)/trainings", path)
+        if method == "POST" and match:
+            training_id = uuid.uuid4().hex[:20]
+            with self.state.lock:
+                self.state.trainings[training_id] = {"created": now, "destination": request.get("destination"),
+                                                    "input": request.get("input", {}), "version": match.group(3)}
+            if request.get("webhook"):
+                threading.Timer(self.config["training_seconds"], self.send_training_webhook,
+                                args=(training_id, request["webhook"])).start()
+            return self.send_json(self.training_payload(training_id), status=201)
+
+        match = re.fullmatch(r"/v1/trainings/([^/]+)", path)
+        if method == "GET" and match:
+            if match.group(1) not in self.state.trainings:
+                return self.send_json({"detail": "Not found"}, status=404)
+            return self.send_json(self.training_payload(match.group(1)))
+
+        match = re.fullmatch(r"/v1/models/([^/]+)/([^/]+)/versions", path)
+        if method == "GET" and match:
+            version_id = uuid.uuid5(uuid.NAMESPACE_URL, f"{match.group(1)}/{match.group(2)}").hex
+            return self.send_json({"next": None, "previous": None, "results": [self.version_payload(version_id)]})
+
+        # replicate.run() fetches the version of "owner/name:version" before it waits for the prediction
+        match = re.fullmatch(r"/v1/models/([^/]+)/([^/]+)/versions/([^/]+)", path)
+        if method == "GET" and match:
+            return self.send_json(self.version_payload(match.group(3)))
+
+        if method == "POST" and (path == "/v1/predictions" or re.fullmatch(r"/v1/models/[^/]+/[^/]+/predictions", path)):
+            prediction_id = uuid.uuid4().hex[:20]
+            with self.state.lock:
+                self.state.predictions[prediction_id] = {"created": now, "input": request.get("input", {}),
+                                                        "version": request.get("version")}
+            # "Prefer: wait[=n]" (sent by replicate.run) holds the answer until the prediction is done or n seconds pass
+            wait = re.fullmatch(r"wait(?:=(\d+))?", self.headers.get("Prefer", "").strip())
+            if wait:
+                time.sleep(min(self.config["prediction_seconds"], float(wait.group(1) or 60)))
+            return self.send_json(self.prediction_payload(prediction_id), status=201)
+
+        match = re.fullmatch(r"/v1/predictions/([^/]+)", path)
+        if method == "GET" and match:
+            if match.group(1) not in self.state.predictions:
+                return self.send_json({"detail": "Not found"}, status=404)
+            return self.send_json(self.prediction_payload(match.group(1)))
+
+        self.send_json({"detail": f"Stub has no route for {method} {path}"}, status=404)
+
+    def version_payload(self, version_id):
+        """A model version whose output is a list of image URLs, like the trained LoRA models."""
+        return {
+            "id": version_id, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "cog_version": "stub",
+            "openapi_schema": {"components": {"schemas": {
+                "Output": {"type": "array", "items": {"type": "string", "format": "uri"}},
+            }}},
+        }
+
+    def training_payload(self, training_id):
+        training = self.state.trainings[training_id]
+        elapsed = time.time() - training["created"]
+        duration = self.config["training_seconds"]
+        status = "succeeded" if elapsed >= duration else ("processing" if elapsed >= duration * 0.1 else "starting")
+        return {
+            "id": training_id, "status": status, "version": training["version"], "input": training["input"],
+            "model": "ostris/flux-dev-lora-trainer",
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(training["created"])),
+            "output": {"version": f"{training['destination']}:{uuid.uuid4().hex}"} if status == "succeeded" else None,
+            "logs": "", "error": None,
+            "urls": {"get": f"{self.base_url()}/v1/trainings/{training_id}",
+                     "cancel": f"{self.base_url()}/v1/trainings/{training_id}/cancel"},
+        }
+
+    def send_training_webhook(self, training_id, webhook_url):
+        """POST the finished training to its webhook, like Replicate's "completed" event."""
+        self.state.count("webhook")
+        body = json.dumps(self.training_payload(training_id)).encode("utf-8")
+        request = urllib.request.Request(webhook_url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except OSError:
+            # The pipeline polls for trainings whose webhook does not arrive
+            pass
+
+    def prediction_payload(self, prediction_id):
+        prediction = self.state.predictions[prediction_id]
+        elapsed = time.time() - prediction["created"]
+        status = "succeeded" if elapsed >= self.config["prediction_seconds"] else "processing"
+        num_outputs = int(prediction["input"].get("num_outputs", 1) or 1)
+        output_format = prediction["input"].get("output_format", "png")
+        output = [f"{self.base_url()}/files/{prediction_id}_{i}.{output_format}" for i in range(num_outputs)]
+        return {
+            "id": prediction_id, "status": status, "version": prediction["version"], "input": prediction["input"],
+            "model": "stub/model", "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "output": output if status == "succeeded" else None, "logs": "", "error": None,
+            "urls": {"get": f"{self.base_url()}/v1/predictions/{prediction_id}",
+                     "cancel": f"{self.base_url()}/v1/predictions/{prediction_id}/cancel"},
+        }
+
+    # --- file.io and files ---
+
+    def handle_fileio(self, method):
+        self.state.count("fileio")
+        time.sleep(self.config["upload_latency"])
+        if method != "POST":
+            return self.send_json({"success": False}, status=405)
+        if self.state.should_fail("fileio"):
+            return self.send_failure("fileio")
+        key = uuid.uuid4().hex[:12]
+        self.send_json({"success": True, "status": 200, "key": key, "link": f"{self.base_url()}/files/upload_{key}.zip"})
+
+    def handle_file(self, path):
+        self.state.count("files")
+        body = PNG_BYTES if not path.endswith(".zip") else b"PK\x05\x06" + b"\x00" * 18
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png" if not path.endswith(".zip") else "application/zip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        merged = dict(DEFAULT_STUB_CONFIG)
+        merged.update(config or {})
+        merged["failure_rates"] = dict(DEFAULT_STUB_CONFIG["failure_rates"], **(config or {}).get("failure_rates", {}))
+        self.state = StubState(merged)
+        super().__init__((host, port), StubHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """Start the stand-ins on a background thread and return the server (server.url, server.shutdown())."""
+    server = StubServer(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def stub_environment(server_url, training_poll_interval=1.0, training_seconds=None, webhooks=False):
+    """Environment variables that point the pipeline at the stand-ins.
+
+    With webhooks, every pipeline process receives training webhooks on a port of its own.
+    """
+    environment = {
+        "OLLAMA_HOST": server_url,
+        "OLLAMA_EXTERNAL_SERVER": "1",
+        "REPLICATE_BASE_URL": server_url,
+        "REPLICATE_API_TOKEN": "benchmark-token",
+        "REPLICATE_POLL_INTERVAL": "0.2",
+        "REPLICATE_TRAINING_POLL_INTERVAL": str(training_poll_interval),
+        "FILEIO_URL": f"{server_url}/fileio/",
+    }
+    if training_seconds is not None:
+        environment["REPLICATE_TRAINING_EXPECTED_SECONDS"] = str(training_seconds)
+        environment["REPLICATE_TRAINING_MIN_POLL_INTERVAL"] = str(min(training_poll_interval, 0.2))
+    if webhooks:
+        environment["REPLICATE_WEBHOOK_PORT"] = "0"
+    return environment
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Ollama/Replicate/file.io stand-ins on their own.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--training-seconds", type=float, default=DEFAULT_STUB_CONFIG["training_seconds"])
+    parser.add_argument("--prediction-seconds", type=float, default=DEFAULT_STUB_CONFIG["prediction_seconds"])
+    args = parser.parse_args()
+
+    server = StubServer({"training_seconds": args.training_seconds, "prediction_seconds": args.prediction_seconds}, port=args.port)
+    print(f"[INFO] Stand-ins listening on {server.url}")
+    for key, value in stub_environment(server.url).items():
+        print(f"export {key}={value}")
+    server.serve_forever()
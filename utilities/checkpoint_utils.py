@@ -0,0 +1,89 @@
+import os
+import json
+import glob
+import hashlib
+from datetime import datetime
+from utilities.pet_catalog_utils import get_recent_pets
+
+def hash_inputs(*values):
+    """Return a stable content hash of JSON-serialisable stage inputs."""
+    encoded = json.dumps(values, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 of a file's contents, or an empty string if it does not exist."""
+    if not file_path or not os.path.isfile(file_path):
+        return ""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_checkpoint(record, stage):
+    """Return the checkpoint entry of a stage in the pet record, or None."""
+    return record.get("checkpoints", {}).get(stage)
+
+def is_stage_complete(record, stage, input_hash):
+    """True if the stage finished with exactly these inputs."""
+    checkpoint = get_checkpoint(record, stage)
+    return bool(checkpoint and checkpoint.get("status") == "completed" and checkpoint.get("input_hash") == input_hash)
+
+def mark_stage_started(record, stage, input_hash):
+    """Record that a stage started with these inputs, keeping finished steps if the inputs are unchanged."""
+    checkpoints = record.setdefault("checkpoints", {})
+    previous = checkpoints.get(stage) or {}
+    steps = previous.get("completed_steps", []) if previous.get("input_hash") == input_hash else []
+    checkpoints[stage] = {
+        "status": "started",
+        "input_hash": input_hash,
+        "started_at": datetime.now().isoformat(),
+        "completed_steps": steps,
+    }
+
+def mark_stage_complete(record, stage, input_hash):
+    """Record the completion marker of a stage."""
+    checkpoint = record.setdefault("checkpoints", {}).setdefault(stage, {})
+    checkpoint.update({
+        "status": "completed",
+        "input_hash": input_hash,
+        "completed_at": datetime.now().isoformat(),
+    })
+
+def is_step_complete(record, stage, step):
+    """True if a named step inside a stage already finished."""
+    checkpoint = get_checkpoint(record, stage) or {}
+    return step in checkpoint.get("completed_steps", [])
+
+def mark_step_complete(record, stage, step):
+    """Record that a named step inside a stage finished."""
+    checkpoint = record.setdefault("checkpoints", {}).setdefault(stage, {})
+    steps = checkpoint.setdefault("completed_steps", [])
+    if step not in steps:
+        steps.append(step)
+
+def _is_resumable(json_file, stages):
+    try:
+        with open(json_file, "r") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+    checkpoints = record.get("checkpoints") if isinstance(record, dict) else None
+    if not checkpoints:
+        return False
+    return not all(checkpoints.get(stage, {}).get("status") == "completed" for stage in stages)
+
+def find_latest_resumable_record(stages, base_dir="pet_directory"):
+    """Find the most recent pet record that carries checkpoints but has not finished every stage.
+
+    Only the latest pets in the pet catalog are checked; base_dir is scanned when the catalog has none.
+    """
+    recent_pets = get_recent_pets()
+    if recent_pets:
+        return next((pet["json_file"] for pet in recent_pets if _is_resumable(pet["json_file"], stages)), None)
+
+    candidates = [json_file for json_file in glob.glob(os.path.join(base_dir, "**", "*.json"), recursive=True)
+                  if _is_resumable(json_file, stages)]
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
@@ -2,8 +2,9 @@ import os
 import zipfile
 import shutil
 from datetime import datetime
+from utilities.image_preprocess_utils import IMAGE_EXTENSIONS
 
-def zip_files(directory_to_zip, output_directory='zip_uploads', output_filename=None):
+def zip_files(directory_to_zip, output_directory='zip_uploads', output_filename=None, file_names=None):
     archive_directory = os.path.join(output_directory, 'archive')
 
     # Move existing .zip files to the archive directory
@@ -23,11 +24,11 @@ def zip_files(directory_to_zip, output_directory='zip_uploads', output_filename=
 
     output_filepath = os.path.join(output_directory, output_filename)
 
-    # Zip the files in the provided directory
+    # Zip the files in the provided directory, or only file_names of it when given
     with zipfile.ZipFile(output_filepath, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
-        for file_name in os.listdir(directory_to_zip):
+        for file_name in (os.listdir(directory_to_zip) if file_names is None else file_names):
             file_path = os.path.join(directory_to_zip, file_name)
-            if os.path.isfile(file_path) and file_name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp')):
+            if os.path.isfile(file_path) and file_name.lower().endswith(IMAGE_EXTENSIONS):
                 zipf.write(file_path, file_name)
 
     print(f"[INFO] Zip file created at location: {output_filepath}")
@@ -1,9 +1,13 @@
 import os
 import requests
+from utilities.trace_utils import span
 
+FILEIO_URL = os.getenv("FILEIO_URL", "https://file.io/")
+
+@span("fileio.upload", category="upload")
 def upload_file_to_fileio(file_path):
     """Upload a file to file.io and return the download URL."""
-    url = "https://file.io/"
+    url = FILEIO_URL
     print(f"[INFO] Starting the upload to file.io for file: {file_path}")
 
     # Check if the file exists
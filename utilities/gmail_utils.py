@@ -3,7 +3,6 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from google.cloud import secretmanager
 from os import environ, path
 from dotenv import load_dotenv
 import logging
@@ -22,6 +21,8 @@ def load_env_file():
     return False
 
 def get_secret_version(project_id, secret_id, version_id="latest"):
+    # Only needed without a .env file
+    from google.cloud import secretmanager
     client = secretmanager.SecretManagerServiceClient()
     name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
     response = client.access_secret_version(request={"name": name})
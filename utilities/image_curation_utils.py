@@ -0,0 +1,95 @@
+import os
+from utilities.image_preprocess_utils import IMAGE_EXTENSIONS, map_images
+
+# dHash of a 9x8 grayscale thumbnail: 64 bits, one per horizontal brightness step
+HASH_SIZE = 8
+# Sharpness is measured at this shorter side, so photos of different sizes score alike
+SHARPNESS_SIDE = 512
+
+def image_features(image_path):
+    """Perceptual hash bits and sharpness (variance of the Laplacian) of one image, or None if unreadable."""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(image_path) as image:
+            gray = ImageOps.exif_transpose(image).convert("L")
+    except Exception:
+        return None
+
+    thumbnail = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    hash_bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+
+    scale = SHARPNESS_SIDE / min(gray.size)
+    if scale < 1:
+        gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float32)
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+    return {"hash_bits": hash_bits, "sharpness": float(laplacian.var()) if laplacian.size else 0.0}
+
+def curate_images(image_dir, duplicate_distance=6, blur_threshold=50.0, max_images=30, min_images=5,
+                  max_workers=None):
+    """Choose the images of image_dir worth training on. Returns (file names to keep, report).
+
+    Images whose hashes differ in at most duplicate_distance of 64 bits form a cluster, of which
+    only the sharpest is kept. Images below blur_threshold are rejected unless fewer than min_images
+    would remain, and at most max_images of the sharpest are kept. Images that cannot be read are kept
+    unchecked. The report records the decision, sharpness and hash of every image.
+    """
+    import numpy as np
+
+    file_names = sorted(
+        file_name for file_name in os.listdir(image_dir)
+        if os.path.isfile(os.path.join(image_dir, file_name)) and file_name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    features = map_images(image_features, [(os.path.join(image_dir, file_name),) for file_name in file_names], max_workers)
+
+    decisions = {file_name: {"file": file_name, "decision": "unchecked"} for file_name in file_names}
+    readable = [(file_name, feature) for file_name, feature in zip(file_names, features) if feature is not None]
+    if readable:
+        bits = np.array([feature["hash_bits"] for _, feature in readable])
+        sharpness = np.array([feature["sharpness"] for _, feature in readable])
+        # Pairwise Hamming distances of all hashes at once
+        distances = (bits[:, None, :] != bits[None, :, :]).sum(axis=2)
+
+        # Sharpest first, so each cluster is represented by its sharpest member
+        order = np.argsort(-sharpness, kind="stable")
+        cluster_of = np.full(len(readable), -1)
+        for index in order:
+            if cluster_of[index] >= 0:
+                continue
+            members = (distances[index] <= duplicate_distance) & (cluster_of < 0)
+            cluster_of[members] = index
+
+        weights = 1 << np.arange(bits.shape[1] - 1, -1, -1, dtype=np.uint64)
+        hashes = (bits.astype(np.uint64) * weights).sum(axis=1)
+        for index, (file_name, _) in enumerate(readable):
+            decisions[file_name].update(sharpness=round(float(sharpness[index]), 1), dhash=f"{int(hashes[index]):016x}")
+            if cluster_of[index] != index:
+                decisions[file_name].update(decision="duplicate", duplicate_of=readable[cluster_of[index]][0])
+
+        representatives = [index for index in order if cluster_of[index] == index]
+        sharp = [index for index in representatives if sharpness[index] >= blur_threshold]
+        blurry = [index for index in representatives if sharpness[index] < blur_threshold]
+        # Too few sharp photos: keep the least blurry ones rather than train on almost nothing
+        kept = sharp + blurry[:max(0, min_images - len(sharp))]
+        for position, index in enumerate(kept):
+            decisions[readable[index][0]]["decision"] = "kept" if position < max_images else "over_limit"
+        for index in blurry[max(0, min_images - len(sharp)):]:
+            decisions[readable[index][0]]["decision"] = "blurry"
+
+    keep = [file_name for file_name in file_names if decisions[file_name]["decision"] in ("kept", "unchecked")]
+    counts = {}
+    for decision in decisions.values():
+        counts[decision["decision"]] = counts.get(decision["decision"], 0) + 1
+    report = {
+        "images": len(file_names),
+        "kept": len(keep),
+        "decision_counts": counts,
+        "duplicate_distance": duplicate_distance,
+        "blur_threshold": blur_threshold,
+        "max_images": max_images,
+        "decisions": [decisions[file_name] for file_name in file_names],
+    }
+    return keep, report
@@ -0,0 +1,116 @@
+import os
+import time
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Extensions zip_files puts into the training zip
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp')
+# Fewer images than this are handled in the calling process; starting a pool would cost more than it saves
+PROCESS_POOL_MIN_IMAGES = 8
+
+def map_images(function, arguments, max_workers=None):
+    """Call function(*args) for every tuple in arguments and return the results in order.
+
+    Enough images go to a process pool of fresh interpreters. The callers run in task-graph and batch
+    worker threads next to Ollama and HTTP client threads, and a forked child could inherit a lock
+    one of those threads held.
+    """
+    workers = min(max_workers or os.cpu_count() or 1, len(arguments))
+    if len(arguments) < PROCESS_POOL_MIN_IMAGES or workers < 2:
+        return [function(*args) for args in arguments]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(function, *zip(*arguments)))
+
+def plan_output_names(file_names):
+    """Give every source file a distinct .jpg name, compared case-insensitively.
+
+    A file keeps its stem where it can (photo.png becomes photo.jpg); a clash adds the original
+    extension (photo.jpeg next to photo.jpg becomes photo_jpeg.jpg), then a counter. Files that are
+    already .jpg choose first, so they keep their names.
+    """
+    taken = set()
+    output_names = {}
+    for file_name in sorted(file_names, key=lambda name: (not name.lower().endswith(".jpg"), name)):
+        stem, extension = os.path.splitext(file_name)
+        output_name = f"{stem}.jpg"
+        if output_name.lower() in taken:
+            output_name = f"{stem}_{extension[1:].lower()}.jpg"
+        base, counter = output_name[:-len(".jpg")], 2
+        while output_name.lower() in taken:
+            output_name = f"{base}_{counter}.jpg"
+            counter += 1
+        taken.add(output_name.lower())
+        output_names[file_name] = output_name
+    return output_names
+
+def preprocess_image(source_path, output_dir, min_side, quality=90, output_name=None):
+    """Prepare one photo for training and return what it cost and saved.
+
+    Applies the EXIF orientation, scales the image down until its shorter side is min_side (never up),
+    and writes it as a JPEG of the given quality without EXIF, GPS or other metadata to output_name
+    (default: the file's stem with .jpg). Images Pillow cannot read are copied unchanged, under the
+    stem of output_name with their own extension.
+    """
+    from PIL import Image, ImageOps
+
+    file_name = os.path.basename(source_path)
+    output_name = output_name or f"{os.path.splitext(file_name)[0]}.jpg"
+    result = {"file": file_name, "original_bytes": os.path.getsize(source_path)}
+    try:
+        with Image.open(source_path) as image:
+            result["original_size"] = list(image.size)
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                # Flatten transparency onto white; the trainer sees a plain photo either way
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+
+            width, height = image.size
+            scale = min_side / min(width, height)
+            if scale < 1:
+                image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+            output_path = os.path.join(output_dir, output_name)
+            image.save(output_path, "JPEG", quality=quality, optimize=True)
+            result["output_size"] = list(image.size)
+    except Exception as e:
+        output_path = os.path.join(output_dir, os.path.splitext(output_name)[0] + os.path.splitext(file_name)[1])
+        shutil.copyfile(source_path, output_path)
+        result["error"] = str(e)
+    result["output_bytes"] = os.path.getsize(output_path)
+    return result
+
+def preprocess_images(source_dir, output_dir, min_side, quality=90, max_workers=None):
+    """Preprocess every image in source_dir into output_dir (see map_images) and return a report.
+
+    The report holds the bytes before and after, the bytes saved, the size ratio and the images
+    that were copied unchanged because they could not be read.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    source_paths = sorted(
+        os.path.join(source_dir, file_name) for file_name in os.listdir(source_dir)
+        if os.path.isfile(os.path.join(source_dir, file_name)) and file_name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    output_names = plan_output_names([os.path.basename(path) for path in source_paths])
+    start_time = time.time()
+    results = map_images(preprocess_image, [(path, output_dir, min_side, quality, output_names[os.path.basename(path)])
+                                            for path in source_paths], max_workers)
+
+    original_bytes = sum(result["original_bytes"] for result in results)
+    output_bytes = sum(result["output_bytes"] for result in results)
+    return {
+        "images": len(results),
+        "min_side": min_side,
+        "quality": quality,
+        "original_bytes": original_bytes,
+        "output_bytes": output_bytes,
+        "saved_bytes": original_bytes - output_bytes,
+        "size_ratio": round(original_bytes / output_bytes, 2) if output_bytes else 0.0,
+        "seconds": round(time.time() - start_time, 2),
+        "unchanged": [result["file"] for result in results if "error" in result],
+    }
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+JOB_QUEUE_DB = "job_queue.sqlite3"
+JOB_STAGING_DIR = "job_staging"
+
+_db_lock = threading.Lock()
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"]) if job["payload"] else {}
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def init_job_queue(db_path=JOB_QUEUE_DB):
+    """Create the jobs table and put jobs interrupted by a restart back in the queue."""
+    with _db_lock:
+        conn = _connect(db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_kind_status ON jobs (kind, status, created_at)")
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+        finally:
+            conn.close()
+    if requeued:
+        print(f"[INFO] Re-queued {requeued} job(s) interrupted by a restart.")
+
+def new_job_id():
+    """Generate a job ID that is also safe to use as a directory name."""
+    return uuid.uuid4().hex
+
+def create_job_staging_dir(job_id, staging_root=JOB_STAGING_DIR):
+    """Create the private upload directories for one job."""
+    job_dir = os.path.join(staging_root, job_id)
+    zip_uploads_dir = os.path.join(job_dir, "zip_uploads")
+    os.makedirs(zip_uploads_dir, exist_ok=True)
+    return {"job_dir": job_dir, "zip_uploads_dir": zip_uploads_dir}
+
+def enqueue_job(kind, payload, job_id=None, max_queued=None, db_path=JOB_QUEUE_DB):
+    """Add a job to the queue. Returns the job ID, or None if the queue for this kind is full."""
+    job_id = job_id or new_job_id()
+    with _db_lock:
+        conn = _connect(db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if max_queued is not None:
+                queued = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE kind = ? AND status = 'queued'", (kind,)
+                ).fetchone()[0]
+                if queued >= max_queued:
+                    conn.execute("ROLLBACK")
+                    return None
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), time.time())
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+    return job_id
+
+def claim_next_job(kind, db_path=JOB_QUEUE_DB):
+    """Atomically mark the oldest queued job of this kind as running and return it."""
+    with _db_lock:
+        conn = _connect(db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND status = 'queued' ORDER BY created_at LIMIT 1", (kind,)
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            started_at = time.time()
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (started_at, row["id"]))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+    job = _row_to_job(row)
+    job["status"] = "running"
+    job["started_at"] = started_at
+    return job
+
+def finish_job(job_id, succeeded, result=None, error=None, db_path=JOB_QUEUE_DB):
+    """Record the outcome of a job."""
+    status = "succeeded" if succeeded else "failed"
+    with _db_lock:
+        conn = _connect(db_path)
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+        finally:
+            conn.close()
+
+def get_job(job_id, db_path=JOB_QUEUE_DB):
+    """Return a job as a dict, or None if it does not exist."""
+    with _db_lock:
+        conn = _connect(db_path)
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+    return _row_to_job(row)
+
+def get_queue_position(job_id, db_path=JOB_QUEUE_DB):
+    """Return how many queued jobs of the same kind are ahead of this one (0 = next)."""
+    with _db_lock:
+        conn = _connect(db_path)
+        try:
+            row = conn.execute("SELECT kind, created_at, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] != "queued":
+                return None
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE kind = ? AND status = 'queued' AND created_at < ?",
+                (row["kind"], row["created_at"])
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+def run_worker(kind, handler, poll_interval=1.0, sleep=time.sleep, db_path=JOB_QUEUE_DB):
+    """Claim and run jobs of one kind forever. handler(job) returns a result dict or raises."""
+    while True:
+        job = claim_next_job(kind, db_path)
+        if job is None:
+            sleep(poll_interval)
+            continue
+
+        print(f"[INFO] Worker picked up {kind} job {job['id']}")
+        try:
+            result = handler(job)
+            finish_job(job["id"], True, result=result, db_path=db_path)
+            print(f"[INFO] {kind} job {job['id']} finished.")
+        except Exception as e:
+            finish_job(job["id"], False, error=str(e), db_path=db_path)
+            print(f"[ERROR] {kind} job {job['id']} failed: {e}")
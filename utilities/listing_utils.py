@@ -0,0 +1,53 @@
+import re
+
+# Labels of the shelter-site listing format (see PET_DESCRIPTION) -> pet record keys
+LISTING_LABELS = {
+    "pet id": "pet_ID",
+    "pet type": "type",
+    "sex": "gender",
+    "age": "age",
+    "breed": "breed",
+    "size": "size",
+    "location": "location",
+}
+BEHAVIOR_SECTION = "behavioral characteristics"
+DETAILS_SECTION = "additional details"
+
+def _normalize_label(line):
+    return re.sub(r"\s+", " ", line.strip().rstrip(":")).lower()
+
+def _is_heading(line):
+    label = _normalize_label(line)
+    return label in LISTING_LABELS or label in (BEHAVIOR_SECTION, DETAILS_SECTION)
+
+def parse_shelter_listing(description):
+    """Read the labelled fields of a shelter listing without asking a model.
+
+    Each label ("Pet ID", "Sex", "Breed", ...) stands on its own line with the value on the next one;
+    "Behavioral characteristics" is followed by trait blocks of a title line and an explanation.
+    Returns the fields found, keyed like the pet record; labels that are missing or empty are left out.
+    """
+    lines = [line.strip() for line in description.splitlines()]
+    fields = {}
+    for index, line in enumerate(lines):
+        label = _normalize_label(line)
+        if label in LISTING_LABELS and LISTING_LABELS[label] not in fields:
+            # The value is the next non-empty line, unless that is already the next label
+            value = next((candidate for candidate in lines[index + 1:] if candidate), "")
+            if value and not _is_heading(value):
+                fields[LISTING_LABELS[label]] = value
+        elif label == BEHAVIOR_SECTION and "behavioral_characteristics" not in fields:
+            traits = []
+            new_block = True
+            for candidate in lines[index + 1:]:
+                if not candidate:
+                    new_block = True
+                    continue
+                if _is_heading(candidate):
+                    break
+                if new_block:
+                    traits.append(candidate)
+                    new_block = False
+            if traits:
+                fields["behavioral_characteristics"] = ", ".join(traits)
+    return fields
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextvars
+
+# Answers of the local LLM, keyed by model digest, prompt and options, shared by every run on this machine
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "llm_cache.sqlite3")
+LLM_CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", 64)) * 1024 * 1024)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").lower() not in ("0", "false", "no")
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_total_stats = {"hits": 0, "misses": 0}
+# Counters of the stage run this context belongs to, so concurrent pets in a batch count separately
+_context_stats = contextvars.ContextVar("llm_cache_stats", default=None)
+
+def _connect(db_path):
+    """One connection per thread and database; the table is created on first use."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used_at)")
+        connections[db_path] = conn
+    return conn
+
+def make_cache_key(model_digest, messages, options=None, output_format=None):
+    """Content address of a request: the same model weights, prompt and sampling options give the same key."""
+    encoded = json.dumps([model_digest, messages, options or {}, output_format], sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+def track_cache_stats(stats=None):
+    """Count the hits and misses of the current context (one stage run) in stats and return it.
+
+    Pass the same dict again from a later task of the stage to keep adding to it.
+    """
+    if stats is None:
+        stats = {"hits": 0, "misses": 0}
+    _context_stats.set(stats)
+    return stats
+
+def _count(outcome):
+    with _stats_lock:
+        _total_stats[outcome] += 1
+        stats = _context_stats.get()
+        if stats is not None:
+            stats[outcome] = stats.get(outcome, 0) + 1
+
+def get_cache_stats(stats=None):
+    """Hits, misses and hit rate of a tracked dict, or of this process when stats is None."""
+    with _stats_lock:
+        stats = dict(stats if stats is not None else _total_stats)
+    lookups = stats.get("hits", 0) + stats.get("misses", 0)
+    stats["hit_rate"] = round(stats.get("hits", 0) / lookups, 3) if lookups else 0.0
+    return stats
+
+def get_cached_response(key, db_path=LLM_CACHE_DB):
+    """Return the cached answer for key, or None on a miss (or when the cache is disabled)."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        conn = _connect(db_path)
+        row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            conn.execute("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (time.time(), key))
+    except sqlite3.Error as e:
+        print(f"[WARNING] LLM cache lookup failed: {e}")
+        row = None
+    _count("hits" if row is not None else "misses")
+    return row[0] if row is not None else None
+
+def store_cached_response(key, model_name, response, max_bytes=LLM_CACHE_MAX_BYTES, db_path=LLM_CACHE_DB):
+    """Cache an answer, then evict the least recently used answers until the cache fits in max_bytes."""
+    if not LLM_CACHE_ENABLED or not response:
+        return
+    now = time.time()
+    try:
+        conn = _connect(db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, response, len(response.encode("utf-8")), now, now)
+            )
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0] - max_bytes
+            if excess > 0:
+                evict = []
+                for old_key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used_at"):
+                    if excess <= 0:
+                        break
+                    evict.append((old_key,))
+                    excess -= size
+                conn.executemany("DELETE FROM llm_cache WHERE key = ?", evict)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        print(f"[WARNING] Could not cache the LLM response: {e}")
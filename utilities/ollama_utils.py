@@ -1,10 +1,15 @@
 import os
+import sys
 import subprocess
 import shutil
 import psutil
 import requests
 import time
 import socket
+import threading
+import contextvars
+from utilities.trace_utils import span
+from utilities.llm_cache_utils import make_cache_key, get_cached_response, store_cached_response
 
 # Define paths and globals
 OLLAMA_EXE_PATH = "ollama"  # Assuming this is in the PATH if installed
@@ -12,7 +17,27 @@ OLLAMA_RUNNERS_DIR = os.path.join(os.getcwd(), "ollama", "ollama_runners")
 OLLAMA_TEMP_DIR = os.path.join(os.getcwd(), "ollama_temp")
 OLLAMA_ZIP_PATH = os.path.join(os.getcwd(), "Ollama-darwin.zip")
 OLLAMA_PROCESS = None
+# PID of the server this process already started an idle watcher for
+_idle_watcher_pid = None
+# Model name -> digest reported by the server, looked up once per process
+_model_digests = {}
+# Token counts of the stage run this context belongs to (see track_llm_usage)
+_llm_usage = contextvars.ContextVar("llm_usage", default=None)
+_llm_usage_lock = threading.Lock()
 OLLAMA_PORT = 11434  # Define the port used by Ollama
+# Requests the Ollama server answers at the same time; keep in step with the server's OLLAMA_NUM_PARALLEL
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", 4))
+# Comma-separated base URLs of Ollama servers on other hosts; requests go to the least-loaded healthy one
+OLLAMA_HOSTS = [host.strip().rstrip("/") for host in os.getenv("OLLAMA_HOSTS", "").split(",") if host.strip()]
+# Seconds a failed endpoint is skipped before it gets requests again
+OLLAMA_ENDPOINT_RETRY_AFTER = 30
+# Set when the server at OLLAMA_HOST is run by someone else (a shared box, the benchmark stand-in)
+OLLAMA_EXTERNAL_SERVER = bool(OLLAMA_HOSTS) or os.getenv("OLLAMA_EXTERNAL_SERVER", "").lower() in ("1", "true", "yes")
+# Seconds without requests after which the model is unloaded and a server started here shuts down (0 = stop after each run)
+OLLAMA_IDLE_TIMEOUT = int(os.getenv("OLLAMA_IDLE_TIMEOUT", 1800))
+OLLAMA_KEEP_ALIVE = f"{OLLAMA_IDLE_TIMEOUT}s" if OLLAMA_IDLE_TIMEOUT > 0 else None
+# Seconds to wait for a freshly started server to answer
+OLLAMA_START_TIMEOUT = 30
 
 DEFAULT_MODELS_DIR = os.path.join(os.path.expanduser("~"), ".ollama", "models")
 
@@ -76,6 +101,8 @@ def install_ollama_pkg():
 
 def kill_existing_ollama_service():
     """Kill any existing Ollama service instances to free up the port."""
+    if OLLAMA_EXTERNAL_SERVER:
+        return
     for process in psutil.process_iter(['pid', 'name', 'username']):
         try:
             if 'ollama' in process.info['name'].lower() and process.info['username'] == os.getlogin():
@@ -101,23 +128,66 @@ def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('127.0.0.1', port)) == 0
 
-def start_ollama_service():
-    """Start Ollama service."""
+def get_ollama_url():
+    """Base URL of the Ollama server, from OLLAMA_HOST like the ollama package reads it."""
+    host = os.getenv("OLLAMA_HOST", f"127.0.0.1:{OLLAMA_PORT}")
+    if "://" not in host:
+        host = f"http://{host}"
+    if host.count(":") < 2:
+        host = f"{host.rstrip('/')}:{OLLAMA_PORT}"
+    return host.rstrip("/")
+
+def is_ollama_server_healthy(timeout=2):
+    """True if an Ollama server answers on its API (a process merely holding the port does not count)."""
+    try:
+        return requests.get(f"{get_ollama_url()}/api/version", timeout=timeout).ok
+    except requests.RequestException:
+        return False
+
+def wait_for_ollama_server(timeout=OLLAMA_START_TIMEOUT):
+    """Poll the server with backoff until it answers; returns False after timeout seconds."""
+    deadline = time.time() + timeout
+    delay = 0.1
+    while time.time() < deadline:
+        if is_ollama_server_healthy():
+            return True
+        time.sleep(min(delay, max(deadline - time.time(), 0)))
+        delay = min(delay * 2, 2)
+    return is_ollama_server_healthy()
+
+def start_ollama_service(max_loaded_models=1):
+    """Start the Ollama service, or reuse one that is already running and healthy.
+
+    max_loaded_models is how many models the server keeps in memory at once, so routing questions to
+    several models does not unload and reload them between requests.
+    """
     global OLLAMA_PROCESS
+    if is_ollama_server_healthy():
+        print("Reusing the running Ollama service.")
+        return True
     print("Starting Ollama service...")
 
     retries = 3
     while retries > 0:
         if is_port_in_use(OLLAMA_PORT):
-            print(f"Port {OLLAMA_PORT} is already in use. Assuming Ollama service is running.")
-            return True  # Treat it as success if the port is already in use
+            # Something holds the port without answering: a hung server from an earlier run
+            print(f"Port {OLLAMA_PORT} is in use but Ollama does not answer. Stopping the old service.")
+            kill_existing_ollama_service()
 
         os.environ['OLLAMA_RUNNERS_DIR'] = OLLAMA_RUNNERS_DIR
-        OLLAMA_PROCESS = subprocess.Popen([OLLAMA_EXE_PATH, "serve"], env=os.environ)
+        # Let the server answer as many requests at once as run_concurrent_chats sends
+        os.environ.setdefault('OLLAMA_NUM_PARALLEL', str(OLLAMA_NUM_PARALLEL))
+        os.environ.setdefault('OLLAMA_MAX_LOADED_MODELS', str(max_loaded_models))
+        # Detached, so the server stays warm for the next run after this one exits. It must not hold on to
+        # this process's output pipes either, or whoever reads them waits until the server exits.
+        if os.name == 'nt':
+            popen_kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            popen_kwargs = {"start_new_session": True}
+        OLLAMA_PROCESS = subprocess.Popen([OLLAMA_EXE_PATH, "serve"], env=os.environ, stdin=subprocess.DEVNULL,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **popen_kwargs)
 
-        # Wait and check if the service starts properly
-        time.sleep(10)
-        if is_port_in_use(OLLAMA_PORT):
+        if wait_for_ollama_server():
             print("Ollama service started successfully.")
             return True
 
@@ -127,14 +197,80 @@ def start_ollama_service():
     print("Failed to start Ollama service. Please check and try again.")
     return False
 
-def stop_ollama_service():
-    """Stop Ollama service if it was started by this script."""
+def start_idle_watcher(server_pid):
+    """Start a detached process that stops the server once it has been idle for OLLAMA_IDLE_TIMEOUT."""
+    global _idle_watcher_pid
+    if _idle_watcher_pid == server_pid:
+        return
+    _idle_watcher_pid = server_pid
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.name == 'nt':
+        popen_kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        popen_kwargs = {"start_new_session": True}
+    subprocess.Popen([sys.executable, "-m", "utilities.ollama_utils", "--watch-idle", str(server_pid)],
+                     cwd=repo_root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **popen_kwargs)
+
+def watch_idle_ollama_service(server_pid, check_interval=30):
+    """Stop the server once no model is loaded. Requests load the model with keep_alive=OLLAMA_KEEP_ALIVE,
+    so the model stays resident until the server has been idle that long."""
+    idle_checks = 0
+    while psutil.pid_exists(server_pid):
+        time.sleep(check_interval)
+        try:
+            loaded = requests.get(f"{get_ollama_url()}/api/ps", timeout=5).json().get("models") or []
+        except (requests.RequestException, ValueError):
+            continue
+        idle_checks = 0 if loaded else idle_checks + 1
+        # Two checks in a row, so the gap between the end of setup and the first request is not cut off
+        if idle_checks >= 2:
+            try:
+                process = psutil.Process(server_pid)
+                process.terminate()
+                process.wait(timeout=10)
+            except psutil.TimeoutExpired:
+                process.kill()
+            except psutil.NoSuchProcess:
+                pass
+            return
+
+def stop_ollama_service(force=False):
+    """Stop the Ollama service started by this script.
+
+    With OLLAMA_IDLE_TIMEOUT set, the server is left running for the next run and its idle watcher
+    stops it later; force stops it now.
+    """
     global OLLAMA_PROCESS
     if OLLAMA_PROCESS is not None:
-        OLLAMA_PROCESS.terminate()
-        OLLAMA_PROCESS.wait()
+        if force or OLLAMA_IDLE_TIMEOUT <= 0:
+            OLLAMA_PROCESS.terminate()
+            OLLAMA_PROCESS.wait()
+            print("Ollama service has been stopped.")
+        else:
+            print(f"Leaving the Ollama service running; it stops after {OLLAMA_IDLE_TIMEOUT} seconds without requests.")
         OLLAMA_PROCESS = None
-        print("Ollama service has been stopped.")
+
+def is_model_pulled(model_name, url=None):
+    """True if the server already lists the model with a digest, so pulling it again can be skipped."""
+    try:
+        models = requests.get(f"{url or get_ollama_url()}/api/tags", timeout=5).json().get("models") or []
+    except (requests.RequestException, ValueError):
+        return False
+    for model in models:
+        name = model.get("model") or model.get("name") or ""
+        if name in (model_name, f"{model_name}:latest") and model.get("digest"):
+            _model_digests[model_name] = model["digest"]
+            return True
+    return False
+
+def pull_model_on_endpoint(model_name, url):
+    """Pull a model on a remote server through its API; a failure leaves that server to fail over later."""
+    import ollama
+    print(f"Pulling model '{model_name}' on {url}... This may take a while.")
+    try:
+        ollama.Client(host=url).pull(model_name)
+    except Exception as e:
+        print(f"Failed to pull model '{model_name}' on {url}: {e}")
 
 def is_ollama_installed():
     """Check if Ollama is installed by running 'ollama help'."""
@@ -146,37 +282,373 @@ def is_ollama_installed():
     except FileNotFoundError:
         return False
 
-def install_and_setup_ollama(model_name):
-    """Install and set up Ollama, including pulling the required model."""
-    if not is_ollama_installed():
-        install_ollama()
+@span("ollama.setup", category="llm")
+def install_and_setup_ollama(model_name, restart_service=False):
+    """Install and set up Ollama, including pulling the required model (or list of models).
+
+    A healthy running server is reused and the pull is skipped when the server already has the model;
+    restart_service stops any running server first.
+    """
+    model_names = [model_name] if isinstance(model_name, str) else list(dict.fromkeys(model_name))
+    if OLLAMA_EXTERNAL_SERVER:
+        install_ollama_pkg()
+        for url in get_ollama_endpoints():
+            print(f"Using the external Ollama server at {url}.")
+            for model_name in model_names:
+                if not is_model_pulled(model_name, url):
+                    pull_model_on_endpoint(model_name, url)
+        return
 
     install_ollama_pkg()
 
-    # Start the Ollama service before pulling the model
-    kill_existing_ollama_service()  # Ensure no leftover processes are running
+    if restart_service:
+        kill_existing_ollama_service()  # Ensure no leftover processes are running
 
-    if not start_ollama_service():
-        print("Error: Failed to start Ollama service. Exiting.")
-        return
+    if not is_ollama_server_healthy():
+        if not is_ollama_installed():
+            install_ollama()
+        # Start the Ollama service before pulling the model
+        if not start_ollama_service(max_loaded_models=len(model_names)):
+            print("Error: Failed to start Ollama service. Exiting.")
+            return
+    else:
+        print("Reusing the running Ollama service.")
 
     try:
-        print(f"Attempting to pull the model '{model_name}'...")
-        pull_model(model_name)
-    except subprocess.CalledProcessError as e:
-        print(f"Error occurred while pulling the model: {e}")
-        raise
-    except Exception as e:
-        print(f"Unexpected error occurred: {e}")
-        raise
+        for model_name in model_names:
+            if is_model_pulled(model_name):
+                print(f"Model '{model_name}' is already available. Skipping the pull.")
+                continue
+
+            try:
+                print(f"Attempting to pull the model '{model_name}'...")
+                pull_model(model_name)
+            except subprocess.CalledProcessError as e:
+                print(f"Error occurred while pulling the model: {e}")
+                raise
+            except Exception as e:
+                print(f"Unexpected error occurred: {e}")
+                raise
+    finally:
+        # Only after the pulls: a pull does not load a model, so the watcher would take it for an idle server
+        if OLLAMA_PROCESS is not None and OLLAMA_IDLE_TIMEOUT > 0:
+            start_idle_watcher(OLLAMA_PROCESS.pid)
+
+def get_ollama_endpoints():
+    """Base URLs requests are spread over: OLLAMA_HOSTS, or the single server at OLLAMA_HOST."""
+    return OLLAMA_HOSTS or [get_ollama_url()]
+
+class OllamaEndpointPool:
+    """Pick the least-loaded healthy Ollama endpoint per request and keep per-endpoint statistics.
+
+    An endpoint whose request fails is skipped for OLLAMA_ENDPOINT_RETRY_AFTER seconds while the others
+    take over.
+    """
+
+    def __init__(self, urls):
+        self.endpoints = [
+            {"url": url, "in_flight": 0, "requests": 0, "errors": 0, "seconds": 0.0, "unhealthy_until": 0.0}
+            for url in urls
+        ]
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude=()):
+        """Reserve the endpoint with the fewest requests in flight, preferring healthy and faster ones."""
+        with self._lock:
+            now = time.time()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint["url"] not in exclude] or self.endpoints
+
+            def load(endpoint):
+                average = endpoint["seconds"] / endpoint["requests"] if endpoint["requests"] else 0.0
+                return (endpoint["unhealthy_until"] > now, endpoint["in_flight"], average)
+
+            endpoint = min(candidates, key=load)
+            endpoint["in_flight"] += 1
+            return endpoint
 
-def get_story_response_from_model(model_name, user_message):
-    """Get response content from the model specifically for story writing."""
-    user_messages = [{'role': 'user', 'content': user_message}]
+    def release(self, endpoint, seconds, failed=False):
+        with self._lock:
+            endpoint["in_flight"] -= 1
+            endpoint["requests"] += 1
+            endpoint["seconds"] += seconds
+            if failed:
+                endpoint["errors"] += 1
+                endpoint["unhealthy_until"] = time.time() + OLLAMA_ENDPOINT_RETRY_AFTER
+            else:
+                endpoint["unhealthy_until"] = 0.0
+
+    def client(self, endpoint):
+        """The synchronous ollama client of an endpoint (async clients belong to one event loop, see run_concurrent_chats)."""
+        import ollama
+        with self._lock:
+            if endpoint["url"] not in self._clients:
+                self._clients[endpoint["url"]] = ollama.Client(host=endpoint["url"])
+            return self._clients[endpoint["url"]]
+
+    def stats(self):
+        """Requests, error rate and average latency per endpoint."""
+        with self._lock:
+            return {
+                endpoint["url"]: {
+                    "requests": endpoint["requests"],
+                    "errors": endpoint["errors"],
+                    "error_rate": round(endpoint["errors"] / endpoint["requests"], 3) if endpoint["requests"] else 0.0,
+                    "average_seconds": round(endpoint["seconds"] / endpoint["requests"], 2) if endpoint["requests"] else 0.0,
+                }
+                for endpoint in self.endpoints
+            }
+
+_endpoint_pool = None
+_endpoint_pool_lock = threading.Lock()
+
+def get_endpoint_pool():
+    global _endpoint_pool
+    with _endpoint_pool_lock:
+        if _endpoint_pool is None:
+            _endpoint_pool = OllamaEndpointPool(get_ollama_endpoints())
+        return _endpoint_pool
+
+def _is_endpoint_failure(error):
+    """A request the server rejected (unknown model, unsupported format) fails the same way on every endpoint."""
     import ollama
-    try:
-        responses = ollama.chat(model=model_name, messages=user_messages, stream=True)
-        return ''.join(chunk['message']['content'] for chunk in responses if 'message' in chunk and 'content' in chunk['message'])
-    except Exception as e:
-        print(f"An error occurred while retrieving the model's response: {e}")
-        return None
\ No newline at end of file
+    status_code = getattr(error, "status_code", None)
+    return not (isinstance(error, ollama.ResponseError) and status_code is not None and 0 < status_code < 500)
+
+def _call_with_failover(call, span_record=None):
+    """Run call(client) against the least-loaded healthy endpoint, moving on to the next one when it fails."""
+    pool = get_endpoint_pool()
+    tried = set()
+    while True:
+        endpoint = pool.acquire(exclude=tried)
+        tried.add(endpoint["url"])
+        if span_record is not None:
+            span_record["attributes"]["endpoint"] = endpoint["url"]
+        start_time = time.time()
+        try:
+            result = call(pool.client(endpoint))
+        except Exception as e:
+            failed = _is_endpoint_failure(e)
+            pool.release(endpoint, time.time() - start_time, failed=failed)
+            if not failed or len(tried) >= len(pool.endpoints):
+                raise
+            print(f"Ollama endpoint {endpoint['url']} failed ({e}). Retrying on another endpoint.")
+            continue
+        pool.release(endpoint, time.time() - start_time)
+        return result
+
+def get_model_digest(model_name):
+    """Digest of the model's weights as the server reports them, so a re-pulled model gets fresh cache keys.
+
+    Falls back to the model name when the server does not list it.
+    """
+    if model_name not in _model_digests:
+        digest = model_name
+        try:
+            for model in _call_with_failover(lambda client: client.list())['models']:
+                name = model.get('model') or model.get('name') or ''
+                if name in (model_name, f"{model_name}:latest") and model.get('digest'):
+                    digest = model['digest']
+                    break
+        except Exception as e:
+            print(f"Could not read the digest of model '{model_name}': {e}")
+        _model_digests[model_name] = digest
+    return _model_digests[model_name]
+
+def track_llm_usage(usage=None):
+    """Add the prompt-eval and generation token counts of the current context's requests to usage and return it.
+
+    Pass the same dict again from a later task of the stage to keep adding to it.
+    """
+    if usage is None:
+        usage = {"requests": 0, "prompt_eval_tokens": 0, "prompt_eval_seconds": 0.0,
+                 "eval_tokens": 0, "eval_seconds": 0.0, "truncated": 0, "routes": {}}
+    _llm_usage.set(usage)
+    return usage
+
+def _record_usage(span_record, response, route=None):
+    """Copy the token counts of a finished request into its span and the tracked usage.
+
+    route labels the kind of question (see MODEL_ROUTES) so its request count and latency add up separately.
+    """
+    if not response:
+        return
+    prompt_eval_tokens = response.get('prompt_eval_count') or 0
+    eval_tokens = response.get('eval_count') or 0
+    # The answer hit its num_predict budget instead of finishing or reaching a stop sequence
+    truncated = response.get('done_reason') == 'length'
+    span_record["attributes"].update(prompt_eval_tokens=prompt_eval_tokens, eval_tokens=eval_tokens, truncated=truncated)
+    usage = _llm_usage.get()
+    if usage is None:
+        return
+    with _llm_usage_lock:
+        usage["requests"] += 1
+        usage["prompt_eval_tokens"] += prompt_eval_tokens
+        usage["prompt_eval_seconds"] += (response.get('prompt_eval_duration') or 0) / 1e9
+        usage["eval_tokens"] += eval_tokens
+        usage["eval_seconds"] += (response.get('eval_duration') or 0) / 1e9
+        usage["truncated"] += int(truncated)
+        if route:
+            route_usage = usage.setdefault("routes", {}).setdefault(
+                route, {"model": span_record["attributes"].get("model"), "requests": 0, "seconds": 0.0, "truncated": 0})
+            route_usage["requests"] += 1
+            route_usage["seconds"] += time.time() - span_record["start"]
+            route_usage["truncated"] += int(truncated)
+
+def _build_messages(user_message, system=None):
+    """Chat messages for one question. A system message shared by several questions is a common prefix
+    the server can keep evaluated instead of processing it again for every question."""
+    messages = [{'role': 'system', 'content': system}] if system else []
+    messages.append({'role': 'user', 'content': user_message})
+    return messages
+
+def get_story_response_from_model(model_name, user_message, cache=True, system=None, route=None, options=None):
+    """Get response content from the model specifically for story writing.
+
+    Identical requests are answered from the LLM response cache; pass cache=False for prompts that
+    must get a fresh, creative answer every time. options are Ollama generation options (num_predict,
+    stop, num_ctx, temperature, ...).
+    """
+    user_messages = _build_messages(user_message, system)
+    cache_key = make_cache_key(get_model_digest(model_name), user_messages, options) if cache else None
+    if cache_key:
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+    with span("ollama.chat", category="llm", model=model_name, route=route) as record:
+        def stream_chat(client):
+            responses = client.chat(model=model_name, messages=user_messages, stream=True, options=options,
+                                    keep_alive=OLLAMA_KEEP_ALIVE)
+            parts = []
+            for chunk in responses:
+                if 'message' in chunk and 'content' in chunk['message']:
+                    parts.append(chunk['message']['content'])
+                if chunk.get('done'):
+                    _record_usage(record, chunk, route)
+            return ''.join(parts)
+
+        try:
+            content = _call_with_failover(stream_chat, record)
+        except Exception as e:
+            print(f"An error occurred while retrieving the model's response: {e}")
+            return None
+    if cache_key:
+        store_cached_response(cache_key, model_name, content)
+    return content
+
+def get_structured_response_from_model(model_name, user_message, schema=None, system=None, route=None, options=None):
+    """Get a JSON object from the model, constrained to the JSON schema when the server supports it.
+
+    Returns the decoded object, or None when the model did not answer with valid JSON.
+    """
+    import json
+    user_messages = _build_messages(user_message, system)
+    options = dict({'temperature': 0}, **(options or {}))
+    # Servers older than schema support only know format="json"
+    formats = [schema, "json"] if schema else ["json"]
+    for output_format in formats:
+        cache_key = make_cache_key(get_model_digest(model_name), user_messages, options, output_format)
+        content = get_cached_response(cache_key)
+        if content is None:
+            with span("ollama.chat", category="llm", format="json", model=model_name, route=route) as record:
+                try:
+                    response = _call_with_failover(lambda client: client.chat(
+                        model=model_name, messages=user_messages, format=output_format,
+                        options=options, keep_alive=OLLAMA_KEEP_ALIVE), record)
+                    content = response['message']['content']
+                    _record_usage(record, response, route)
+                except Exception as e:
+                    print(f"An error occurred while retrieving the model's structured response: {e}")
+                    continue
+        try:
+            result = json.loads(content)
+        except ValueError as e:
+            print(f"The model's response was not valid JSON: {e}")
+            return None
+        store_cached_response(cache_key, model_name, content)
+        return result
+    return None
+
+def run_concurrent_chats(build_coroutines, max_concurrency=None):
+    """Run the coroutines build_coroutines(chat) returns concurrently and return their results in order.
+
+    await chat(model_name, user_message, cache=True, system=None, output_format=None, route=None, options=None)
+    answers like get_story_response_from_model but returns (content, seconds); output_format ("json" or a
+    JSON schema) asks for structured output, returned as the undecoded JSON text. Requests go to the
+    least-loaded endpoint of the pool and fail over like the synchronous calls. At most max_concurrency
+    (OLLAMA_NUM_PARALLEL per endpoint) requests are in flight at once; the seconds do not include the time
+    a request waited for its turn.
+    """
+    import asyncio
+    import ollama
+    pool = get_endpoint_pool()
+
+    async def run():
+        clients = {}
+        semaphore = asyncio.Semaphore(max_concurrency or OLLAMA_NUM_PARALLEL * len(pool.endpoints))
+
+        async def stream_chat(client, record, route, **chat_kwargs):
+            responses = await client.chat(stream=True, keep_alive=OLLAMA_KEEP_ALIVE, **chat_kwargs)
+            parts = []
+            async for chunk in responses:
+                if 'message' in chunk and 'content' in chunk['message']:
+                    parts.append(chunk['message']['content'])
+                if chunk.get('done'):
+                    _record_usage(record, chunk, route)
+            return ''.join(parts)
+
+        async def chat_with_failover(record, route, **chat_kwargs):
+            tried = set()
+            while True:
+                endpoint = pool.acquire(exclude=tried)
+                tried.add(endpoint["url"])
+                record["attributes"]["endpoint"] = endpoint["url"]
+                if endpoint["url"] not in clients:
+                    clients[endpoint["url"]] = ollama.AsyncClient(host=endpoint["url"])
+                start_time = time.time()
+                try:
+                    content = await stream_chat(clients[endpoint["url"]], record, route, **chat_kwargs)
+                except Exception as e:
+                    failed = _is_endpoint_failure(e)
+                    pool.release(endpoint, time.time() - start_time, failed=failed)
+                    if not failed or len(tried) >= len(pool.endpoints):
+                        raise
+                    print(f"Ollama endpoint {endpoint['url']} failed ({e}). Retrying on another endpoint.")
+                    continue
+                pool.release(endpoint, time.time() - start_time)
+                return content
+
+        async def chat(model_name, user_message, cache=True, system=None, output_format=None, route=None, options=None):
+            user_messages = _build_messages(user_message, system)
+            start_time = time.time()
+            cache_key = make_cache_key(get_model_digest(model_name), user_messages, options, output_format) if cache else None
+            if cache_key:
+                cached = get_cached_response(cache_key)
+                if cached is not None:
+                    return cached, time.time() - start_time
+            async with semaphore:
+                with span("ollama.chat", category="llm", model=model_name, route=route) as record:
+                    start_time = time.time()
+                    try:
+                        chat_kwargs = {"format": output_format} if output_format else {}
+                        content = await chat_with_failover(record, route, model=model_name, messages=user_messages,
+                                                           options=options, **chat_kwargs)
+                    except Exception as e:
+                        print(f"An error occurred while retrieving the model's response: {e}")
+                        content = None
+                    response_time = time.time() - start_time
+            if cache_key:
+                store_cached_response(cache_key, model_name, content)
+            return content, response_time
+
+        return await asyncio.gather(*build_coroutines(chat))
+
+    return asyncio.run(run())
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Ollama service helpers")
+    parser.add_argument("--watch-idle", type=int, metavar="PID", help="Stop the Ollama server PID once it is idle")
+    args = parser.parse_args()
+    if args.watch_idle:
+        watch_idle_ollama_service(args.watch_idle)
\ No newline at end of file
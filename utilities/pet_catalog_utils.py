@@ -0,0 +1,131 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+
+# Index of pets and their files by run ID, so stages find their pet without scanning pet_directory.
+# Kept next to the code by default, since the video maker runs from its own directory.
+PET_CATALOG_DB = os.getenv(
+    "PET_CATALOG_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pet_catalog.sqlite3")
+)
+# Set for child processes so standalone stages know which run they belong to
+RUN_ID_ENV = "PIPELINE_RUN_ID"
+
+_local = threading.local()
+
+def _connect(db_path):
+    """One connection per thread and database; the tables are created on first use."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pets (
+                run_id TEXT PRIMARY KEY,
+                pet_dir TEXT NOT NULL,
+                json_file TEXT NOT NULL,
+                name TEXT,
+                pet_type TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS pets_created_at ON pets (created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                path TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS artifacts_run_kind ON artifacts (run_id, kind, id)")
+        connections[db_path] = conn
+    return conn
+
+def new_run_id():
+    """Generate a run ID that is also safe to use as a directory name."""
+    return uuid.uuid4().hex
+
+def get_run_id():
+    """The run ID handed down by the parent process, or None."""
+    return os.getenv(RUN_ID_ENV) or None
+
+def register_pet(run_id, pet_dir, json_file, name=None, pet_type=None, db_path=PET_CATALOG_DB):
+    """Record where the pet of a run lives. Paths are stored absolute so any working directory can use them."""
+    if not run_id:
+        return
+    now = time.time()
+    try:
+        _connect(db_path).execute(
+            "INSERT INTO pets (run_id, pet_dir, json_file, name, pet_type, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (run_id) DO UPDATE SET pet_dir = excluded.pet_dir, json_file = excluded.json_file, "
+            "name = excluded.name, pet_type = excluded.pet_type, updated_at = excluded.updated_at",
+            (run_id, os.path.abspath(pet_dir), os.path.abspath(json_file), name, pet_type, now, now)
+        )
+    except sqlite3.Error as e:
+        print(f"[WARNING] Could not add run {run_id} to the pet catalog: {e}")
+
+def register_artifact(run_id, kind, path, db_path=PET_CATALOG_DB):
+    """Record a file a run produced (an image, a zip, a storyline)."""
+    if not run_id:
+        return
+    try:
+        _connect(db_path).execute(
+            "INSERT INTO artifacts (run_id, kind, path, created_at) VALUES (?, ?, ?, ?)",
+            (run_id, kind, os.path.abspath(path), time.time())
+        )
+    except sqlite3.Error as e:
+        print(f"[WARNING] Could not add a {kind} of run {run_id} to the pet catalog: {e}")
+
+def get_pet(run_id, db_path=PET_CATALOG_DB):
+    """The catalog entry of a run as a dict, or None if the run is unknown or its record is gone."""
+    if not run_id:
+        return None
+    try:
+        row = _connect(db_path).execute("SELECT * FROM pets WHERE run_id = ?", (run_id,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"[WARNING] Pet catalog lookup failed: {e}")
+        return None
+    if row is None or not os.path.exists(row["json_file"]):
+        return None
+    return dict(row)
+
+def get_recent_pets(limit=20, db_path=PET_CATALOG_DB):
+    """The most recently started pets whose records still exist, newest first."""
+    try:
+        rows = _connect(db_path).execute(
+            "SELECT * FROM pets ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"[WARNING] Pet catalog lookup failed: {e}")
+        return []
+    return [dict(row) for row in rows if os.path.exists(row["json_file"])]
+
+def find_pet(run_id=None, db_path=PET_CATALOG_DB):
+    """The pet of run_id, or without one the most recently started pet. None when the catalog has neither."""
+    if run_id:
+        return get_pet(run_id, db_path)
+    recent = get_recent_pets(db_path=db_path)
+    return recent[0] if recent else None
+
+def find_artifact(run_id, kind, db_path=PET_CATALOG_DB):
+    """Path of the newest artifact of this kind a run produced, or None."""
+    if not run_id:
+        return None
+    try:
+        row = _connect(db_path).execute(
+            "SELECT path FROM artifacts WHERE run_id = ? AND kind = ? ORDER BY id DESC LIMIT 1", (run_id, kind)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"[WARNING] Pet catalog lookup failed: {e}")
+        return None
+    return row["path"] if row is not None and os.path.exists(row["path"]) else None
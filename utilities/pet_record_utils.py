@@ -0,0 +1,173 @@
+import os
+import copy
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from utilities.trace_utils import span
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# One lock per pet record, shared by every stage running in this process
+_record_locks = {}
+_record_locks_guard = threading.Lock()
+
+def get_record_lock(json_file):
+    """Return the lock guarding read-modify-write cycles of one pet record."""
+    key = os.path.abspath(json_file)
+    with _record_locks_guard:
+        if key not in _record_locks:
+            _record_locks[key] = threading.Lock()
+        return _record_locks[key]
+
+@contextmanager
+def locked_pet_record(json_file):
+    """Hold the pet record's lock against other threads of this process and against other processes.
+
+    Other processes are kept out with an OS lock on "<record>.lock" next to the record.
+    """
+    with get_record_lock(json_file):
+        with open(f"{json_file}.lock", "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                # LK_LOCK gives up after ten seconds, so keep asking until the other process is done
+                while True:
+                    try:
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def merge_into(target, updates):
+    """Deep-merge updates into target so nested sections like replicate_configs keep keys set by other stages."""
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_into(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+def read_pet_record(json_file):
+    """Load a pet record, or an empty dict if it does not exist yet."""
+    if not os.path.exists(json_file):
+        return {}
+    with open(json_file, 'r') as f:
+        return json.load(f)
+
+def write_pet_record(json_file, data):
+    """Replace the pet record on disk atomically: readers see the old or the new record, never half of one."""
+    directory = os.path.dirname(os.path.abspath(json_file))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(json_file)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, json_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def update_pet_record(json_file, updates=None, updater=None):
+    """Merge updates (and/or apply updater(data)) into the pet record on disk and return the result."""
+    with locked_pet_record(json_file), span("pet_record.write", category="io"):
+        data = read_pet_record(json_file)
+        if updates:
+            merge_into(data, updates)
+        if updater:
+            updater(data)
+        write_pet_record(json_file, data)
+    return data
+
+class PetRecord:
+    """A stage's in-memory copy of a pet record whose changes are written in batches.
+
+    Every update is applied to data right away and queued. flush() replays the queue onto the record
+    as it is on disk, under the record lock, and writes it back atomically, so changes other stages or
+    processes made in the meantime are kept. Updates flush immediately unless they are made inside
+    batch(). An updater may therefore run more than once and should only set values. Change data
+    through update(), since a flush replaces its contents with the record as written.
+    """
+
+    def __init__(self, json_file):
+        self.json_file = json_file
+        self.data = read_pet_record(json_file)
+        self._pending = []
+        self._batch_depth = 0
+        self._lock = threading.RLock()
+
+    def update(self, updates=None, updater=None):
+        with self._lock:
+            if updates:
+                merge_into(self.data, copy.deepcopy(updates))
+            if updater:
+                updater(self.data)
+            self._pending.append((copy.deepcopy(updates), updater))
+            if not self._batch_depth:
+                self.flush()
+            return self.data
+
+    @contextmanager
+    def batch(self):
+        """Collect the updates made inside the block into one write."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.flush()
+
+    def flush(self):
+        """Write the queued updates; returns the record as written."""
+        with self._lock:
+            if not self._pending:
+                return self.data
+            with locked_pet_record(self.json_file), span("pet_record.write", category="io"):
+                data = read_pet_record(self.json_file)
+                for updates, updater in self._pending:
+                    if updates:
+                        merge_into(data, updates)
+                    if updater:
+                        updater(data)
+                write_pet_record(self.json_file, data)
+            self._pending = []
+            # Refresh in place, so callers holding on to data see what other writers added
+            self.data.clear()
+            self.data.update(data)
+            return self.data
+
+def get_journal_path(json_file):
+    return f"{os.path.splitext(json_file)[0]}.journal.jsonl"
+
+def append_journal_event(json_file, message, **fields):
+    """Append a log-like entry to the pet record's journal instead of rewriting the record for it."""
+    event = dict(fields, time=time.time(), message=message)
+    with open(get_journal_path(json_file), "a") as f:
+        f.write(json.dumps(event, default=str) + "\n")
+
+def read_journal(json_file):
+    """The journal entries of a pet record, oldest first."""
+    journal_path = get_journal_path(json_file)
+    if not os.path.exists(journal_path):
+        return []
+    with open(journal_path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import importlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utilities.progress_utils import emit_progress_event, STAGE_START, STAGE_END, PROGRESS, ERROR
+from utilities.pet_record_utils import update_pet_record
+from utilities.pet_catalog_utils import new_run_id
+from utilities.trace_utils import span, summarize_trace, export_chrome_trace
+
+# Stage scripts in the order 0_run_all.py runs them
+PIPELINE_STAGES = [
+    "1_gather_pet_data.py",
+    "2_train_a_lora.py",
+    "3_create_images_of_pet.py",
+]
+
+# The pipeline as a task graph: task -> (stage script, function, tasks it depends on, resource class).
+# Training only needs the TRIGGER_WORD and the image zip from gather_identity, so it
+# runs alongside the LLM work in gather_details.
+PIPELINE_GRAPH = {
+    "gather_identity": ("1_gather_pet_data.py", "gather_identity", [], "llm"),
+    "train_lora": ("2_train_a_lora.py", "main", ["gather_identity"], "training"),
+    "gather_details": ("1_gather_pet_data.py", "gather_details", ["gather_identity"], "llm"),
+    "create_images": ("3_create_images_of_pet.py", "main", ["train_lora", "gather_details"], "prediction"),
+}
+
+def create_run_context(pet_description="", gdrive_link="", submission_file=None, job_id=None,
+                       zip_uploads_dir="zip_uploads", resume=False, shared_ollama=False, run_id=None):
+    """Create the shared state handed from stage to stage when the pipeline runs in one process."""
+    return {
+        # Key of this run's pet in the pet catalog
+        "run_id": run_id or job_id or new_run_id(),
+        "pet_description": pet_description.strip(),
+        "gdrive_link": gdrive_link,
+        "submission_file": submission_file,
+        "job_id": job_id,
+        "zip_uploads_dir": zip_uploads_dir,
+        "resume": resume,
+        # Set when other runs use the same Ollama server, so stages must not kill or stop it
+        "shared_ollama": shared_ollama,
+        "pet_dir_path": None,
+        "json_filepath": None,
+        "pet_data": None,
+        "clients": {},
+    }
+
+def create_context_from_submission(data, submission_file=None, resume=False, shared_ollama=False):
+    """Build a run context from a submission dict (the JSON app.py writes to app_submit_log/)."""
+    context = create_run_context(
+        data.get("PET_DESCRIPTION", ""), data.get("zip_of_images_via_gdrive", ""),
+        submission_file=submission_file, job_id=data.get("job_id"),
+        zip_uploads_dir=data.get("zip_uploads_dir", "zip_uploads"),
+        resume=resume, run_id=data.get("run_id"),
+        # Queued app jobs share one Ollama server with each other
+        shared_ollama=shared_ollama or bool(data.get("job_id"))
+    )
+    if resume and data.get("pet_json_file") and os.path.exists(data["pet_json_file"]):
+        context["json_filepath"] = data["pet_json_file"]
+        context["pet_dir_path"] = os.path.dirname(data["pet_json_file"])
+    return context
+
+def load_stage(script_name):
+    """Import a numbered stage script (e.g. 1_gather_pet_data.py) as a module."""
+    module_name = os.path.splitext(os.path.basename(script_name))[0]
+    return importlib.import_module(module_name)
+
+def run_task_graph(tasks, max_workers=None, resource_limits=None, stop_on_failure=True):
+    """Run tasks ({name: (callable, [dependencies], resource class)}) on a thread pool.
+
+    A task starts as soon as its dependencies finished and its resource class has a free slot
+    in resource_limits. With stop_on_failure=False a failed task only skips the tasks that
+    depend on it. Returns {"timings": {name: (start, end)}, "failed": {name: error}, "skipped": [names]}.
+    """
+    resource_limits = resource_limits or {}
+    pending = dict(tasks)
+    running = {}
+    finished = set()
+    failed = {}
+    skipped = []
+    timings = {}
+    in_use = {}
+    total = len(tasks)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as executor:
+        while pending or running:
+            # Drop tasks that can never run because a dependency failed (or everything stops)
+            dropped = True
+            while dropped:
+                dropped = False
+                for name, (func, dependencies, resource) in list(pending.items()):
+                    if (stop_on_failure and failed) or any(d in failed or d in skipped for d in dependencies):
+                        skipped.append(name)
+                        del pending[name]
+                        dropped = True
+
+            for name, (func, dependencies, resource) in list(pending.items()):
+                if not all(dependency in finished for dependency in dependencies):
+                    continue
+                limit = resource_limits.get(resource)
+                if limit is not None and in_use.get(resource, 0) >= limit:
+                    continue
+                print(f"[INFO] Starting task: {name}")
+                emit_progress_event(STAGE_START, stage=name)
+                in_use[resource] = in_use.get(resource, 0) + 1
+                # Run in a copy of the current context so the task's spans nest under the caller's span
+                running[executor.submit(contextvars.copy_context().run, func)] = (name, resource, time.time())
+                del pending[name]
+
+            if not running:
+                if pending:
+                    raise Exception(f"Task graph cannot make progress, unmet dependencies for: {', '.join(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, resource, started = running.pop(future)
+                in_use[resource] -= 1
+                timings[name] = (started, time.time())
+                try:
+                    future.result()
+                    finished.add(name)
+                    print(f"[INFO] Task {name} finished in {timings[name][1] - started:.2f} seconds")
+                    emit_progress_event(STAGE_END, stage=name, status="succeeded", seconds=round(timings[name][1] - started, 2))
+                except BaseException as e:
+                    # Let tasks already running (e.g. a paid training) finish so their results are checkpointed
+                    print(f"[ERROR] Task {name} failed: {e}")
+                    failed[name] = e
+                    emit_progress_event(ERROR, stage=name, message=str(e))
+                    emit_progress_event(STAGE_END, stage=name, status="failed", seconds=round(timings[name][1] - started, 2))
+                emit_progress_event(PROGRESS, stage=None, percent=round(100 * (len(finished) + len(failed)) / total))
+
+    if stop_on_failure and failed:
+        raise next(iter(failed.values()))
+    return {"timings": timings, "failed": failed, "skipped": skipped}
+
+def build_pipeline_tasks(context, graph=PIPELINE_GRAPH, prefix=""):
+    """Turn the pipeline graph into runnable tasks bound to one pet's run context."""
+    tasks = {}
+    for name, (script_name, function_name, dependencies, resource) in graph.items():
+        stage_function = getattr(load_stage(script_name), function_name)
+
+        def run_stage(stage_function=stage_function, task_name=prefix + name):
+            with span(task_name, category="stage"):
+                stage_function(context=context)
+
+        tasks[prefix + name] = (
+            run_stage,
+            [prefix + dependency for dependency in dependencies],
+            resource
+        )
+    return tasks
+
+def run_pipeline_graph(context, graph=PIPELINE_GRAPH):
+    """Run the pipeline stages in-process following the task graph, sharing the run context."""
+    try:
+        with span("pipeline", category="pipeline", job_id=context.get("job_id")):
+            run_task_graph(build_pipeline_tasks(context, graph))
+    finally:
+        save_record_path_to_submission(context)
+        save_trace_summary(context)
+    return context
+
+def run_batch_pipeline(contexts, resource_limits, graph=PIPELINE_GRAPH):
+    """Pipeline many pets through one task graph: while one pet trains, the next one uses the LLM.
+
+    Returns a throughput report. A failing pet does not stop the others.
+    """
+    tasks = {}
+    for index, context in enumerate(contexts):
+        tasks.update(build_pipeline_tasks(context, graph, prefix=f"pet_{index + 1}:"))
+
+    batch_start = time.time()
+    try:
+        with span("batch", category="pipeline", pets=len(contexts)):
+            outcome = run_task_graph(tasks, resource_limits=resource_limits, stop_on_failure=False)
+    finally:
+        for context in contexts:
+            save_record_path_to_submission(context)
+    batch_end = time.time()
+
+    # Every pet's record gets its own slice of the batch trace, like a single run
+    trace_file = export_chrome_trace()
+    for index, context in enumerate(contexts):
+        save_trace_summary(context, name_prefix=f"pet_{index + 1}:")
+
+    pets = []
+    for index, context in enumerate(contexts):
+        prefix = f"pet_{index + 1}:"
+        pet_timings = [t for name, t in outcome["timings"].items() if name.startswith(prefix)]
+        pet_failed = [name[len(prefix):] for name in outcome["failed"] if name.startswith(prefix)]
+        pet_skipped = [name[len(prefix):] for name in outcome["skipped"] if name.startswith(prefix)]
+        pets.append({
+            "submission": context.get("submission_file") or f"line {index + 1}",
+            "pet_json_file": context.get("json_filepath"),
+            "succeeded": not pet_failed and not pet_skipped,
+            "failed_tasks": pet_failed,
+            "skipped_tasks": pet_skipped,
+            "duration_seconds": round(max(end for _, end in pet_timings) - min(start for start, _ in pet_timings), 2) if pet_timings else 0,
+        })
+
+    resource_busy = {}
+    for name, (start, end) in outcome["timings"].items():
+        resource = tasks[name][2]
+        resource_busy[resource] = resource_busy.get(resource, 0) + (end - start)
+
+    total_seconds = batch_end - batch_start
+    succeeded = sum(1 for pet in pets if pet["succeeded"])
+    return {
+        "started_at": batch_start,
+        "total_seconds": round(total_seconds, 2),
+        "pets_total": len(pets),
+        "pets_succeeded": succeeded,
+        "pets_per_hour": round(succeeded * 3600 / total_seconds, 2) if total_seconds > 0 else 0,
+        "resource_limits": resource_limits,
+        "resource_busy_seconds": {resource: round(busy, 2) for resource, busy in resource_busy.items()},
+        "trace": summarize_trace(root_name="batch"),
+        "trace_file": trace_file,
+        "pets": pets,
+    }
+
+def load_batch_submissions(path):
+    """Read pet submissions from a directory of JSON files or a JSONL file. Returns [(data, submission_file)]."""
+    submissions = []
+    if os.path.isdir(path):
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith('.json'):
+                file_path = os.path.join(path, file_name)
+                with open(file_path) as f:
+                    submissions.append((json.load(f), file_path))
+    else:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    submissions.append((json.loads(line), None))
+    return submissions
+
+def save_record_path_to_submission(context):
+    """Remember the pet record in the submission JSON so a failed run can be resumed with --resume."""
+    submission_file = context.get("submission_file")
+    json_filepath = context.get("json_filepath")
+    if not submission_file or not json_filepath or not os.path.exists(submission_file):
+        return
+    with open(submission_file, "r") as f:
+        data = json.load(f)
+    if data.get("pet_json_file") == json_filepath:
+        return
+    data["pet_json_file"] = json_filepath
+    with open(submission_file, "w") as f:
+        json.dump(data, f, indent=2)
+
+def save_trace_summary(context, name_prefix=None):
+    """Export the run's trace and write its critical-path summary into the pet record.
+
+    In a batch, name_prefix ("pet_N:") picks the pet's own tasks; the batch exports the trace itself.
+    """
+    try:
+        if not name_prefix:
+            trace_file = export_chrome_trace()
+            print(f"[INFO] Trace written to {trace_file} (open it in chrome://tracing or ui.perfetto.dev)")
+        summary = summarize_trace(root_name="pipeline", name_prefix=name_prefix)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Could not export the trace: {e}")
+        return
+    json_filepath = context.get("json_filepath")
+    if summary and json_filepath and os.path.exists(json_filepath):
+        # Replace rather than merge, so span names from an earlier attempt do not linger
+        update_pet_record(json_filepath, updater=lambda data: data.update(trace_summary=summary))
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import threading
+import subprocess
+
+# The pipe a parent process (app.py) reads typed progress events from, one JSON object per line
+PROGRESS_EVENT_FD_ENV = "PROGRESS_EVENT_FD"
+
+# Event types stages emit
+STAGE_START = "stage_start"
+STAGE_END = "stage_end"
+PROGRESS = "progress"
+ARTIFACT = "artifact"
+ERROR = "error"
+
+_event_stream = None
+_event_stream_lock = threading.Lock()
+
+def _open_event_stream():
+    """Open the event pipe inherited from the parent, or return None when nobody is listening."""
+    value = os.getenv(PROGRESS_EVENT_FD_ENV)
+    if not value:
+        return None
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            fd = msvcrt.open_osfhandle(int(value), os.O_WRONLY)
+        else:
+            fd = int(value)
+        return os.fdopen(fd, "w", buffering=1, encoding="utf-8", closefd=False)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Could not open progress event channel {value}: {e}")
+        return None
+
+def emit_progress_event(event_type, **fields):
+    """Send a typed event (stage_start, stage_end, progress, artifact, error) to the parent process.
+
+    Does nothing when the script was not started with an event channel, so stages run the same from the CLI.
+    """
+    global _event_stream
+    with _event_stream_lock:
+        if _event_stream is None:
+            _event_stream = _open_event_stream() or False
+        if not _event_stream:
+            return
+        event = {"type": event_type, "time": time.time()}
+        event.update(fields)
+        try:
+            _event_stream.write(json.dumps(event, default=str) + "\n")
+        except OSError:
+            # The reader went away; keep running without events
+            _event_stream = False
+
+def inherit_event_channel_kwargs():
+    """Popen kwargs that hand this process's event channel on to a child (0_run_all.py --subprocess)."""
+    value = os.getenv(PROGRESS_EVENT_FD_ENV)
+    if not value:
+        return {}
+    if os.name == 'nt':
+        return {"startupinfo": subprocess.STARTUPINFO(lpAttributeList={"handle_list": [int(value)]})}
+    return {"pass_fds": (int(value),)}
+
+def _read_lines(stream, callback):
+    try:
+        for line in iter(stream.readline, ''):
+            line = line.rstrip("\r\n")
+            if line:
+                callback(line)
+    finally:
+        stream.close()
+
+def run_with_progress_events(cmd, on_event, on_output, env=None):
+    """Run cmd and read its stdout, stderr and event channel concurrently, so no pipe can fill up and block it.
+
+    on_output(line, stream_name) gets every output line and on_event(event) every decoded event.
+    Returns the exit code.
+    """
+    env = dict(env if env is not None else os.environ)
+    read_fd, write_fd = os.pipe()
+    popen_kwargs = {}
+    if os.name == 'nt':
+        import msvcrt
+        handle = msvcrt.get_osfhandle(write_fd)
+        os.set_handle_inheritable(handle, True)
+        env[PROGRESS_EVENT_FD_ENV] = str(handle)
+        popen_kwargs["startupinfo"] = subprocess.STARTUPINFO(lpAttributeList={"handle_list": [handle]})
+    else:
+        env[PROGRESS_EVENT_FD_ENV] = str(write_fd)
+        popen_kwargs["pass_fds"] = (write_fd,)
+
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True, env=env, **popen_kwargs)
+    finally:
+        # Only the child keeps the write end, so the reader sees EOF when the child exits
+        os.close(write_fd)
+
+    def handle_event_line(line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            on_output(line, "events")
+            return
+        on_event(event)
+
+    readers = [
+        threading.Thread(target=_read_lines, args=(process.stdout, lambda line: on_output(line, "stdout")), daemon=True),
+        threading.Thread(target=_read_lines, args=(process.stderr, lambda line: on_output(line, "stderr")), daemon=True),
+        threading.Thread(target=_read_lines, args=(os.fdopen(read_fd, "r", encoding="utf-8"), handle_event_line), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    process.wait()
+    for reader in readers:
+        reader.join()
+    return process.returncode
+
+class ProgressCoalescer:
+    """Collect output lines and events and push them to clients as one message per interval.
+
+    Only the latest progress event per stage is kept, so a long run sends a few messages a second
+    instead of one per line.
+    """
+
+    def __init__(self, send, interval=0.5):
+        self.send = send
+        self.interval = interval
+        self._lines = []
+        self._events = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def start(self):
+        self._flusher = threading.Thread(target=self._run, daemon=True)
+        self._flusher.start()
+        return self
+
+    def add_line(self, line):
+        with self._lock:
+            self._lines.append(line)
+
+    def add_event(self, event):
+        with self._lock:
+            if event.get("type") == PROGRESS:
+                self._events = [e for e in self._events
+                                if not (e.get("type") == PROGRESS and e.get("stage") == event.get("stage"))]
+            self._events.append(event)
+
+    def flush(self):
+        with self._lock:
+            lines, events = self._lines, self._events
+            self._lines, self._events = [], []
+        if lines or events:
+            self.send("\n".join(lines), events)
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self.flush()
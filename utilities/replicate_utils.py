@@ -7,6 +7,13 @@ from collections import defaultdict
 import json
 from datetime import datetime
 import time
+import hmac
+import base64
+import hashlib
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utilities.trace_utils import span
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,7 +24,18 @@ HEADERS = {
     'Content-Type': 'application/json',
 }
 
-BASE_URL = 'https://api.replicate.com/v1'
+# REPLICATE_BASE_URL is also read by the replicate client, so both can point at a local stand-in
+BASE_URL = f"{os.getenv('REPLICATE_BASE_URL', 'https://api.replicate.com').rstrip('/')}/v1"
+TRAINING_POLL_INTERVAL = float(os.getenv('REPLICATE_TRAINING_POLL_INTERVAL', 60))  # seconds, far from the expected finish
+TRAINING_MIN_POLL_INTERVAL = float(os.getenv('REPLICATE_TRAINING_MIN_POLL_INTERVAL', 5))  # seconds, around the expected finish
+TRAINING_EXPECTED_SECONDS = float(os.getenv('REPLICATE_TRAINING_EXPECTED_SECONDS', 1200))
+TRAINING_FINAL_STATUSES = ("succeeded", "failed", "canceled")
+# With REPLICATE_WEBHOOK_PORT set, a local receiver learns about finished trainings from Replicate's webhook.
+# REPLICATE_WEBHOOK_URL is the address Replicate reaches it at (a tunnel or proxy). Without it the receiver
+# only listens on 127.0.0.1; with it the receiver listens on every interface and needs the signing secret.
+REPLICATE_WEBHOOK_PORT = os.getenv('REPLICATE_WEBHOOK_PORT')
+REPLICATE_WEBHOOK_URL = os.getenv('REPLICATE_WEBHOOK_URL')
+REPLICATE_WEBHOOK_SECRET = os.getenv('REPLICATE_WEBHOOK_SECRET')  # "whsec_..." signing secret
 SAVE_DIRECTORY = './usage_data'
 
 # Make sure the save directory exists
@@ -42,6 +60,7 @@ def get_replicate_default_values():
         "NUM_INFERENCE_STEPS": 28
     }
 
+@span("replicate.predict", category="replicate")
 def create_image(prompt, api_token, config):
     os.environ['REPLICATE_API_TOKEN'] = api_token
 
@@ -70,6 +89,7 @@ def create_image(prompt, api_token, config):
     )
     return output
 
+@span("replicate.api", category="replicate")
 def get_data(endpoint):
     response = requests.get(f'{BASE_URL}/{endpoint}', headers=HEADERS)
     response.raise_for_status()
@@ -226,6 +246,7 @@ def generate_hf_repo_name(base_name):
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     return f"{base_name}-{timestamp}"
 
+@span("replicate.create_model", category="replicate")
 def create_model(client, owner, name, visibility, hardware, description):
     """Create a new model on Replicate."""
     print(f"Creating a new model on Replicate to store fine-tuned weights... (Model Name: {name})")
@@ -248,6 +269,7 @@ def create_model(client, owner, name, visibility, hardware, description):
         else:
             raise
 
+@span("replicate.start_training", category="replicate")
 def start_training(client, model, path_to_images, steps, lora_rank, optimizer, batch_size, resolution,
                    autocaption, trigger_word, learning_rate, hf_token, hf_repo_id, version, retry_delay, max_retries):
     """Start the training process on Replicate."""
@@ -256,6 +278,8 @@ def start_training(client, model, path_to_images, steps, lora_rank, optimizer, b
 
         try:
             print("Initializing training on Replicate...")
+            webhook_url = get_training_webhook_url()
+            webhook_kwargs = {"webhook": webhook_url, "webhook_events_filter": ["completed"]} if webhook_url else {}
             training = client.trainings.create(
                 version=version,
                 input={
@@ -271,7 +295,8 @@ def start_training(client, model, path_to_images, steps, lora_rank, optimizer, b
                     "hf_token": hf_token,
                     "hf_repo_id": hf_repo_id,
                 },
-                destination=f"{model.owner}/{model.name}"
+                destination=f"{model.owner}/{model.name}",
+                **webhook_kwargs
             )
 
             print(f"Training initiation payload:\n"
@@ -320,6 +345,7 @@ def record_hf_repo_creation(response):
     print(f"Response: {response}")
 
 # Newly added functions to utilities
+@span("replicate.poll", category="replicate")
 def get_training_status(training_id):
     """Get the current status of a training."""
     url = f"{BASE_URL}/trainings/{training_id}"
@@ -331,25 +357,146 @@ def get_training_status(training_id):
         print(f"Failed to get training status: {response.status_code}")
         return None
 
-def monitor_training(training_id, interval=60):
-    """Continuously monitor the training status at specified intervals."""
-    print(f"Starting to monitor training: {training_id}")
-
-    while True:
-        training_info = get_training_status(training_id)
-        if training_info:
-            status = training_info.get("status")
-            print(f"Training Status: {status} (Checked at {time.strftime('%Y-%m-%d %H:%M:%S')})")
-            
-            if status in ["succeeded", "failed", "canceled"]:
-                print(f"Training completed with status: {status}")
-                break
-        else:
-            print("No training info available. Exiting.")
-            break
-        
-        time.sleep(interval)
-
+_training_events_lock = threading.Lock()
+_training_results = {}  # training ID -> final training payload delivered by the webhook, while someone waits for it
+_training_waiters = {}  # training ID -> [(event loop, asyncio.Event)] of wait_for_training calls
+_webhook_url = None
+
+def is_valid_webhook_signature(headers, body, secret=REPLICATE_WEBHOOK_SECRET):
+    """Check Replicate's webhook-signature header against the signing secret.
+
+    Without a secret every delivery is accepted, which get_training_webhook_url only allows on 127.0.0.1.
+    """
+    if not secret:
+        return True
+    key = base64.b64decode(secret.split("_", 1)[-1])
+    signed_content = f"{headers.get('webhook-id')}.{headers.get('webhook-timestamp')}.".encode("utf-8") + body
+    expected = base64.b64encode(hmac.new(key, signed_content, hashlib.sha256).digest()).decode("ascii")
+    signatures = (headers.get("webhook-signature") or "").split()
+    return any(hmac.compare_digest(expected, signature.split(",", 1)[-1]) for signature in signatures)
+
+def record_training_event(payload):
+    """Hand a training payload from the webhook to whoever waits for that training.
+
+    Payloads nobody waits for are dropped; a wait that starts later polls the status first anyway.
+    """
+    if payload.get("status") not in TRAINING_FINAL_STATUSES:
+        return
+    with _training_events_lock:
+        waiters = list(_training_waiters.get(payload.get("id"), []))
+        if waiters:
+            _training_results[payload.get("id")] = payload
+    for loop, event in waiters:
+        loop.call_soon_threadsafe(event.set)
+
+class TrainingWebhookHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not is_valid_webhook_signature(self.headers, body):
+            return self.reply(401)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self.reply(400)
+        record_training_event(payload)
+        self.reply(200)
+
+def get_training_webhook_url():
+    """Start the webhook receiver once per process and return the URL to give Replicate, or None without one."""
+    global _webhook_url
+    if REPLICATE_WEBHOOK_PORT is None:
+        return None
+    if REPLICATE_WEBHOOK_URL and not REPLICATE_WEBHOOK_SECRET:
+        # Anyone who can reach an exposed receiver could otherwise report a training as finished
+        print("REPLICATE_WEBHOOK_URL is set without REPLICATE_WEBHOOK_SECRET; polling for training status instead.")
+        return None
+    with _training_events_lock:
+        if _webhook_url is None:
+            host = "0.0.0.0" if REPLICATE_WEBHOOK_URL else "127.0.0.1"
+            try:
+                server = ThreadingHTTPServer((host, int(REPLICATE_WEBHOOK_PORT)), TrainingWebhookHandler)
+            except OSError as e:
+                # Another run on this machine holds the port; this one polls instead
+                print(f"Could not start the training webhook receiver on port {REPLICATE_WEBHOOK_PORT}: {e}")
+                return None
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _webhook_url = REPLICATE_WEBHOOK_URL or f"http://127.0.0.1:{server.server_address[1]}"
+            print(f"Receiving training webhooks at {_webhook_url}")
+        return _webhook_url
+
+def next_poll_interval(elapsed, expected_seconds=TRAINING_EXPECTED_SECONDS, max_interval=TRAINING_POLL_INTERVAL,
+                       min_interval=TRAINING_MIN_POLL_INTERVAL):
+    """Seconds until the next status check: half the expected remaining time, so checks get denser towards
+    the expected finish, then backing off again the longer an overdue training keeps running."""
+    remaining = expected_seconds - elapsed
+    interval = remaining / 2 if remaining > 0 else -remaining / 4
+    return min(max_interval, max(min_interval, interval))
+
+def _training_start_time(training_info):
+    """When the training was created, so a resumed wait keeps its place in the schedule."""
+    try:
+        return datetime.fromisoformat(training_info["created_at"].replace("Z", "+00:00")).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return time.time()
+
+async def wait_for_training(training_id, expected_seconds=TRAINING_EXPECTED_SECONDS, max_interval=TRAINING_POLL_INTERVAL):
+    """Wait until a training finishes and return its final status (None when its status cannot be read).
+
+    Returns as soon as the webhook reports the training finished, and otherwise polls on the
+    next_poll_interval schedule, which also covers webhooks that never arrive.
+    """
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    waiter = (loop, event)
+    with _training_events_lock:
+        _training_waiters.setdefault(training_id, []).append(waiter)
+    try:
+        with span("replicate.training", category="replicate", training_id=training_id):
+            print(f"Starting to monitor training: {training_id}")
+            started_at = None
+            while True:
+                with _training_events_lock:
+                    training_info = _training_results.get(training_id)
+                if training_info is None:
+                    training_info = await asyncio.to_thread(get_training_status, training_id)
+                if not training_info:
+                    print("No training info available. Exiting.")
+                    return None
+
+                status = training_info.get("status")
+                print(f"Training Status: {status} (Checked at {time.strftime('%Y-%m-%d %H:%M:%S')})")
+                if status in TRAINING_FINAL_STATUSES:
+                    print(f"Training completed with status: {status}")
+                    return status
+
+                if started_at is None:
+                    started_at = _training_start_time(training_info)
+                interval = next_poll_interval(time.time() - started_at, expected_seconds, max_interval)
+                try:
+                    await asyncio.wait_for(event.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        with _training_events_lock:
+            _training_waiters[training_id].remove(waiter)
+            if not _training_waiters[training_id]:
+                del _training_waiters[training_id]
+                _training_results.pop(training_id, None)
+
+def monitor_training(training_id, interval=TRAINING_POLL_INTERVAL):
+    """Block until the training finishes (see wait_for_training). Returns the final status."""
+    return asyncio.run(wait_for_training(training_id, max_interval=interval))
+
+@span("replicate.model_versions", category="replicate")
 def get_model_versions(model_owner, model_name):
     """Get the versions of a given model."""
     url = f"{BASE_URL}/models/{model_owner}/{model_name}/versions"
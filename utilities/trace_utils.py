@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import threading
+import subprocess
+import contextvars
+from contextlib import contextmanager
+
+# A trace spans every process of one run; children find it through these variables
+TRACE_ID_ENV = "PIPELINE_TRACE_ID"
+PARENT_SPAN_ENV = "PIPELINE_PARENT_SPAN_ID"
+TRACE_DIR_ENV = "PIPELINE_TRACE_DIR"
+DEFAULT_TRACE_DIR = "traces"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_finished_spans = []
+_spans_lock = threading.Lock()
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+def get_trace_id():
+    """Return the trace ID of this run, starting a new trace if no parent process started one."""
+    if not os.getenv(TRACE_ID_ENV):
+        os.environ[TRACE_ID_ENV] = uuid.uuid4().hex
+    return os.environ[TRACE_ID_ENV]
+
+def get_trace_dir():
+    return os.getenv(TRACE_DIR_ENV, DEFAULT_TRACE_DIR)
+
+def get_spans_file(trace_id=None):
+    """The JSONL file every process of a trace appends its finished spans to."""
+    return os.path.join(get_trace_dir(), f"{trace_id or get_trace_id()}.spans.jsonl")
+
+@contextmanager
+def span(name, category="pipeline", **attributes):
+    """Time a block as a span nested under the current one. Usable as a decorator too."""
+    parent = _current_span.get()
+    record = {
+        "name": name,
+        "cat": category,
+        "trace_id": get_trace_id(),
+        "span_id": _new_id(),
+        "parent_id": parent["span_id"] if parent else os.getenv(PARENT_SPAN_ENV),
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "start": time.time(),
+        "attributes": attributes,
+    }
+    token = _current_span.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record["attributes"]["error"] = str(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        record["end"] = time.time()
+        with _spans_lock:
+            _finished_spans.append(record)
+
+def subprocess_env(env=None):
+    """Environment for a child process so its spans join this trace under the current span."""
+    env = dict(env if env is not None else os.environ)
+    env[TRACE_ID_ENV] = get_trace_id()
+    env[TRACE_DIR_ENV] = get_trace_dir()
+    current = _current_span.get()
+    if current:
+        env[PARENT_SPAN_ENV] = current["span_id"]
+    return env
+
+def traced_run(cmd, **kwargs):
+    """subprocess.run inside a span named after the program (e.g. ffmpeg); a traced child nests under it."""
+    with span(os.path.basename(cmd[0]), category="subprocess", args=" ".join(str(part) for part in cmd[1:])[:200]):
+        kwargs["env"] = subprocess_env(kwargs.get("env"))
+        return subprocess.run(cmd, **kwargs)
+
+def flush_spans():
+    """Append the spans finished in this process to the trace's spans file."""
+    with _spans_lock:
+        spans = list(_finished_spans)
+        _finished_spans.clear()
+    if not spans:
+        return
+    os.makedirs(get_trace_dir(), exist_ok=True)
+    with open(get_spans_file(spans[0]["trace_id"]), "a") as f:
+        f.write("".join(json.dumps(record, default=str) + "\n" for record in spans))
+
+# Spans of child processes reach the parent's files even when the child only imports a utility
+atexit.register(flush_spans)
+
+def load_spans(trace_id=None):
+    flush_spans()
+    spans_file = get_spans_file(trace_id)
+    if not os.path.exists(spans_file):
+        return []
+    with open(spans_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def export_chrome_trace(trace_id=None, output_file=None):
+    """Write all spans of a trace as a Chrome trace (open it in chrome://tracing or ui.perfetto.dev)."""
+    trace_id = trace_id or get_trace_id()
+    events = []
+    for record in load_spans(trace_id):
+        events.append({
+            "name": record["name"],
+            "cat": record["cat"],
+            "ph": "X",
+            "ts": int(record["start"] * 1e6),
+            "dur": int((record["end"] - record["start"]) * 1e6),
+            "pid": record["pid"],
+            "tid": record["tid"],
+            "args": dict(record["attributes"], span_id=record["span_id"], parent_id=record["parent_id"]),
+        })
+    output_file = output_file or os.path.join(get_trace_dir(), f"{trace_id}.json")
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump({"traceEvents": events, "otherData": {"trace_id": trace_id}}, f)
+    return output_file
+
+def _critical_path(record, children):
+    """Walk back from the end of a span through the children that kept it busy."""
+    path = []
+    cursor = record["end"]
+    for child in sorted(children.get(record["span_id"], []), key=lambda child: child["end"], reverse=True):
+        if child["end"] <= cursor + 1e-3:
+            path = _critical_path(child, children) + path
+            cursor = child["start"]
+    return [record] + path
+
+def _spans_of_prefix(spans, name_prefix, root_name):
+    """The spans named with name_prefix and everything below them, with the prefix dropped from their
+    names and one root of root_name spanning them all."""
+    top_ids = {record["span_id"] for record in spans if record["name"].startswith(name_prefix)}
+    selected = set(top_ids)
+    added = True
+    while added:
+        below = {record["span_id"] for record in spans if record["parent_id"] in selected} - selected
+        selected |= below
+        added = bool(below)
+    kept = [dict(record) for record in spans if record["span_id"] in selected]
+    if not kept:
+        return []
+    root = {"name": root_name, "span_id": f"{name_prefix}root", "parent_id": None,
+            "start": min(record["start"] for record in kept), "end": max(record["end"] for record in kept)}
+    for record in kept:
+        if record["span_id"] in top_ids:
+            record["name"] = record["name"][len(name_prefix):]
+            record["parent_id"] = root["span_id"]
+    return [root] + kept
+
+def summarize_trace(trace_id=None, root_name=None, min_seconds=0.1, name_prefix=None):
+    """Summarise a trace: the critical path below the root span (leaving out steps shorter than
+    min_seconds) and the total time per span name.
+
+    With name_prefix, only one pet of a batch counts: its "pet_N:" tasks and the spans below them.
+    """
+    trace_id = trace_id or get_trace_id()
+    spans = load_spans(trace_id)
+    if name_prefix:
+        spans = _spans_of_prefix(spans, name_prefix, root_name or "pipeline")
+    if not spans:
+        return None
+    span_ids = {record["span_id"] for record in spans}
+    children = {}
+    roots = []
+    for record in spans:
+        if record["parent_id"] in span_ids:
+            children.setdefault(record["parent_id"], []).append(record)
+        else:
+            roots.append(record)
+    if root_name:
+        roots = [record for record in roots if record["name"] == root_name] or roots
+    # A resumed job reuses its trace, so summarise the latest attempt
+    root = max(roots, key=lambda record: record["end"])
+
+    time_by_name = {}
+    for record in spans:
+        time_by_name[record["name"]] = time_by_name.get(record["name"], 0) + record["end"] - record["start"]
+
+    return {
+        "trace_id": trace_id,
+        "trace_file": os.path.join(get_trace_dir(), f"{trace_id}.json"),
+        "total_seconds": round(root["end"] - root["start"], 2),
+        "critical_path": [
+            {"name": record["name"], "seconds": round(record["end"] - record["start"], 2)}
+            for record in _critical_path(root, children)
+            if record["end"] - record["start"] >= min_seconds
+        ],
+        "seconds_by_span": {
+            name: round(seconds, 2)
+            for name, seconds in sorted(time_by_name.items(), key=lambda item: item[1], reverse=True)
+        },
+    }
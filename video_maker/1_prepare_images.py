@@ -9,6 +9,10 @@ import requests
 
 from GLOBAL_VARIABLES import SONG_TO_USE, SONG_PROMPT
 
+# The later video scripts find this run's storyline through the pet catalog
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities.pet_catalog_utils import get_run_id, register_artifact
+
 def is_npm_running():
     try:
         response = requests.get('http://localhost:3000/api/get_limit')
@@ -190,6 +194,7 @@ def main():
     json_filepath = os.path.join(storylines_dir, json_filename)
     with open(json_filepath, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
+    register_artifact(get_run_id(), "storyline", json_filepath)
 
     print(f"[INFO] JSON file created with image paths. Saved to {json_filepath}")
 
@@ -1,5 +1,6 @@
 import os
 import subprocess
+import sys
 import shutil
 import json
 import re
@@ -8,6 +9,11 @@ from datetime import datetime
 from PIL import Image, ExifTags, ImageFilter
 import math
 
+# ffmpeg calls are traced with the helpers in the repository's utilities package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities.trace_utils import traced_run
+from utilities.pet_catalog_utils import get_run_id, find_artifact
+
 # Import variables from GLOBAL_VARIABLES.py
 try:
     from GLOBAL_VARIABLES import SONG_TO_USE, randomize_images
@@ -103,7 +109,7 @@ def generate_video_from_images(image_paths, audio_file, output_file, display_dur
     # Create a video segment for each image
     for i, (image_file, duration) in enumerate(zip(temp_jpeg_images, display_durations)):
         image_video_path = os.path.join(temp_directory, f'image_video_{i:03d}.mp4')
-        subprocess.run([
+        traced_run([
             'ffmpeg', '-y', '-loop', '1', '-i', image_file, '-c:v', 'libx264',
             '-t', str(duration), '-pix_fmt', 'yuv420p', image_video_path
         ], check=True)
@@ -116,7 +122,7 @@ def generate_video_from_images(image_paths, audio_file, output_file, display_dur
             f.write(f"file '{video_path}'\n")
 
     concatenated_video_path = os.path.join(temp_directory, 'concatenated_video.mp4')
-    subprocess.run([
+    traced_run([
         'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', videos_list_path,
         '-c', 'copy', concatenated_video_path
     ], check=True)
@@ -132,7 +138,7 @@ def generate_video_from_images(image_paths, audio_file, output_file, display_dur
     # Combine the concatenated video with the audio, applying fade out effect
     output_file_temp = output_file + "_temp.mp4"  # Temporary output file
 
-    subprocess.run([
+    traced_run([
         'ffmpeg', '-y',
         '-i', concatenated_video_path,
         '-i', audio_file_adjusted,
@@ -157,7 +163,7 @@ def generate_video_from_images(image_paths, audio_file, output_file, display_dur
 
 def get_length(filename):
     """Get the length of an audio file using ffprobe."""
-    result = subprocess.run(
+    result = traced_run(
         ["ffprobe", "-v", "error", "-show_entries", "format=duration",
          "-of", "default=noprint_wrappers=1:nokey=1", filename],
         stdout=subprocess.PIPE,
@@ -172,7 +178,7 @@ def adjust_audio_length(audio_path, target_length):
     if current_length > target_length:
         # Trim the audio
         trimmed_audio_path = f"{os.path.splitext(audio_path)[0]}_trimmed.mp3"
-        subprocess.run([
+        traced_run([
             'ffmpeg', '-y', '-i', audio_path, '-t', str(target_length), '-c', 'copy', trimmed_audio_path
         ], check=True)
         return trimmed_audio_path
@@ -180,7 +186,7 @@ def adjust_audio_length(audio_path, target_length):
         # Loop the audio
         loop_count = int(target_length // current_length) + 1
         looped_audio_path = f"{os.path.splitext(audio_path)[0]}_looped.mp3"
-        subprocess.run([
+        traced_run([
             'ffmpeg', '-y', '-stream_loop', str(loop_count), '-i', audio_path, '-t', str(target_length),
             '-c', 'copy', looped_audio_path
         ], check=True)
@@ -196,6 +202,10 @@ def unique_filepath(filepath):
     return f"{base}_{datetime.now().strftime('%H%M%S')}{ext}"
 
 def get_latest_storyline_file(directory):
+    # The storyline of this run when run_all.py handed down a run ID, else the newest one
+    storyline_file = find_artifact(get_run_id(), "storyline")
+    if storyline_file:
+        return storyline_file
     json_files = [f for f in os.listdir(directory) if f.endswith('_manual_storyline.json')]
     if not json_files:
         return None
@@ -237,7 +247,7 @@ def apply_fade_out(audio_path, fade_duration):
     if start_time < 0:
         start_time = 0  # Ensure start time is not negative
     faded_audio_path = f"{os.path.splitext(audio_path)[0]}_faded.mp3"
-    subprocess.run([
+    traced_run([
         'ffmpeg', '-y', '-i', audio_path,
         '-af', f"afade=t=out:st={start_time}:d={fade_duration}",
         '-c:a', 'aac', '-b:a', '192k',
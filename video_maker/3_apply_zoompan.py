@@ -3,10 +3,16 @@
 
 import os
 import subprocess
+import sys
 import json
 import shutil
 from datetime import datetime
 
+# ffmpeg calls are traced with the helpers in the repository's utilities package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities.trace_utils import traced_run
+from utilities.pet_catalog_utils import get_run_id, find_artifact
+
 # Constants
 CREATED_VIDEOS_DIR = "created_videos"
 PROCESSED_VIDEOS_DIR = os.path.join(CREATED_VIDEOS_DIR, "processed")
@@ -18,6 +24,10 @@ ZOOM_PATTERN = "1 + 0.2*sin(in/25)"  # Customize the zoom pattern here
 os.makedirs(PROCESSED_VIDEOS_DIR, exist_ok=True)
 
 def get_latest_storyline_file(directory):
+    # The storyline of this run when run_all.py handed down a run ID, else the newest one
+    storyline_file = find_artifact(get_run_id(), "storyline")
+    if storyline_file:
+        return storyline_file
     json_files = [f for f in os.listdir(directory) if f.endswith('_manual_storyline.json')]
     if not json_files:
         return None
@@ -62,7 +72,7 @@ def process_video():
     video_dir = os.path.dirname(created_video_path)
 
     # Get the video dimensions using ffprobe
-    result = subprocess.run(
+    result = traced_run(
         ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
          'stream=width,height', '-of', 'csv=p=0', created_video_path],
         stdout=subprocess.PIPE,
@@ -96,7 +106,7 @@ def process_video():
         '-preset', 'fast', '-c:a', 'copy', processed_video_path
     ]
     try:
-        subprocess.run(ffmpeg_command, check=True)
+        traced_run(ffmpeg_command, check=True)
         print(f"Processed video saved as {processed_video_path}")
     except subprocess.CalledProcessError as e:
         print(f"FFmpeg processing failed: {e}")
@@ -2,9 +2,15 @@
 
 import os
 import subprocess
+import sys
 import json
 from datetime import datetime
 
+# ffmpeg calls are traced with the helpers in the repository's utilities package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities.trace_utils import traced_run
+from utilities.pet_catalog_utils import get_run_id, find_artifact
+
 # Import variables from GLOBAL_VARIABLES.py
 from GLOBAL_VARIABLES import FIRST_5_SECOND_TEXT, LAST_5_SECONDS_TEXT
 
@@ -17,6 +23,10 @@ FONT_SIZE = 48  # Adjust font size as needed
 MAX_CHARS_PER_LINE = 40  # Adjust the max characters per line as needed
 
 def get_latest_storyline_file(directory):
+    # The storyline of this run when run_all.py handed down a run ID, else the newest one
+    storyline_file = find_artifact(get_run_id(), "storyline")
+    if storyline_file:
+        return storyline_file
     json_files = [f for f in os.listdir(directory) if f.endswith('_manual_storyline.json')]
     if not json_files:
         return None
@@ -42,7 +52,7 @@ def write_json(data, file_path):
 
 def get_video_duration(input_file):
     try:
-        result = subprocess.run(
+        result = traced_run(
             [
                 'ffprobe',
                 '-v', 'error',
@@ -215,7 +225,7 @@ def process_video():
     ]
 
     try:
-        subprocess.run(ffmpeg_cmd, check=True)
+        traced_run(ffmpeg_cmd, check=True)
         print(f"[INFO] Text successfully added to {output_file}")
     except subprocess.CalledProcessError as e:
         print(f"[ERROR] An error occurred while running ffmpeg:\n{e}")
@@ -8,6 +8,14 @@ import time
 import json
 import datetime  # Correctly import the entire datetime module
 
+# The video scripts share the pipeline's tracing helpers
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utilities.trace_utils import span, subprocess_env, export_chrome_trace, summarize_trace
+from utilities.pet_catalog_utils import RUN_ID_ENV, get_run_id, new_run_id, find_artifact
+
+# The scripts of one video share a run ID, so they find this run's storyline instead of the newest one
+RUN_ID = get_run_id() or new_run_id()
+
 def run_script(script_name):
     """
     Runs a Python script using the same interpreter and captures its output.
@@ -24,14 +32,16 @@ def run_script(script_name):
     print(f"\nRunning script: {script_name}\n{'=' * 50}")
     
     try:
-        # Run the script and capture the output
-        result = subprocess.run(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            check=True
-        )
+        # Run the script and capture the output; its ffmpeg spans nest under this script's span
+        with span(script_name, category="stage"):
+            result = subprocess.run(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                check=True,
+                env=dict(subprocess_env(), **{RUN_ID_ENV: RUN_ID})
+            )
         
         # Print the script's output
         print(result.stdout)
@@ -60,13 +70,14 @@ def find_latest_json(storylines_dir):
     latest_json_filename = json_files[0]
     return os.path.join(storylines_dir, latest_json_filename)
 
-def update_json_with_runtime(json_filepath, total_runtime_seconds):
+def update_json_with_runtime(json_filepath, total_runtime_seconds, trace_summary=None):
     """
     Updates the specified JSON file by adding the 'total_script_runtime' fields.
 
     Args:
         json_filepath (str): The path to the JSON file to update.
         total_runtime_seconds (float): The total runtime in seconds.
+        trace_summary (dict): Critical path and time per span of this run, if traced.
     """
     try:
         with open(json_filepath, 'r', encoding='utf-8') as f:
@@ -79,6 +90,8 @@ def update_json_with_runtime(json_filepath, total_runtime_seconds):
     data['total_script_runtime_seconds'] = total_runtime_seconds
     # Convert seconds to a human-readable format (HH:MM:SS)
     data['total_script_runtime_human_readable'] = str(datetime.timedelta(seconds=round(total_runtime_seconds)))
+    if trace_summary:
+        data['trace_summary'] = trace_summary
 
     try:
         with open(json_filepath, 'w', encoding='utf-8') as f:
@@ -109,11 +122,17 @@ def main():
     start_time = time.time()
     
     # Run each script
-    for script in scripts_to_run:
-        success = run_script(script)
-        if not success:
-            print(f"[ERROR] Execution halted due to failure in {script}.")
-            sys.exit(1)  # Exit if any script fails
+    failed_script = None
+    with span("video", category="pipeline"):
+        for script in scripts_to_run:
+            success = run_script(script)
+            if not success:
+                failed_script = script
+                break
+    if failed_script:
+        print(f"[ERROR] Execution halted due to failure in {failed_script}.")
+        print(f"[INFO] Trace written to {export_chrome_trace()}")
+        sys.exit(1)  # Exit if any script fails
     
     # Record the end time
     end_time = time.time()
@@ -122,15 +141,16 @@ def main():
     total_runtime = end_time - start_time
     print(f"\n[INFO] All scripts executed successfully.")
     print(f"[INFO] Total runtime: {total_runtime:.2f} seconds.")
+    print(f"[INFO] Trace written to {export_chrome_trace()}")
     
     # Locate the latest JSON file in 'storylines' directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
     storylines_dir = os.path.join(script_dir, 'storylines')
-    latest_json = find_latest_json(storylines_dir)
+    latest_json = find_artifact(RUN_ID, "storyline") or find_latest_json(storylines_dir)
     
     if latest_json:
         print(f"[INFO] Latest JSON file found: {latest_json}")
-        update_json_with_runtime(latest_json, total_runtime)
+        update_json_with_runtime(latest_json, total_runtime, summarize_trace(root_name="video"))
     else:
         print(f"[WARNING] No '_manual_storyline.json' files found in {storylines_dir}. Skipping runtime update.")
     